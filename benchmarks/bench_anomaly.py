@@ -0,0 +1,107 @@
+"""
+Benchmark of the per-district anomaly scoring (src/anomaly.py) on synthetic daily counts over several years: the time
+to count the history and to score every district, then a check of the scores of the days around 29 February against
+sums of the daily counts over the real dates of every year's window.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_anomaly --districts 500 --first-year 2014 --last-year 2024
+"""
+import time
+import argparse
+import datetime
+
+import numpy as np
+import polars as pl
+
+from src.anomaly import DistrictBaseline, WINDOW_DAYS, MIN_YEARS
+
+
+def synthetic_daily(n_districts: int, first_day: datetime.date, last_day: datetime.date, seed: int = 0) -> pl.DataFrame:
+    """
+    Generates the rows of the district_daily_counts query: one row per day and district with hotspots.
+    """
+    rng = np.random.default_rng(seed)
+    days = pl.date_range(first_day, last_day, "1d", eager=True)
+    daily = pl.DataFrame({
+        "acq_date": np.repeat(days.to_numpy(), n_districts),
+        "first_adm": np.tile([f"Provinsi {i % 34}" for i in range(n_districts)], len(days)),
+        "second_adm": np.tile([f"Kabupaten {i}" for i in range(n_districts)], len(days)),
+        "n_hotspots": rng.poisson(2.0, len(days) * n_districts),
+    }).with_columns(pl.col("acq_date").cast(pl.Date))
+    return daily.filter(pl.col("n_hotspots") > 0)
+
+
+def expected_scores(daily: pl.DataFrame, day: datetime.date, years: list, window_days: int) -> dict:
+    """
+    Sums the daily counts over the real dates of the window of every year, 28 February standing for 29 February.
+
+    Returns:
+    - dict: {(first_adm, second_adm): (hotspots of the window of day, mean of the previous years)}
+    """
+    def window_sum(year: int) -> pl.DataFrame:
+        try:
+            last = day.replace(year=year)
+        except ValueError:
+            last = datetime.date(year, 2, 28)
+        return (daily.filter(pl.col("acq_date").is_between(last - datetime.timedelta(days=window_days - 1), last))
+                .group_by(["first_adm", "second_adm"]).agg(pl.col("n_hotspots").sum()))
+
+    previous = [year for year in years if year < day.year]
+    current = {(p, d): n for p, d, n in window_sum(day.year).iter_rows()}
+    history = {}
+    for year in previous:
+        for p, d, n in window_sum(year).iter_rows():
+            history[(p, d)] = history.get((p, d), 0) + n
+
+    return {key: (current.get(key, 0), history.get(key, 0) / len(previous)) for key in set(current) | set(history)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--districts", type=int, default=500)
+    parser.add_argument("--first-year", type=int, default=2014)
+    parser.add_argument("--last-year", type=int, default=2024, help="a leap year, for the check around 29 February")
+    args = parser.parse_args()
+
+    first_day, last_day = datetime.date(args.first_year, 1, 1), datetime.date(args.last_year, 12, 31)
+    daily = synthetic_daily(args.districts, first_day, last_day)
+    print(f"rows={daily.height:,} districts={args.districts:,} years={args.first_year}-{args.last_year}")
+
+    baseline = DistrictBaseline()
+    start = time.perf_counter()
+    for year in range(args.first_year, args.last_year + 1):
+        baseline.update(daily.filter(pl.col("acq_date").dt.year() == year), datetime.date(year, 1, 1),
+                        datetime.date(year, 12, 31))
+    print(f"{'count the history':<22}{time.perf_counter() - start:>8.2f} s")
+
+    days = pl.date_range(datetime.date(args.last_year, 1, 1), last_day, "1d", eager=True).to_list()
+    start = time.perf_counter()
+    for day in days:
+        baseline.score(day)
+    print(f"{'score every day':<22}{(time.perf_counter() - start) * 1000 / len(days):>8.2f} ms per day")
+
+    # every day from a week before 29 February to a week after its window must keep all the previous years
+    n_years = args.last_year - args.first_year
+    mismatches, checked = [], 0
+    day = datetime.date(args.last_year, 2, 22)
+    while day <= datetime.date(args.last_year, 3, 8):
+        scores = baseline.score(day)
+        expected = expected_scores(daily, day, baseline.years, WINDOW_DAYS)
+        if (scores["n_years"] != n_years).any():
+            mismatches.append(f"{day}: n_years={scores['n_years'].unique().to_list()}, {n_years} expected")
+        for p, d, n_hotspots, mean in scores.select("first_adm", "second_adm", "n_hotspots", "baseline_mean").iter_rows():
+            n_expected, mean_expected = expected.get((p, d), (0, 0.0))
+            if n_hotspots != n_expected or (n_years >= MIN_YEARS
+                                               and (mean is None or not np.isclose(mean, mean_expected, atol=0.01))):
+                mismatches.append(f"{day} {d}: {n_hotspots}, {mean} scored, {n_expected}, {mean_expected:.2f} expected")
+                break
+        checked += 1
+        day += datetime.timedelta(days=1)
+
+    for mismatch in mismatches[:10]:
+        print(f"MISMATCH {mismatch}")
+    print(f"{'leap day check':<22}{len(mismatches)} mismatches over {checked} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Benchmark of the fire event clustering (src/clustering.py) over a synthetic season of detections, clustered in one go
+and incrementally, one daily ETL batch at a time.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_clustering --events 20000 --days 120
+"""
+import time
+import argparse
+
+from src.clustering import FireEventClusterer, cluster_detections
+from benchmarks.synthetic import season_detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--eps-km", type=float, default=1.0)
+    parser.add_argument("--eps-hours", type=float, default=24.0)
+    parser.add_argument("--min-samples", type=int, default=1)
+    args = parser.parse_args()
+    params = dict(eps_km=args.eps_km, eps_hours=args.eps_hours, min_samples=args.min_samples)
+
+    detections = season_detections(args.events, args.days)
+    print(f"detections={detections.height:,} events generated={args.events:,} days={args.days}")
+
+    start = time.perf_counter()
+    clustered = cluster_detections(detections, **params)
+    print(f"{'one batch':<22}{time.perf_counter() - start:>8.2f} s  events found={clustered['event_id'].n_unique():,}")
+
+    clusterer = FireEventClusterer(**params)
+    batch_times = []
+    start = time.perf_counter()
+    for _, batch in detections.group_by("acq_date", maintain_order=True):
+        batch_start = time.perf_counter()
+        clusterer.add_batch(batch)
+        batch_times.append(time.perf_counter() - batch_start)
+
+    print(f"{'daily batches':<22}{time.perf_counter() - start:>8.2f} s  events found={clusterer.events().height:,}")
+    print(f"{'slowest daily batch':<22}{max(batch_times):>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Latency of the named queries of src/queries.py with each database driver (adbc, psycopg, connectorx), against a
+local Postgres.
+
+With --load, the target database is filled first with synthetic data (benchmarks/synthetic.py): processed_viirs
+through the migrations, a season of detections; articles, air_quality_idn and idn_gsod with the columns the
+dashboard reads. The tables are replaced: never point --uri at the production database.
+
+For each query and driver, the report has the first call (connection and statement preparation included) and the
+median of the --repeat calls after it.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_drivers --uri postgresql://postgres@localhost/bench --load
+    python -m benchmarks.bench_drivers --uri postgresql://postgres@localhost/bench --drivers adbc psycopg --output drivers.json
+"""
+import io
+import json
+import time
+import argparse
+import statistics
+
+import polars as pl
+
+from src.migrate import migrate, ensure_partitions
+from src.geohash import prefix_ranges
+from src.queries import QUERIES, DRIVERS, fetch_query, close_connections
+from src.procedures import parse_aqms, cleaning_aqms_data, cleaning_articles
+from benchmarks.synthetic import aqms_geojson, fetched_articles, daily_max_temperature
+from benchmarks.bench_queries import season_table, VIEWPORT
+
+TABLES = {
+    "articles": """
+        CREATE TABLE articles (
+            keywords TEXT, title TEXT, article_text TEXT, url TEXT, image TEXT, publisher TEXT,
+            published_time TIMESTAMPTZ, published_date DATE
+        )""",
+    "air_quality_idn": """
+        CREATE TABLE air_quality_idn (
+            lat_sensor TEXT, lon_sensor TEXT, address TEXT, city TEXT, province TEXT, air_quality_index SMALLINT,
+            category TEXT, updated_at TIMESTAMP, fetched_date DATE
+        )""",
+    "idn_gsod": "CREATE TABLE idn_gsod (date DATE, max_temp_c DOUBLE PRECISION)",
+}
+
+_ranges = prefix_ranges(*VIEWPORT)
+
+# (case, query name, parameters)
+CASES = [
+    ("density_map_7", "density_map", dict(n_day=7)),
+    ("density_map_15", "density_map", dict(n_day=15)),
+    ("density_map_30", "density_map", dict(n_day=30)),
+    ("viewport_7", "viewport", dict(n_day=7, lows=",".join(low for low, _ in _ranges),
+                                    highs=",".join(high or "~" for _, high in _ranges), west=VIEWPORT[0],
+                                    south=VIEWPORT[1], east=VIEWPORT[2], north=VIEWPORT[3])),
+    ("tile_window_30", "tile_window", dict(n_day=30)),
+    ("processed_viirs_version", "processed_viirs_version", {}),
+    ("latest_articles", "latest_articles", dict(n_day=2)),
+    ("latest_air_quality", "latest_air_quality", {}),
+    ("daily_max_temperature", "daily_max_temperature", {}),
+    ("idn_gsod_version", "idn_gsod_version", {}),
+]
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def _copy(cursor, table: str, df: pl.DataFrame):
+    buffer = io.BytesIO()
+    df.write_csv(buffer)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, HEADER true)", buffer)
+
+
+def load(uri: str, n_events: int, days: int):
+    """
+    Replaces the tables of the dashboard queries with synthetic data.
+    """
+    import psycopg2
+
+    if migrate(uri) is None:
+        raise RuntimeError("The migrations failed")
+
+    season = season_table(n_events, days)
+    articles = cleaning_articles(fetched_articles(500)).with_columns(pl.col("published_time").dt.replace_time_zone("UTC"))
+    air_quality = cleaning_aqms_data(parse_aqms(aqms_geojson(1000))).with_columns(pl.col("category").cast(pl.Utf8))
+    temperature = pl.from_pandas(daily_max_temperature(3 * 365)).with_columns(pl.col("date").cast(pl.Date))
+
+    connection = psycopg2.connect(uri)
+    with connection.cursor() as cursor:
+        cursor.execute("TRUNCATE processed_viirs")
+        ensure_partitions(cursor, season["acq_date"].min(), season["acq_date"].max())
+        _copy(cursor, "processed_viirs", season)
+
+        for table, ddl in TABLES.items():
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(ddl)
+        _copy(cursor, "articles", articles)
+        _copy(cursor, "air_quality_idn", air_quality)
+        _copy(cursor, "idn_gsod", temperature)
+    connection.commit()
+
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        for table in ["processed_viirs", *TABLES]:
+            cursor.execute(f"VACUUM ANALYZE {table}")
+    connection.close()
+
+    print(f"Loaded {season.height:,} detections, {articles.height} articles, {air_quality.height} AQMS readings "
+          f"and {temperature.height} GSOD days")
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def measure(driver: str, name: str, params: dict, uri: str, repeat: int) -> dict:
+    """
+    Times the first call of a query on a fresh connection, then the following ones.
+    """
+    close_connections()
+
+    start = time.perf_counter()
+    result = fetch_query(name, uri, driver=driver, **params)
+    first = (time.perf_counter() - start) * 1000
+
+    if result is None:
+        return None
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fetch_query(name, uri, driver=driver, **params)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {"rows": result.height, "first_ms": round(first, 3), "median_ms": round(statistics.median(timings), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", required=True, help="a local scratch Postgres database")
+    parser.add_argument("--load", action="store_true", help="replace the tables with synthetic data first")
+    parser.add_argument("--events", type=int, default=15_000, help="fire events of the synthetic season")
+    parser.add_argument("--days", type=int, default=183, help="length of the season, in days")
+    parser.add_argument("--drivers", nargs="+", choices=DRIVERS, default=list(DRIVERS))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="where the JSON report is written")
+    args = parser.parse_args()
+
+    if args.load:
+        load(args.uri, args.events, args.days)
+
+    results = {case: {driver: measure(driver, name, params, args.uri, args.repeat) for driver in args.drivers}
+               for case, name, params in CASES if name in QUERIES}
+    close_connections()
+
+    print(f"\n{'query':<26}{'rows':>9}" + "".join(f"{driver + ' first':>18}{driver + ' warm':>17}"
+                                               for driver in args.drivers))
+    for case, by_driver in results.items():
+        rows = next((result["rows"] for result in by_driver.values() if result), 0)
+        line = f"{case:<26}{rows:>9,}"
+        for driver in args.drivers:
+            result = by_driver[driver]
+            line += f"{result['first_ms']:>15.2f} ms{result['median_ms']:>14.2f} ms" if result else f"{'failed':>35}"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+End-to-end throughput of the ETL extract and transform stages (FIRMS, SIPONGI AQMS, Google News articles), replayed
+from an HTTP archive (src/http_archive.py) instead of the live services, so that slow runs can be reproduced and
+profiled offline.
+
+An archive is first recorded, either from the live services (TOKEN is read from ./.env) or from the synthetic
+stand-in of benchmarks/synthetic.py, then replayed with a chosen latency:
+
+    python -m benchmarks.bench_etl record ./.http-archive/etl.jsonl.gz
+    python -m benchmarks.bench_etl record ./.http-archive/synthetic.jsonl.gz --synthetic --rows 50000
+    python -m benchmarks.bench_etl replay ./.http-archive/etl.jsonl.gz --latency recorded
+    python -m benchmarks.bench_etl replay ./.http-archive/etl.jsonl.gz --latency 0 --profile etl.prof
+
+The date and the row counts of the recorded run are kept next to the archive (<archive>.json), so that the replayed
+run asks for the same URLs. A replay exits with 1 if it differs from its recording: a request missing from the
+archive, a recording never served, or a step whose row count changed.
+"""
+import sys
+import json
+import time
+import argparse
+import datetime
+import cProfile
+
+from src.procedures import (fetch_viirs_data, load_administrative_boundaries, extract_administrative,
+                            cleaning_fetched_data, fetch_air_quality_data, cleaning_aqms_data, fetch_articles,
+                            cleaning_articles)
+from src.dedup import MinHashIndex, dedup_articles
+from src.geotag import geotag_articles
+from src.summarize import StubBackend, MemoryStore, summarize_articles
+from src.metrics import write_summary
+from src.http_archive import HttpArchive, REDACTED, GNEWS_DATES, archive_summary
+
+KEYWORDS = ["kebakaran hutan", "karhutla", "kabut asap"]
+
+
+def run_etl(today: str, day_range: str, token: str, max_results: int, pause: float) -> dict:
+    """
+    Runs the extract and transform stages of the three sources, timing each step.
+
+    Returns:
+    - dict: {step: {"seconds": float, "rows": int}}
+    """
+    steps = {}
+
+    def step(name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        rows = len(result) if result is not None else 0
+        steps[name] = {"seconds": round(time.perf_counter() - start, 3), "rows": rows}
+        return result
+
+    boundaries = step("load_administrative_boundaries", load_administrative_boundaries)
+
+    viirs = step("fetch_viirs_data", fetch_viirs_data, today, day_range, token)
+    if viirs is not None:
+        joined = step("extract_administrative", extract_administrative, viirs, adm_df=boundaries)
+        step("cleaning_fetched_data", cleaning_fetched_data, joined)
+
+    aqms = step("fetch_air_quality_data", fetch_air_quality_data)
+    if aqms is not None:
+        step("cleaning_aqms_data", cleaning_aqms_data, aqms)
+
+    articles = step("fetch_articles", fetch_articles, KEYWORDS, max_results, int(day_range), pause=pause)
+    if articles is not None and not articles.empty:
+        cleaned = step("cleaning_articles", cleaning_articles, articles)
+        if cleaned is not None:
+            # a new index, so that every replay drops the same duplicates
+            stories = step("dedup_articles", dedup_articles, cleaned, MinHashIndex())
+            tagged = step("geotag_articles", geotag_articles, stories)
+            # the local stand-in of the model, so that a replay makes no paid call
+            step("summarize_articles", summarize_articles, tagged, StubBackend(), MemoryStore())
+
+    return steps
+
+
+def replay_problems(archive: HttpArchive, recorded_rows: dict, steps: dict) -> list:
+    """
+    Compares a replayed run with its recording.
+
+    Parameters:
+    - archive (HttpArchive): The archive the run was replayed from.
+    - recorded_rows (dict): {step: rows} of the recorded run.
+    - steps (dict): The steps of the replayed run, as returned by run_etl.
+
+    Returns:
+    - list: The differences, as messages. Empty if the replay went as recorded.
+    """
+    problems = [f"not in the archive: {method} {url}" for method, url in dict.fromkeys(archive.misses)]
+    problems += [f"never served: {method} {url} ({unused} of its recordings)" for method, url, unused in archive.unused()]
+
+    for name, rows in recorded_rows.items():
+        replayed = steps.get(name, {}).get("rows")
+        if replayed != rows:
+            problems.append(f"{name}: {replayed} rows replayed, {rows} recorded")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("archive")
+    parser.add_argument("--day-range", default="1")
+    parser.add_argument("--max-results", type=int, default=20)
+    parser.add_argument("--synthetic", action="store_true", help="record from the synthetic stand-in")
+    parser.add_argument("--rows", type=int, default=10_000, help="hotspots of the synthetic FIRMS csv")
+    parser.add_argument("--stations", type=int, default=200, help="sensors of the synthetic AQMS GeoJSON")
+    parser.add_argument("--latency", default="0", help='seconds per replayed response, or "recorded"')
+    parser.add_argument("--profile", help="write a cProfile of the replayed run to this file")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    meta_path = f"{args.archive}.json"
+
+    if args.mode == "record":
+        today = datetime.date.today().isoformat()
+        responder, token = None, None
+
+        if args.synthetic:
+            from benchmarks.synthetic import http_responder
+            responder, token = http_responder(args.rows, args.stations, args.max_results), REDACTED
+        else:
+            from dotenv import dotenv_values
+            token = dotenv_values("./.env").get("TOKEN")
+
+        with HttpArchive(args.archive, mode="record", secrets=[token], ignore=[GNEWS_DATES], responder=responder):
+            steps = run_etl(today, args.day_range, token, args.max_results, pause=0 if args.synthetic else 1)
+
+        with open(meta_path, "w") as f:
+            json.dump({"today": today, "day_range": args.day_range, "max_results": args.max_results,
+                       "rows": {name: step["rows"] for name, step in steps.items()}}, f)
+
+        for host, stats in archive_summary(args.archive).items():
+            print(f"{host:<40}{stats['requests']:>6} requests{stats['bytes'] / 1024:>10.0f} KB{stats['seconds']:>9.2f} s")
+
+        problems = []
+
+    else:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        latency = args.latency if args.latency == "recorded" else float(args.latency)
+
+        profiler = cProfile.Profile() if args.profile else None
+        with HttpArchive(args.archive, mode="replay", latency=latency, ignore=[GNEWS_DATES]) as archive:
+            if profiler:
+                profiler.enable()
+            steps = run_etl(meta["today"], meta["day_range"], REDACTED, meta["max_results"], pause=0)
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+
+        if "rows" not in meta:
+            print(f"{meta_path} has no row counts (recorded by an older version), only the requests are checked")
+        problems = replay_problems(archive, meta.get("rows", {}), steps)
+
+    total = sum(step["seconds"] for step in steps.values())
+    for name, step in steps.items():
+        print(f"{name:<34}{step['seconds']:>9.3f} s{step['rows']:>10,} rows")
+    print(f"{'total':<34}{total:>9.3f} s")
+
+    if args.metrics_json:
+        write_summary(args.metrics_json)
+
+    for problem in problems:
+        print(f"REPLAY MISMATCH {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Microbenchmark of the per-callback server CPU spent building the dashboard charts.
+
+Compares the previous plotly.express based chart functions (kept below as reference) with the cached figure
+factory in src/figures.py, on synthetic hotspots shaped like the processed_viirs query of generate_density_map.
+Also reports the size of the initial density map figure, which now only carries the latest day.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_figures --rows 20000 --days 7 --repeat 5
+"""
+import io
+import time
+import json
+import argparse
+
+import pandas as pd
+import polars as pl
+import plotly.io
+import plotly.express as px
+import plotly.graph_objects as go
+
+from src.procedures import build_density_map, generate_line_chart, generate_top_prov, generate_top_kabkot
+from benchmarks.synthetic import processed_hotspots
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Chart functions as they were before the figure factory, kept for comparison only.
+def legacy_density_map(processed_viirs: pl.DataFrame):
+    df_viirs = processed_viirs.to_pandas()
+    df_viirs.sort_values(by=["acq_date"], ascending=True, inplace=True)
+    df_viirs = df_viirs.rename(columns={"frp":"Fire Radiative Power", "second_adm": "District", "first_adm":"Province",
+                                    "acq_date":"Date", "confidence":"Confidence", "brightness":"Brightness"})
+    df_viirs["Date"] = df_viirs["Date"].astype(str)
+
+    hover_dict = {"latitude":False, "longitude":False, "Date":True, "acq_time":False,
+                "Confidence":True,"Fire Radiative Power":True, "District":True,
+                "Province":False, "Brightness":True}
+
+    map_fig = px.density_mapbox(df_viirs, lat="latitude", lon="longitude", z="Fire Radiative Power",
+                                radius=3, hover_name="Province", hover_data=hover_dict,
+                                center=dict(lat=-2.5, lon=118), zoom=3.6, color_continuous_scale="matter_r",
+                                mapbox_style="carto-positron", template="plotly_dark", animation_frame="Date")
+    map_fig.update_layout(autosize=True)
+    map_fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    map_fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
+    map_fig.update_coloraxes(showscale=True, colorbar=dict(len=0.3, title="Fire Radiative Power", thickness=10, orientation="h", y=0, x=0.15, title_side="top"))
+
+    last_frame_num = int(len(map_fig.frames) -1)
+    map_fig.layout['sliders'][0]['active'] = last_frame_num
+    map_fig = go.Figure(data=map_fig['frames'][last_frame_num]['data'], frames=map_fig['frames'], layout=map_fig.layout)
+    map_fig["layout"].pop("updatemenus")
+    map_fig.update_layout(sliders=[dict(pad={"r":50, "l":10, "t":0})])
+
+    return map_fig, df_viirs.to_json(date_format='iso', orient='split')
+
+
+def legacy_line_chart(data: json):
+    dff = pd.read_json(io.StringIO(data), orient='split')
+    fires_count = dff['Fire Radiative Power'].count()
+    confidence_count = dff["Confidence"][dff["Confidence"]=="High"].count()
+    dff.index = pd.DatetimeIndex(dff["Date"])
+    dff = dff.resample('D')['Fire Radiative Power'].count()
+
+    fig = px.area(dff, x=dff.index, y=dff.values,
+            labels={"y":"<b>Titik Api Terdeteksi</b>", "Date":""}, template="plotly_dark")
+    fig.update_layout(autosize=True)
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    fig.update_traces(line_color='indianred')
+    fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
+    fig.update_yaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
+    fig.update_layout(xaxis_showgrid=True, yaxis_showgrid=False)
+
+    return fig, f"{fires_count:,}", f"{confidence_count:,}"
+
+
+def legacy_top_bar(data: json, column: str):
+    dff = pd.read_json(io.StringIO(data), orient='split')
+    grouped = dff.groupby([column]).agg(total_fires = ("Fire Radiative Power", "count"))
+    grouped = grouped.sort_values(by="total_fires", ascending=False).reset_index().head(5)
+
+    fig = px.bar(grouped, x="total_fires", y=column, orientation="h", text="total_fires",
+                    labels={column:"", "total_fires":"<b>Titik Api Terdeteksi</b>"}, template="plotly_dark")
+    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    fig.update_layout(autosize=True)
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    fig.update_traces(marker_color='indianred')
+    fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
+    fig.update_xaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
+    fig.update_layout(xaxis_showgrid=False, yaxis_showgrid=False)
+
+    return fig
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def cpu_time(func, repeat: int) -> float:
+    """
+    Returns the best per-call process CPU time of func, in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        timings.append(time.process_time() - start)
+
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    processed_viirs = processed_hotspots(args.rows, args.days)
+    _, data, _ = build_density_map(processed_viirs)
+
+    # warm the cached layouts, so the timings show the steady state of a running server
+    generate_top_prov(data)
+    generate_line_chart(data)
+
+    cases = [
+        ("density_map", lambda: legacy_density_map(processed_viirs), lambda: build_density_map(processed_viirs)),
+        ("line_chart", lambda: legacy_line_chart(data), lambda: generate_line_chart(data, patch=True)),
+        ("top_prov", lambda: legacy_top_bar(data, "Province"), lambda: generate_top_prov(data, patch=True)),
+        ("top_kabkot", lambda: legacy_top_bar(data, "District"), lambda: generate_top_kabkot(data, patch=True)),
+    ]
+
+    print(f"rows={args.rows:,} days={args.days} (best of {args.repeat}, CPU ms per callback)")
+    print(f"{'chart':<12}{'before':>10}{'after':>10}{'speedup':>10}")
+    for name, before, after in cases:
+        before_ms = cpu_time(before, args.repeat)
+        after_ms = cpu_time(after, args.repeat)
+        print(f"{name:<12}{before_ms:>10.1f}{after_ms:>10.1f}{before_ms / after_ms:>9.1f}x")
+
+    # initial payload of the density map sent to the browser
+    before_kb = len(legacy_density_map(processed_viirs)[0].to_json()) / 1024
+    after_kb = len(plotly.io.to_json(build_density_map(processed_viirs)[0])) / 1024
+    print(f"{'map payload':<12}{before_kb:>9.0f}K{after_kb:>9.0f}K{before_kb / after_kb:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
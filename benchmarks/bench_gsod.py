@@ -0,0 +1,95 @@
+"""
+Benchmark of the GSOD ingestion, comparing the pandas steps of notebooks/build-enviromental-viz.ipynb with the
+Polars lazy pipeline of src/gsod.py on a multi-year archive.
+
+The archive is built by repeating data/GSOD-Jan_to_Sept.csv over several years (one file per year, as NOAA
+exports them), written to a temporary directory.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_gsod --years 10 --repeat 3
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import pandas as pd
+import polars as pl
+
+from src.gsod import scan_gsod, national_daily, station_daily
+
+SAMPLE_PATH = "./data/GSOD-Jan_to_Sept.csv"
+
+
+def write_archive(directory: str, years: int) -> list:
+    sample = pl.read_csv(SAMPLE_PATH, infer_schema_length=0)
+    paths = []
+
+    for shift in range(years):
+        year = 2023 - shift
+        path = os.path.join(directory, f"gsod_{year}.csv")
+        sample.with_columns(pl.lit(str(year)) + pl.col("DATE").str.slice(4)).write_csv(path, quote_style="always")
+        paths.append(path)
+
+    return paths
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def notebook_pipeline(paths: list) -> pd.DataFrame:
+    # the steps of build-enviromental-viz.ipynb, kept for comparison only
+    df = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    df = df[["STATION", "NAME", "LATITUDE", "LONGITUDE", "DATE", "MAX", "TEMP", "VISIB", "WDSP", "PRCP"]]
+    df.columns = ["station_id", "station_name", "latitude", "longitude", "date", "max_temp_f", "temperature_f", "visibility", "wind_speed", "precipitation"]
+    df = df[df["station_name"].str.contains(", ID")].reset_index(drop=True)
+
+    def fahrenheit_to_celsius(f):
+        return round((f - 32) * 5/9, 2)
+
+    df['max_temp_c'] = df['max_temp_f'].apply(fahrenheit_to_celsius)
+    df['date'] = pd.to_datetime(df['date'])
+    df.set_index('date', inplace=True)
+
+    daily_statistics_gsod = df.resample('D').agg({
+        'max_temp_c': ['median', 'mean', 'max'],
+        'precipitation': 'mean',
+        'visibility': 'mean',
+        'wind_speed': 'mean'
+    }).reset_index()
+
+    return daily_statistics_gsod
+
+
+def lazy_pipeline(paths: list):
+    readings = scan_gsod(paths).collect().lazy()
+    return national_daily(readings).collect(), station_daily(readings).collect()
+
+
+def wall_time(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_archive(directory, args.years)
+        rows = sum(1 for path in paths for _ in open(path)) - len(paths)
+
+        before_ms = wall_time(lambda: notebook_pipeline(paths), args.repeat)
+        after_ms = wall_time(lambda: lazy_pipeline(paths), args.repeat)
+
+    print(f"years={args.years} rows={rows:,} (best of {args.repeat}, wall ms)")
+    print(f"{'notebook (pandas)':<28}{before_ms:>10.1f}")
+    print(f"{'src.gsod (polars lazy)':<28}{after_ms:>10.1f}{before_ms / after_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
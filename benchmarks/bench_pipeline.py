@@ -0,0 +1,259 @@
+"""
+Benchmark suite of the ETL steps and of the dashboard chart functions, on synthetic inputs (benchmarks/synthetic.py)
+at several sizes. The timings are written as a JSON report; given the report of a previous run, the cases that got
+slower than the threshold are listed and the exit code is 1, so that regressions are caught before deploying.
+
+Suites:
+    firms     extract_administrative, cleaning_fetched_data and enrich_weather on hotspots in the FIRMS API layout
+    aqms      parse_aqms and cleaning_aqms_data on a SIPONGI GeoJSON response
+    news      newspaper parsing of article pages, cleaning_articles, dedup_articles (into an empty index),
+              geotag_articles and summarize_articles (StubBackend, into an empty cache)
+    charts    the generate_* chart functions on the processed_viirs query (build_density_map stands for
+              generate_density_map, which only adds the database query)
+    calendar  generate_calendar on the idn_gsod query
+
+Usage (from the repository root):
+    python -m benchmarks.bench_pipeline --output baseline.json
+    python -m benchmarks.bench_pipeline --baseline baseline.json --output current.json --threshold 1.25
+    python -m benchmarks.bench_pipeline --suites charts --quick
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import itertools
+import statistics
+import subprocess
+
+import pandas as pd
+import polars as pl
+
+from src.procedures import (load_administrative_boundaries, extract_administrative, cleaning_fetched_data, parse_aqms,
+                            cleaning_aqms_data, cleaning_articles, build_density_map, generate_density_frame,
+                            generate_line_chart, generate_top_prov, generate_top_kabkot, generate_calendar)
+from src.weather import StationIndex, enrich_weather
+from src.dedup import MinHashIndex, dedup_articles
+from src.geotag import geotag_articles
+from src.summarize import StubBackend, MemoryStore, summarize_articles
+from benchmarks.synthetic import (firms_hotspots, processed_hotspots, aqms_geojson, article_pages, fetched_articles,
+                                  daily_max_temperature, station_readings)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Each suite builds its inputs for a size and returns its cases as (name, func, setup). setup, when given, is called
+# before every run outside of the timing (e.g. to copy a DataFrame the function modifies in place), and its result is
+# passed to func.
+def firms_cases(rows: int, context: dict) -> list:
+    # read once for all the sizes, as the ETL should
+    if "boundaries" not in context:
+        context["boundaries"] = load_administrative_boundaries()
+        context["stations"] = StationIndex(station_readings(days=7))
+    boundaries, stations = context["boundaries"], context["stations"]
+    raw = firms_hotspots(rows)
+    joined = extract_administrative(raw, adm_df=boundaries)
+    cleaned = cleaning_fetched_data(joined.copy())
+
+    return [
+        ("extract_administrative", lambda _: extract_administrative(raw, adm_df=boundaries), None),
+        ("cleaning_fetched_data", cleaning_fetched_data, joined.copy),
+        ("enrich_weather", lambda _: enrich_weather(cleaned, stations), None),
+    ]
+
+
+def aqms_cases(stations: int, context: dict) -> list:
+    aqms_json = aqms_geojson(stations)
+    parsed = parse_aqms(aqms_json)
+
+    return [
+        ("parse_aqms", lambda _: parse_aqms(aqms_json), None),
+        ("cleaning_aqms_data", lambda _: cleaning_aqms_data(parsed), None),
+    ]
+
+
+def _parse_pages(pages: list) -> list:
+    # the parsing half of fetch_articles, without the download
+    from newspaper import Article
+
+    texts = []
+    for url, html in pages:
+        article = Article(url, language="id")
+        article.download(input_html=html)
+        article.parse()
+        texts.append(article.text)
+
+    return texts
+
+
+def news_cases(n_articles: int, context: dict) -> list:
+    pages = article_pages(n_articles)
+    articles = fetched_articles(n_articles)
+    cleaned = cleaning_articles(articles.copy())
+
+    return [
+        ("parse_article_pages", lambda _: _parse_pages(pages), None),
+        ("cleaning_articles", cleaning_articles, articles.copy),
+        ("dedup_articles", lambda index: dedup_articles(cleaned, index), MinHashIndex),
+        ("geotag_articles", lambda _: geotag_articles(cleaned), None),
+        ("summarize_articles", lambda store: summarize_articles(cleaned, StubBackend(), store), MemoryStore),
+    ]
+
+
+def chart_cases(rows: int, context: dict) -> list:
+    processed_viirs = processed_hotspots(rows)
+    _, data, dates = build_density_map(processed_viirs, key="bench")
+    fresh_keys = itertools.count()
+
+    return [
+        ("build_density_map", lambda _: build_density_map(processed_viirs, key="bench"), None),
+        ("generate_density_frame", lambda _: generate_density_frame("bench", dates[0]), None),
+        # a key never stored, so that every run parses and splits the window again (another worker's window)
+        ("generate_density_frame_from_json", lambda key: generate_density_frame(key, dates[0], data),
+         lambda: f"from-json-{next(fresh_keys)}"),
+        ("generate_line_chart", lambda _: generate_line_chart(data, patch=True), None),
+        ("generate_top_prov", lambda _: generate_top_prov(data, patch=True), None),
+        ("generate_top_kabkot", lambda _: generate_top_kabkot(data, patch=True), None),
+    ]
+
+
+def calendar_cases(days: int, context: dict) -> list:
+    max_temperature = daily_max_temperature(days)
+
+    return [
+        ("generate_calendar", lambda _: generate_calendar(max_temperature), None),
+    ]
+
+
+# suite name: (sizes, cases)
+SUITES = {
+    "firms": ([1_000, 10_000, 100_000], firms_cases),
+    "aqms": ([100, 1_000, 10_000], aqms_cases),
+    "news": ([10, 100, 500], news_cases),
+    "charts": ([1_000, 10_000, 100_000], chart_cases),
+    "calendar": ([90, 365, 1_825], calendar_cases),
+}
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def measure(func, setup, repeat: int) -> dict:
+    """
+    Runs func once to warm it up, then repeat more times.
+
+    Returns:
+    - dict: The best and median wall time and the best process CPU time of a run, in milliseconds.
+    """
+    # the functions of src.procedures print their errors and return None, which must not pass for a fast run
+    if func(setup() if setup else None) is None:
+        raise RuntimeError("the benchmarked function returned None")
+
+    walls, cpus = [], []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        func(argument)
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+
+    return {"best_ms": round(min(walls) * 1000, 3), "median_ms": round(statistics.median(walls) * 1000, 3),
+            "cpu_ms": round(min(cpus) * 1000, 3)}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "polars": pl.__version__, "pandas": pd.__version__}
+
+
+def run(suites: list, repeat: int, quick: bool = False) -> dict:
+    """
+    Runs the suites and returns the report.
+
+    Parameters:
+    - suites (list): Names of the suites to run, keys of SUITES.
+    - repeat (int): Timed runs per case.
+    - quick (bool): Only run the smallest size of each suite.
+
+    Returns:
+    - dict: The report, with the environment and one result per suite, case and size.
+    """
+    report = {"created_at": datetime.datetime.now().isoformat(timespec="seconds"), "environment": environment(),
+              "repeat": repeat, "results": []}
+    context = {}
+
+    for suite in suites:
+        sizes, make_cases = SUITES[suite]
+        for size in sizes[:1] if quick else sizes:
+            for case, func, setup in make_cases(size, context):
+                result = dict(suite=suite, case=case, size=size, **measure(func, setup, repeat))
+                report["results"].append(result)
+                print(f"{suite:<10}{case:<36}{size:>9,}{result['best_ms']:>12.1f} ms{result['cpu_ms']:>12.1f} ms cpu")
+
+    return report
+
+
+def compare(report: dict, baseline: dict, threshold: float, min_ms: float = 1.0) -> list:
+    """
+    Compares the best wall times of a report with the ones of a previous report.
+
+    Parameters:
+    - report (dict): The report of this run.
+    - baseline (dict): The report to compare with.
+    - threshold (float): Slowdown ratio above which a case is a regression, e.g. 1.25.
+    - min_ms (float): Cases faster than this in both reports are too noisy to be reported.
+
+    Returns:
+    - list: (suite, case, size, baseline ms, current ms, ratio) of the regressed cases.
+    """
+    previous = {(r["suite"], r["case"], r["size"]): r["best_ms"] for r in baseline["results"]}
+    regressions = []
+
+    for r in report["results"]:
+        before = previous.get((r["suite"], r["case"], r["size"]))
+        if before is None or before <= 0:
+            continue
+
+        ratio = r["best_ms"] / before
+        r["baseline_ms"], r["ratio"] = before, round(ratio, 3)
+        if ratio > threshold and r["best_ms"] >= min_ms:
+            regressions.append((r["suite"], r["case"], r["size"], before, r["best_ms"], ratio))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", nargs="+", choices=list(SUITES), default=list(SUITES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="only the smallest size of each suite")
+    parser.add_argument("--output", help="where the JSON report is written")
+    parser.add_argument("--baseline", help="a previous JSON report to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    report = run(args.suites, args.repeat, quick=args.quick)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        report["baseline"] = {"created_at": baseline.get("created_at"), "environment": baseline.get("environment"),
+                              "threshold": args.threshold}
+
+        for suite, case, size, before, after, ratio in regressions:
+            print(f"REGRESSION {suite}/{case} size={size:,}: {before:.1f} ms -> {after:.1f} ms ({ratio:.2f}x)")
+        print(f"{len(regressions)} regression(s) above {args.threshold}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
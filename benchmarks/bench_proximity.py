@@ -0,0 +1,53 @@
+"""
+Benchmark of the hotspot to AQMS sensor proximity join (src/proximity.py): a synthetic season of detections against
+synthetic sensors, checked against a brute-force haversine count on a sample of the sensors.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_proximity --events 15000 --days 183 --sensors 500
+"""
+import time
+import argparse
+
+import numpy as np
+
+from src.proximity import fire_pressure, EARTH_RADIUS_KM, PRESSURE_RADII_KM
+from src.procedures import parse_aqms, cleaning_aqms_data
+from benchmarks.synthetic import season_detections, aqms_geojson
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=15_000)
+    parser.add_argument("--days", type=int, default=183)
+    parser.add_argument("--sensors", type=int, default=500)
+    parser.add_argument("--check", type=int, default=20, help="sensors checked against the brute-force count")
+    args = parser.parse_args()
+
+    hotspots = season_detections(args.events, args.days)
+    aqms = cleaning_aqms_data(parse_aqms(aqms_geojson(args.sensors)))
+    print(f"detections={hotspots.height:,} sensors={aqms.height:,} radii={PRESSURE_RADII_KM}")
+
+    start = time.perf_counter()
+    pressure = fire_pressure(aqms, hotspots)
+    print(f"{'fire pressure':<22}{time.perf_counter() - start:>8.2f} s  rows={pressure.height:,} "
+          f"most hotspots within {max(PRESSURE_RADII_KM):.0f} km of a sensor={pressure['n_hotspots'].max():,}")
+
+    latitude, longitude = hotspots["latitude"].to_numpy(), hotspots["longitude"].to_numpy()
+    frp = np.nan_to_num(hotspots["frp"].to_numpy())
+    mismatches = 0
+    for row in pressure.filter(pressure["address"].is_in(pressure["address"].unique().head(args.check))).iter_rows(named=True):
+        distance = haversine_km(float(row["lat_sensor"]), float(row["lon_sensor"]), latitude, longitude)
+        within = distance <= row["radius_km"]
+        if within.sum() != row["n_hotspots"] or not np.isclose(frp[within].sum(), row["frp_sum"], atol=0.01):
+            mismatches += 1
+    print(f"{'brute-force check':<22}{mismatches} mismatches over {args.check} sensors")
+
+
+if __name__ == "__main__":
+    main()
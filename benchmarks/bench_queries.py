@@ -0,0 +1,258 @@
+"""
+The dashboard queries of processed_viirs on a season of synthetic detections (benchmarks/synthetic.py), against a
+local Postgres, on two copies of the table:
+
+    plain        the table as write_database(if_exists="append") creates it: a heap without any index
+    partitioned  the table of the migrations (./migrations): monthly partitions on acq_date, BRIN on acq_date,
+                 B-tree on (first_adm, second_adm, acq_date), GiST on point(longitude, latitude), B-tree on
+                 (geohash, acq_date)
+
+Each copy lives in its own schema of the target database (bench_plain and bench_partitioned), dropped at the end
+unless --keep is given. Never point --uri at the production database.
+
+For each query, the report has the median time of --repeat runs as seen by the client, and the execution time,
+shared buffers (hit + read) and relations scanned of one EXPLAIN ANALYZE.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_queries --uri postgresql://postgres@localhost/bench
+    python -m benchmarks.bench_queries --uri postgresql://postgres@localhost/bench --events 30000 --output queries.json
+"""
+import io
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+import polars as pl
+
+from src.migrate import apply_migrations, ensure_partitions
+from src.geohash import encode as encode_geohash, prefix_ranges
+from benchmarks.synthetic import season_detections, PROVINCES, DISTRICTS
+
+SCHEMAS = ["bench_plain", "bench_partitioned"]
+
+PLAIN_TABLE = """
+    CREATE TABLE processed_viirs (
+        latitude DOUBLE PRECISION, longitude DOUBLE PRECISION, brightness REAL, acq_date DATE, acq_time INTEGER,
+        satellite TEXT, instrument TEXT, confidence TEXT, version TEXT, frp REAL, daynight TEXT, second_adm TEXT,
+        first_adm TEXT, geohash TEXT
+    )"""
+
+DENSITY_MAP = """
+    SELECT latitude, longitude, acq_date, acq_time, confidence, frp, brightness, second_adm, first_adm
+    FROM processed_viirs
+    WHERE acq_date > CURRENT_DATE - INTERVAL '{n_day} day'"""
+
+# A map viewport of one degree over Riau (west, south, east, north)
+VIEWPORT = (101.0, 0.0, 102.0, 1.0)
+
+# The queries of the dashboard (generate_density_map for each timeframe, the data version of src/cache.py and the
+# hotspot window of src/tiles.py), and the province, district and bounding box lookups the indexes are meant for
+QUERIES = {
+    "density_map_7": (DENSITY_MAP.format(n_day=7), None),
+    "density_map_15": (DENSITY_MAP.format(n_day=15), None),
+    "density_map_30": (DENSITY_MAP.format(n_day=30), None),
+    "data_version": ("""
+        SELECT MAX(acq_date) AS last_date, COUNT(*) AS n_rows
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - 31""", None),
+    "tile_window_30": ("""
+        SELECT latitude, longitude, acq_date, frp, confidence, second_adm, first_adm
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - INTERVAL '30 day'""", None),
+    "province_30": ("""
+        SELECT acq_date, COUNT(*) AS hotspots, SUM(frp) AS frp
+        FROM processed_viirs
+        WHERE first_adm = %s AND acq_date > CURRENT_DATE - INTERVAL '30 day'
+        GROUP BY acq_date""", (PROVINCES[0],)),
+    "district_season": ("""
+        SELECT acq_date, COUNT(*) AS hotspots, SUM(frp) AS frp
+        FROM processed_viirs
+        WHERE first_adm = %s AND second_adm = %s
+        GROUP BY acq_date""", (PROVINCES[0], DISTRICTS[0])),
+    "viewport_7": ("""
+        SELECT latitude, longitude, acq_date, frp
+        FROM processed_viirs
+        WHERE point(longitude, latitude) <@ box(point(%s, %s), point(%s, %s))
+          AND acq_date > CURRENT_DATE - INTERVAL '7 day'""", VIEWPORT),
+}
+
+# The same viewport, as generate_viewport_frame reads it: geohash ranges, then the exact bounding box
+QUERIES["viewport_geohash_7"] = ("""
+    SELECT latitude, longitude, acq_date, frp
+    FROM processed_viirs
+    WHERE acq_date > CURRENT_DATE - INTERVAL '7 day'
+      AND (""" + " OR ".join("(geohash >= %s AND geohash < %s)" if high else "(geohash >= %s)"
+                             for _, high in prefix_ranges(*VIEWPORT)) + """)
+      AND longitude BETWEEN %s AND %s AND latitude BETWEEN %s AND %s""",
+    tuple(bound for pair in prefix_ranges(*VIEWPORT) for bound in pair if bound is not None)
+    + (VIEWPORT[0], VIEWPORT[2], VIEWPORT[1], VIEWPORT[3]))
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def season_table(n_events: int, days: int, seed: int = 0) -> pl.DataFrame:
+    """
+    Generates a season of detections with all the columns of processed_viirs, ending yesterday.
+
+    Returns:
+    - pl.DataFrame: The detections, sorted by date as the daily loads append them.
+    """
+    rng = np.random.default_rng(seed)
+    detections = season_detections(n_events, days, seed=seed)
+    rows = detections.height
+
+    return detections.with_columns(
+        pl.lit("N").alias("satellite"),
+        pl.lit("VIIRS").alias("instrument"),
+        pl.Series("confidence", rng.choice(["Nominal", "High", "Low"], rows, p=[0.8, 0.1, 0.1])),
+        pl.lit("2.0NRT").alias("version"),
+        pl.Series("daynight", np.where(detections["acq_time"].to_numpy() < 1200, "Day", "Night")),
+        pl.Series("second_adm", rng.choice(DISTRICTS, rows)),
+        pl.Series("first_adm", rng.choice(PROVINCES, rows)),
+        pl.Series("geohash", encode_geohash(detections["latitude"].to_numpy(), detections["longitude"].to_numpy())),
+    ).select(["latitude", "longitude", "brightness", "acq_date", "acq_time", "satellite", "instrument", "confidence",
+              "version", "frp", "daynight", "second_adm", "first_adm", "geohash"])
+
+
+def connect(uri: str, schema: str):
+    import psycopg2
+    return psycopg2.connect(uri, options=f"-c search_path={schema}")
+
+
+def create_schemas(uri: str, season: pl.DataFrame):
+    """
+    Creates both copies of processed_viirs and loads the season into them with COPY.
+    """
+    buffer = io.BytesIO()
+    season.write_csv(buffer)
+    columns = ", ".join(season.columns)
+
+    for schema in SCHEMAS:
+        connection = connect(uri, schema)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {schema}")
+        connection.commit()
+
+        if schema == "bench_plain":
+            with connection.cursor() as cursor:
+                cursor.execute(PLAIN_TABLE)
+            connection.commit()
+        else:
+            apply_migrations(connection)
+
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            if schema == "bench_partitioned":
+                ensure_partitions(cursor, season["acq_date"].min(), season["acq_date"].max())
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY processed_viirs ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)", buffer)
+        connection.commit()
+
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE processed_viirs")
+        connection.close()
+
+        print(f"Loaded {season.height:,} rows into {schema} in {time.perf_counter() - start:.1f} s")
+
+
+def drop_schemas(uri: str):
+    connection = connect(uri, "public")
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        for schema in SCHEMAS:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    connection.close()
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def _plan_relations(plan: dict) -> set:
+    relations = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", []):
+        relations |= _plan_relations(child)
+    return relations
+
+
+def measure(cursor, query: str, params: tuple, repeat: int) -> dict:
+    """
+    Times a query as the client sees it (execution and transfer of the rows), then explains it.
+    """
+    cursor.execute(query, params)
+    n_rows = len(cursor.fetchall())
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+    explained = cursor.fetchone()[0][0]
+    plan = explained["Plan"]
+
+    return {
+        "rows": n_rows,
+        "median_ms": round(statistics.median(timings), 3),
+        "execution_ms": round(explained["Execution Time"], 3),
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+        "relations": len(_plan_relations(plan)),
+    }
+
+
+def run(uri: str, repeat: int) -> dict:
+    results = {}
+
+    for schema in SCHEMAS:
+        connection = connect(uri, schema)
+        with connection.cursor() as cursor:
+            # with the partitions and their indexes
+            cursor.execute("SELECT COALESCE((SELECT SUM(pg_total_relation_size(relid)) "
+                           "FROM pg_partition_tree('processed_viirs')), pg_total_relation_size('processed_viirs'))")
+            size = cursor.fetchone()[0]
+
+            results[schema] = {"size_mb": round(size / 2**20, 1),
+                               "queries": {name: measure(cursor, query, params, repeat)
+                                           for name, (query, params) in QUERIES.items()}}
+        connection.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", required=True, help="a local scratch Postgres database")
+    parser.add_argument("--events", type=int, default=15_000, help="fire events of the synthetic season")
+    parser.add_argument("--days", type=int, default=183, help="length of the season, in days")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the bench schemas after the run")
+    parser.add_argument("--output", help="where the JSON report is written")
+    args = parser.parse_args()
+
+    season = season_table(args.events, args.days)
+    create_schemas(args.uri, season)
+
+    try:
+        results = run(args.uri, args.repeat)
+    finally:
+        if not args.keep:
+            drop_schemas(args.uri)
+
+    plain, partitioned = results["bench_plain"], results["bench_partitioned"]
+    print(f"\n{season.height:,} detections over {args.days} days; table and indexes: "
+          f"{plain['size_mb']} MB plain, {partitioned['size_mb']} MB partitioned\n")
+    print(f"{'query':<18}{'rows':>9}{'plain ms':>11}{'part. ms':>11}{'speedup':>9}{'plain buf':>11}{'part. buf':>11}"
+          f"{'relations':>11}")
+    for name in QUERIES:
+        before, after = plain["queries"][name], partitioned["queries"][name]
+        print(f"{name:<18}{after['rows']:>9,}{before['median_ms']:>11.2f}{after['median_ms']:>11.2f}"
+              f"{before['median_ms'] / after['median_ms']:>8.1f}x{before['buffers']:>11,}{after['buffers']:>11,}"
+              f"{after['relations']:>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": season.height, "days": args.days, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
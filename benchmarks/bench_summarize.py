@@ -0,0 +1,52 @@
+"""
+Benchmark of the article summarization stage (src/summarize.py) with the local StubBackend, offline: the throughput
+at several concurrencies for a simulated model latency, then a second run of the same articles, which must be served
+from the cache without a call, and a run with a small token budget.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_summarize --articles 200 --latency 0.5 --concurrency 1 4 16
+"""
+import time
+import argparse
+
+import polars as pl
+
+from src.procedures import cleaning_articles
+from src.summarize import StubBackend, MemoryStore, summarize_articles, estimate_tokens, MAX_OUTPUT_TOKENS
+from benchmarks.synthetic import fetched_articles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per call of the stub model")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    articles = cleaning_articles(fetched_articles(args.articles))
+    # every text twice, as the same article fetched by two keywords
+    articles = pl.concat([articles, articles])
+    print(f"articles={articles.height:,} distinct texts={articles['article_text'].n_unique():,} "
+          f"latency={args.latency} s")
+
+    for concurrency in args.concurrency:
+        backend, store = StubBackend(latency=args.latency), MemoryStore()
+        start = time.perf_counter()
+        summarized = summarize_articles(articles, backend, store, concurrency=concurrency, token_budget=10 ** 9)
+        seconds = time.perf_counter() - start
+        print(f"{f'concurrency {concurrency}':<22}{seconds:>8.2f} s  {backend.calls / seconds:>7.1f} calls/s  "
+              f"calls={backend.calls:,} summarized={summarized['summary'].is_not_null().sum():,}")
+
+        start = time.perf_counter()
+        summarize_articles(articles, backend, store, concurrency=concurrency, token_budget=10 ** 9)
+        print(f"{'  cached':<22}{time.perf_counter() - start:>8.2f} s  new calls={backend.calls - len(store.summaries):,}")
+
+    budget = sum(estimate_tokens(text) + MAX_OUTPUT_TOKENS for text in articles["article_text"].unique().head(10))
+    backend = StubBackend()
+    summarized = summarize_articles(articles, backend, MemoryStore(), token_budget=budget)
+    print(f"{'budget of ~10 articles':<22}calls={backend.calls:,} "
+          f"summarized={summarized['summary'].is_not_null().sum():,}")
+
+
+if __name__ == "__main__":
+    main()
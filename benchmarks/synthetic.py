@@ -0,0 +1,366 @@
+"""
+Synthetic inputs for the benchmarks, shaped like the data the ETL and the dashboard work with.
+"""
+import json
+import datetime
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+# Fire-prone areas the synthetic fires are drawn around: (latitude, longitude, spread in degrees, weight)
+FIRE_REGIONS = [
+    (-3.0, 104.5, 1.2, 0.30),   # South Sumatra peatlands
+    (0.5, 101.5, 1.0, 0.15),    # Riau
+    (-1.6, 103.6, 0.8, 0.10),   # Jambi
+    (-2.2, 113.9, 1.5, 0.25),   # Central Kalimantan
+    (-0.5, 109.5, 1.2, 0.10),   # West Kalimantan
+    (-9.5, 121.0, 1.5, 0.10),   # East Nusa Tenggara
+]
+
+# VIIRS overpasses over Indonesia, as HHMM (UTC)
+OVERPASS_TIMES = np.array([527, 545, 604, 1745, 1803, 1821], dtype=np.int32)
+
+# Size of a VIIRS I-band pixel, in degrees (~375 m): one overpass detects a pixel at most once
+PIXEL_DEG = 0.00337
+
+
+def _draw_in_regions(rng: np.random.Generator, n: int) -> tuple:
+    # n points scattered around FIRE_REGIONS, each region drawn with its weight
+    regions = np.array([region[:3] for region in FIRE_REGIONS])
+    weights = np.array([region[3] for region in FIRE_REGIONS])
+    region = rng.choice(len(regions), n, p=weights / weights.sum())
+
+    latitude = regions[region, 0] + rng.normal(0, regions[region, 2])
+    longitude = regions[region, 1] + rng.normal(0, regions[region, 2])
+
+    return latitude, longitude
+
+
+def season_detections(n_events: int, days: int, start: datetime.date = None, seed: int = 0) -> pl.DataFrame:
+    """
+    Generates a season of VIIRS detections grouped into fire events: each event burns for a few days around a point
+    drawn in one of FIRE_REGIONS, spreading a little every day.
+
+    Parameters:
+    - n_events (int): Number of fire events.
+    - days (int): Length of the season, in days.
+    - start (datetime.date): First day of the season. Defaults to `days` days ago.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - pl.DataFrame: Detections with latitude, longitude, acq_date, acq_time, frp and brightness, sorted by date.
+    """
+    rng = np.random.default_rng(seed)
+    start = start or datetime.date.today() - datetime.timedelta(days=days)
+
+    center_lat, center_lon = _draw_in_regions(rng, n_events)
+    first_day = rng.integers(0, days, n_events)
+    duration = rng.integers(1, 8, n_events)
+    daily = rng.integers(1, 30, n_events)
+
+    # one row per event and burning day, then one row per detection of that day
+    event_day = np.repeat(np.arange(n_events), duration)
+    day_offset = np.concatenate([np.arange(d) for d in duration])
+    per_day = rng.poisson(daily[event_day]) + 1
+
+    event = np.repeat(event_day, per_day)
+    offset = np.repeat(day_offset, per_day)
+    n = len(event)
+
+    # the burning front widens with the days, detections snap to the pixel grid
+    spread = PIXEL_DEG * (1 + offset)
+    day = np.minimum(first_day[event] + offset, days - 1)
+    latitude = np.round((center_lat[event] + rng.normal(0, spread)) / PIXEL_DEG) * PIXEL_DEG
+    longitude = np.round((center_lon[event] + rng.normal(0, spread)) / PIXEL_DEG) * PIXEL_DEG
+
+    return pl.DataFrame({
+        "latitude": latitude,
+        "longitude": longitude,
+        "acq_date": pl.Series([start + datetime.timedelta(days=int(d)) for d in range(days)])[day],
+        "acq_time": rng.choice(OVERPASS_TIMES, n),
+        "frp": rng.gamma(1.5, 4.0, n).astype(np.float32),
+        "brightness": rng.uniform(300.0, 367.0, n).astype(np.float32),
+    }).unique(subset=["latitude", "longitude", "acq_date", "acq_time"], maintain_order=True).sort("acq_date")
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+PROVINCES = [f"Provinsi {i}" for i in range(34)]
+DISTRICTS = [f"Kabupaten {i}" for i in range(514)]
+
+
+def _days_back(rng: np.random.Generator, rows: int, days: int) -> list:
+    today = datetime.date.today()
+    return [today - datetime.timedelta(days=int(d)) for d in rng.integers(0, days, rows)]
+
+
+def firms_hotspots(rows: int, days: int = 7, seed: int = 0) -> pl.DataFrame:
+    """
+    Generates hotspots in the layout of the FIRMS country API (VIIRS_SNPP_NRT), as read by fetch_viirs_data.
+
+    Parameters:
+    - rows (int): Number of hotspots.
+    - days (int): Number of days back the hotspots are spread over.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - pl.DataFrame: Hotspots with the columns and types of the API csv.
+    """
+    rng = np.random.default_rng(seed)
+    latitude, longitude = _draw_in_regions(rng, rows)
+    acq_time = rng.choice(OVERPASS_TIMES, rows)
+
+    return pl.DataFrame({
+        "country_id": ["IDN"] * rows,
+        "latitude": np.round(latitude, 5),
+        "longitude": np.round(longitude, 5),
+        "bright_ti4": np.round(rng.uniform(300.0, 367.0, rows), 2),
+        "scan": np.round(rng.uniform(0.32, 0.8, rows), 2),
+        "track": np.round(rng.uniform(0.36, 0.78, rows), 2),
+        "acq_date": [day.isoformat() for day in _days_back(rng, rows, days)],
+        "acq_time": acq_time.astype(np.int64),
+        "satellite": ["N"] * rows,
+        "instrument": ["VIIRS"] * rows,
+        "confidence": rng.choice(["n", "h", "l"], rows, p=[0.8, 0.1, 0.1]),
+        "version": ["2.0NRT"] * rows,
+        "bright_ti5": np.round(rng.uniform(280.0, 310.0, rows), 2),
+        "frp": np.round(rng.gamma(1.5, 4.0, rows), 2),
+        "daynight": np.where(acq_time < 1200, "D", "N"),
+    })
+
+
+def processed_hotspots(rows: int, days: int = 7, seed: int = 0) -> pl.DataFrame:
+    """
+    Generates hotspots shaped like the processed_viirs query of generate_density_map.
+
+    Parameters:
+    - rows (int): Number of hotspots.
+    - days (int): Number of days back the hotspots are spread over.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - pl.DataFrame: Hotspots with the columns of processed_viirs read by the dashboard.
+    """
+    rng = np.random.default_rng(seed)
+    latitude, longitude = _draw_in_regions(rng, rows)
+
+    return pl.DataFrame({
+        "latitude": latitude,
+        "longitude": longitude,
+        "acq_date": _days_back(rng, rows, days),
+        "acq_time": rng.choice(OVERPASS_TIMES, rows),
+        "confidence": rng.choice(["Nominal", "High", "Low"], rows, p=[0.8, 0.1, 0.1]),
+        "frp": rng.gamma(1.5, 4.0, rows).astype(np.float32),
+        "brightness": rng.uniform(300.0, 367.0, rows).astype(np.float32),
+        "second_adm": rng.choice(DISTRICTS, rows),
+        "first_adm": rng.choice(PROVINCES, rows),
+    })
+
+
+def daily_max_temperature(days: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generates the idn_gsod query of the calendar heatmap (date, max_temp_c), most recent day first.
+    """
+    rng = np.random.default_rng(seed)
+    today = datetime.date.today()
+
+    return pd.DataFrame({
+        "date": pd.to_datetime([today - datetime.timedelta(days=d) for d in range(days)]),
+        "max_temp_c": np.round(rng.normal(33.0, 1.5, days), 2),
+    })
+
+
+def station_readings(stations: int = 90, days: int = 30, seed: int = 0) -> pl.DataFrame:
+    """
+    Generates idn_gsod_stations rows (src/gsod.py.station_daily) for the last days, as read by src/weather.py.
+    About 3% of the station days have no reading.
+    """
+    rng = np.random.default_rng(seed)
+    latitude, longitude = _draw_in_regions(rng, stations)
+    today = datetime.date.today()
+    dates = [today - datetime.timedelta(days=d) for d in range(days)]
+    rows = stations * days
+
+    return pl.DataFrame({
+        "station_id": [f"9{i:05d}99999" for i in range(stations)] * days,
+        "latitude": np.tile(np.round(latitude, 4), days),
+        "longitude": np.tile(np.round(longitude, 4), days),
+        "date": [day for day in dates for _ in range(stations)],
+        "max_temp_c": np.round(rng.normal(32.0, 1.8, rows), 2),
+        "precipitation": np.round(rng.exponential(0.2, rows), 2),
+        "wind_speed": np.round(rng.gamma(3.0, 1.5, rows), 1),
+    }).filter(pl.Series(rng.random(rows) >= 0.03))
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+AQMS_CATEGORIES = [("BAIK", 0, 50), ("SEDANG", 51, 100), ("TIDAK SEHAT", 101, 199), ("SANGAT TIDAK SEHAT", 200, 299),
+                   ("BERBAHAYA", 300, 500)]
+
+
+def aqms_geojson(stations: int, seed: int = 0) -> dict:
+    """
+    Generates a response of the SIPONGI AQMS endpoint, as decoded from JSON by fetch_air_quality_data.
+
+    Parameters:
+    - stations (int): Number of sensors.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - dict: A GeoJSON FeatureCollection with one Point feature per sensor. About 2% of the sensors have no reading.
+    """
+    rng = np.random.default_rng(seed)
+    latitude, longitude = _draw_in_regions(rng, stations)
+    values = np.clip(rng.gamma(2.0, 30.0, stations), 0, 500).astype(int)
+    missing = rng.random(stations) < 0.02
+    updated_at = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    features = []
+    for i in range(stations):
+        category = next(name for name, low, high in AQMS_CATEGORIES if values[i] <= high)
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(float(longitude[i]), 6), round(float(latitude[i]), 6)]},
+            "properties": {
+                "alamat": f"Jl. Stasiun Pemantau No. {i}",
+                "kota": f"KOTA {DISTRICTS[i % len(DISTRICTS)].upper()}",
+                "provinsi": PROVINCES[i % len(PROVINCES)].upper(),
+                "nilai": None if missing[i] else int(values[i]),
+                "cat": category,
+                "waktu": (updated_at - datetime.timedelta(hours=int(i % 3))).strftime("%Y-%m-%d %H:%M:%S"),
+            },
+        })
+
+    return {"type": "FeatureCollection", "features": features}
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+NEWS_KEYWORDS = ["kebakaran hutan", "karhutla", "kabut asap"]
+NEWS_WORDS = ("kebakaran hutan dan lahan titik api gambut asap warga petugas pemadam BPBD Manggala Agni satgas "
+              "kabupaten provinsi hektare helikopter water bombing kualitas udara ISPU sekolah diliburkan hujan "
+              "buatan kemarau panjang El Nino Riau Jambi Sumatera Selatan Kalimantan Tengah Barat lokasi desa "
+              "api berhasil dipadamkan luas lahan terbakar menurut keterangan kepala dinas").split()
+
+
+def _paragraph(rng: np.random.Generator, sentences: int) -> str:
+    words = rng.choice(NEWS_WORDS, (sentences, 14))
+    return " ".join(" ".join(sentence).capitalize() + "." for sentence in words)
+
+
+def article_pages(n_articles: int, paragraphs: int = 8, seed: int = 0) -> list:
+    """
+    Generates news article pages as served by the publishers, for the newspaper parsing step of fetch_articles.
+
+    Parameters:
+    - n_articles (int): Number of pages.
+    - paragraphs (int): Paragraphs of body text per page.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - list: (url, html) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    pages = []
+
+    for i in range(n_articles):
+        url = f"https://berita{i % 20}.example.co.id/read/{100000 + i}/karhutla"
+        title = _paragraph(rng, 1).rstrip(".")
+        body = "\n".join(f"<p>{_paragraph(rng, 4)}</p>" for _ in range(paragraphs))
+        html = (f"<html><head><title>{title}</title>"
+                f'<meta property="og:image" content="https://berita{i % 20}.example.co.id/img/{i}.jpg">'
+                f"</head><body><nav><a href='/'>Beranda</a><a href='/nasional'>Nasional</a></nav>"
+                f"<article><h1>{title}</h1>{body}</article>"
+                f"<footer>Hak cipta dilindungi undang-undang.</footer></body></html>")
+        pages.append((url, html))
+
+    return pages
+
+
+def fetched_articles(n_articles: int, paragraphs: int = 8, seed: int = 0) -> pd.DataFrame:
+    """
+    Generates the DataFrame returned by fetch_articles (GNews results with the parsed article text), the input of
+    cleaning_articles. About 5% of the articles carry the download failure marker.
+
+    Parameters:
+    - n_articles (int): Number of articles.
+    - paragraphs (int): Paragraphs of body text per article.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - pd.DataFrame: The articles, in the layout of fetch_articles.
+    """
+    rng = np.random.default_rng(seed)
+    now = datetime.datetime.utcnow()
+    rows = []
+
+    for i in range(n_articles):
+        publisher = f"Berita {i % 20}"
+        failed = rng.random() < 0.05
+        text = "Error: article download failed" if failed else "\n\n".join(_paragraph(rng, 4) for _ in range(paragraphs))
+        published = now - datetime.timedelta(minutes=int(rng.integers(0, 7 * 24 * 60)))
+        rows.append({
+            "publisher": {"href": f"https://berita{i % 20}.example.co.id", "title": publisher},
+            "title": f"{_paragraph(rng, 1).rstrip('.')} - {publisher}",
+            "description": _paragraph(rng, 1),
+            "published date": published.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            "url": f"https://berita{i % 20}.example.co.id/read/{100000 + i}/karhutla",
+            "article_text": text,
+            "image": None if failed else f"https://berita{i % 20}.example.co.id/img/{i}.jpg",
+            "keywords": NEWS_KEYWORDS[i % len(NEWS_KEYWORDS)],
+        })
+
+    return pd.DataFrame(rows)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def _news_feed(pages: list, titles: list) -> str:
+    items = []
+    now = datetime.datetime.utcnow()
+
+    for i, ((url, _), title) in enumerate(zip(pages, titles)):
+        site = url.split("/read/")[0]
+        published = (now - datetime.timedelta(hours=i)).strftime("%a, %d %b %Y %H:%M:%S GMT")
+        items.append(f"<item><title>{title}</title><link>{url}</link><guid>{url}</guid><pubDate>{published}</pubDate>"
+                     f"<description>{title}</description><source url=\"{site}\">{site.split('//')[1]}</source></item>")
+
+    return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Google News</title>'
+            + "".join(items) + "</channel></rss>")
+
+
+def http_responder(rows: int = 10_000, stations: int = 200, articles_per_feed: int = 20, seed: int = 0):
+    """
+    Builds a stand-in for the services the ETL calls, to record an HTTP archive (src/http_archive.py) without the
+    network: the FIRMS country csv, the SIPONGI AQMS GeoJSON, the Google News RSS feeds and the publisher pages.
+    Any other request is answered with a 404.
+
+    Parameters:
+    - rows (int): Hotspots in the FIRMS csv.
+    - stations (int): Sensors in the AQMS GeoJSON.
+    - articles_per_feed (int): Items in each Google News feed, each one linking to its own article page.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - callable: responder(method, url) -> (status, headers, body), for HttpArchive(mode="record", responder=...).
+    """
+    firms_csv = firms_hotspots(rows, seed=seed).write_csv().encode()
+    aqms_body = json.dumps(aqms_geojson(stations, seed=seed)).encode()
+    pages = {}
+    feeds = []
+
+    def respond(method: str, url: str):
+        if "firms.modaps.eosdis.nasa.gov" in url:
+            return 200, {"Content-Type": "text/csv"}, firms_csv
+
+        if "sipongi.menlhk.go.id" in url:
+            return 200, {"Content-Type": "application/json"}, aqms_body
+
+        if "news.google.com/rss" in url:
+            # every query gets its own articles
+            feed_pages = article_pages(articles_per_feed, seed=seed + len(feeds) + 1)
+            feed_pages = [(page_url.replace("/read/", f"/read/{len(feeds)}-"), html) for page_url, html in feed_pages]
+            pages.update(feed_pages)
+            feeds.append(url)
+            titles = [html.split("<title>")[1].split("</title>")[0] for _, html in feed_pages]
+            return 200, {"Content-Type": "application/rss+xml; charset=UTF-8"}, _news_feed(feed_pages, titles).encode()
+
+        if url in pages:
+            return 200, {"Content-Type": "text/html; charset=UTF-8"}, pages[url].encode()
+
+        return 404, {"Content-Type": "text/plain"}, b"Not Found"
+
+    return respond
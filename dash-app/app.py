@@ -1,24 +1,180 @@
 # Import Packages ------------------------------------------------------
+import os
+import gzip
 import datetime
+import functools
+from urllib.parse import urljoin
 import dash
-from dash import dcc, html
+from dash import dcc, html, no_update
 from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
 
-from src.procedures import generate_density_map, fetch_last_data, generate_line_chart, generate_top_prov, generate_top_kabkot, generate_calendar
+from src.procedures import generate_density_map, generate_viewport_frame, generate_density_frame, generate_line_chart, generate_top_prov, generate_top_kabkot, generate_choropleth, render_calendar, cached_chart_aggregates
+from src.figures import base_figure, with_tile_layers, relayout_bounds, choropleth_level_patch
+from src.boundaries import boundary_file, boundary_level
+from src.cache import RenderCache, TileCache, fetch_data_version
+from src.jobs import job_manager
+from src.tiles import valid_tile, get_tile
+from src.metrics import REGISTRY
+from src.queries import fetch_query
+from src.export import ExportRequest, ExportSpool
+from src.api import API_DAYS, AGGREGATES, TOP_N, api_etag, api_body
 
 from dotenv import dotenv_values
+from flask import Response, jsonify, request, abort, send_file, stream_with_context
 
 config = dotenv_values("./.env")
 CONNECTION_URI = config.get("CONNECTION_URI")
 
+# Long callbacks run as background jobs, shared by identical requests until the hotspots are updated
+background_callback_manager = job_manager(
+    cache_by=[lambda: fetch_data_version("processed_viirs", uri_connection=CONNECTION_URI)]
+)
+
 # Instantiate Dash App ------------------------------------------------------
 app = dash.Dash(__name__, 
                 external_stylesheets=[dbc.themes.DARKLY], 
+                background_callback_manager=background_callback_manager,
                 title="Kabar Api",
                 meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1", 'charSet':'“UTF-8”'}])
 server = app.server
 
+# Rendered components that only change when new rows are loaded (memory + disk)
+render_cache = RenderCache()
+
+
+# Metrics of this worker, scraped by Prometheus
+@server.route("/metrics")
+def metrics():
+    return Response(REGISTRY.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
+@server.route("/metrics.json")
+def metrics_summary():
+    return jsonify(REGISTRY.summary())
+
+
+# Vector tiles of the hotspots (?days=N) and of the administrative boundaries, cached on disk per data version
+tile_cache = TileCache()
+# the timeframes of the dashboard: every other value would keep its own window, shared frame and tiles
+TILE_DAYS = (7, 15, 30)
+
+
+@server.route("/tiles/<int:z>/<int:x>/<int:y>.pbf")
+def tiles(z, x, y):
+    n_day = request.args.get("days", type=int)
+    if not valid_tile(z, x, y) or (n_day is not None and n_day not in TILE_DAYS):
+        abort(404)
+
+    tile = get_tile(z, x, y, n_day=n_day, uri_connection=CONNECTION_URI, cache=tile_cache)
+    if tile is None:
+        abort(503)
+
+    response = Response(tile, mimetype="application/vnd.mapbox-vector-tile")
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
+
+# Simplified boundaries of the choropleth (src/boundaries.py), one file per layer and level of detail
+@functools.lru_cache(maxsize=32)
+def _gzipped(path, mtime):
+    with open(path, "rb") as f:
+        return gzip.compress(f.read(), compresslevel=9)
+
+
+@server.route("/boundaries/<layer>-<level>.<fmt>")
+def boundaries(layer, level, fmt):
+    try:
+        path = boundary_file(layer, level, fmt)
+    except ValueError:
+        abort(404)
+
+    mimetype = "application/geo+json" if fmt == "geojson" else "application/json"
+    if "gzip" not in request.headers.get("Accept-Encoding", ""):
+        with open(path, "rb") as f:
+            response = Response(f.read(), mimetype=mimetype)
+    else:
+        response = Response(_gzipped(path, os.path.getmtime(path)), mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return response
+
+
+# Exports of the hotspots for the analysts (src/export.py), e.g.
+#     /export/hotspots.csv?start=2023-09-01&end=2023-09-30&province=Riau&compression=zstd
+# streamed while written to disk the first time, then served from that file, with Range requests, until the next load.
+# zstd compression of the csv and arrow exports needs zstandard.
+export_spool = ExportSpool()
+
+
+@server.route("/export/hotspots.<fmt>")
+def export_hotspots(fmt):
+    try:
+        export = ExportRequest.from_args(fmt, request.args)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    version = fetch_data_version("processed_viirs", uri_connection=CONNECTION_URI)
+    if version is None:
+        abort(503)
+    etag = f"{export.key}-{version}"
+
+    path = export_spool.get(export, version)
+    if path is not None:
+        response = send_file(path, mimetype=export.mimetype, as_attachment=True, download_name=export.filename,
+                             etag=etag, conditional=True)
+        response.headers["Accept-Ranges"] = "bytes"
+    elif request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        # until the file is written, a Range request gets the whole stream: it is never made before answering
+        response = Response(stream_with_context(export_spool.stream(export, version, CONNECTION_URI)),
+                            mimetype=export.mimetype)
+        response.headers["Content-Disposition"] = f'attachment; filename="{export.filename}"'
+        response.headers["Accept-Ranges"] = "none"
+        response.set_etag(etag)
+
+    response.headers["Cache-Control"] = "private, max-age=300"
+    return response
+
+
+# Read API of the aggregates shown by the dashboard (src/api.py), revalidated with ETags: 304 until the next load
+API_MAX_LIMIT = 1000
+
+
+@server.route("/api/v1/hotspots/<aggregate>")
+def api_hotspots(aggregate):
+    n_day = request.args.get("days", default=7, type=int)
+    # limit=0 lists all the regions
+    limit = request.args.get("limit", default=TOP_N, type=int)
+    if aggregate not in AGGREGATES:
+        abort(404)
+    if n_day not in API_DAYS or not 0 <= limit <= API_MAX_LIMIT:
+        abort(400, description=f"days must be one of {API_DAYS} and limit within 0 to {API_MAX_LIMIT}")
+    limit = None if aggregate == "daily" or limit == 0 else limit
+
+    version = fetch_data_version("processed_viirs", uri_connection=CONNECTION_URI)
+    if version is None:
+        abort(503)
+    etag = api_etag(aggregate, n_day, limit, version)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = api_body(aggregate, n_day, limit, version, CONNECTION_URI)
+        if body is None:
+            abort(503)
+        response = Response(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    # cached, but revalidated on every use
+    response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
 
 # DASHBOARD COMPONENTS ------------------------------------------------------
 # Navigation
@@ -72,8 +228,10 @@ card_map = dbc.Card(
                     id="loading-map",
                     type="cube",
                     fullscreen=False,
-                    children=[dcc.Graph(id="density_map", figure={}, style={"height": "50vh"})]
+                    children=[dcc.Graph(id="density_map", figure=base_figure("map"), style={"height": "50vh"})]
                     ),
+                    # Days are sent one at a time, only when selected here
+                    dcc.Slider(id="map-day-slider", min=0, max=0, step=1, value=0, marks={}, included=False),
                     html.Div("Fetching data. Please wait.", id="loading-message", className="loading-message-hidden")
             ],
             style={"position": "relative"}
@@ -81,6 +239,38 @@ card_map = dbc.Card(
 ]
 )
 
+# Choropleth of the provinces or districts, the boundaries follow the zoom level
+card_choropleth = dbc.Card(
+    [
+        dbc.CardHeader(
+            [
+                html.Span("Jumlah Titik Api per Wilayah"),
+                dbc.RadioItems(
+                    options=
+                    [
+                        {"label": "Provinsi", "value": "provinces"},
+                        {"label": "Kabupaten/Kota", "value": "districts"},
+                    ],
+                    value="provinces",
+                    id="choropleth-area",
+                    inline=True,
+                    className="float-end",
+                ),
+            ]
+        ),
+        dbc.CardBody(
+            [
+                dcc.Loading(
+                    id="loading-choropleth",
+                    type="cube",
+                    fullscreen=False,
+                    children=[dcc.Graph(id="choropleth_map", figure=base_figure("choropleth"), style={"height": "50vh"})]
+                    )
+            ]
+        )
+]
+)
+
 # Big Numbers
 card_n_fires = dbc.Card(
     [
@@ -111,7 +301,7 @@ card_top_prov = dbc.Card(
                     id="loading-top-prov",
                     type="cube",
                     fullscreen=False,
-                    children=[dcc.Graph(id="top_10_prov", figure={}, style={"height": "21vh"})]
+                    children=[dcc.Graph(id="top_10_prov", figure=base_figure("bar"), style={"height": "21vh"})]
                     )
             ]
         )
@@ -128,7 +318,7 @@ card_top_district = dbc.Card(
                     id="loading-top-districts",
                     type="cube",
                     fullscreen=False,
-                    children=[dcc.Graph(id="top_10_districts", figure={}, style={"height": "21vh"})]
+                    children=[dcc.Graph(id="top_10_districts", figure=base_figure("bar"), style={"height": "21vh"})]
                 )
             ]
         )
@@ -145,7 +335,7 @@ card_line_chart = dbc.Card(
                     id="loading-line-chart",
                     type="cube",
                     fullscreen=False,
-                    children=[dcc.Graph(id="line_chart_viirs", figure={}, style={"height": "17vh"})]
+                    children=[dcc.Graph(id="line_chart_viirs", figure=base_figure("area"), style={"height": "17vh"})]
                 )
             ]
         )
@@ -153,13 +343,7 @@ card_line_chart = dbc.Card(
 )
 
 # Latest Articles
-query_articles = """
-    SELECT title, url, image, published_time
-    FROM articles
-    WHERE published_date > CURRENT_DATE - INTERVAL '2 day'
-    ORDER BY published_time DESC
-"""
-articles = fetch_last_data(query=query_articles, uri_connection=CONNECTION_URI)
+articles = fetch_query("latest_articles", CONNECTION_URI, n_day=2)
 articles = articles.to_pandas()
 
 cards = []
@@ -218,26 +402,7 @@ card_articles = dbc.Card(
 )
 
 # Latest Air Quality Index
-query_aqi = """
-    WITH RANKED_DATA AS (
-    SELECT 
-        address, city, province, air_quality_index, category, updated_at, 
-        ROW_NUMBER() OVER (PARTITION BY address, city, province ORDER BY updated_at DESC) AS rn
-    FROM 
-        air_quality_idn
-    WHERE 
-        DATE(updated_at) = CURRENT_DATE
-    )
-    SELECT 
-        *
-    FROM 
-        RANKED_DATA
-    WHERE 
-        rn = 1
-    ORDER BY 
-        air_quality_index DESC
-"""
-air_quality = fetch_last_data(query=query_aqi, uri_connection=CONNECTION_URI)
+air_quality = fetch_query("latest_air_quality", CONNECTION_URI)
 air_quality = air_quality.to_pandas()
 
 air_quality["province"] = air_quality["province"].replace(
@@ -327,7 +492,12 @@ app.layout = dbc.Container(
                     ], lg=2, md=12, sm=12, xs=12, className="offset-lg-1", style={"height":"5vh"},
                 ),
                 dbc.Col(nav, lg=5, md=12, sm=12, xs=12, className="offset-lg-3", style={"height":"5vh"}),
-                dcc.Store(id='store_data')
+                dcc.Location(id='page_location', refresh=False),
+                dcc.Store(id='store_data'),
+                dcc.Store(id='store_dates'),
+                dcc.Store(id='store_map_key'),
+                dcc.Store(id='store_choropleth_level'),
+                dcc.Store(id='store_calendar_version')
             ]
         ),
 
@@ -381,6 +551,16 @@ app.layout = dbc.Container(
         ], className="g-2"
     ),
 
+
+    # ----- Fourth Row Layout -----
+    # Contains the choropleth of the provinces and districts
+
+    dbc.Row(
+        [
+            dbc.Col([card_choropleth], lg=10, md=12, sm=12, xs=12, className="offset-lg-1"),
+        ], className="g-2"
+    ),
+
     ], 
 fluid=True
 )
@@ -390,18 +570,18 @@ fluid=True
 # ----- Calendar -----
 @app.callback(
     Output('heatmap-calendar', 'srcDoc'),
-    Input('radioitems-input', 'value')  # Replace with the ID and property of the component that triggers the callback
+    Output('store_calendar_version', 'data'),
+    Input('interval-component', 'n_intervals'),
+    State('store_calendar_version', 'data')
 )
-def update_calendar(data):  # Replace 'value' with the actual input value(s) you need
-    query_temp = """
-        SELECT date, max_temp_c
-        FROM idn_gsod
-        ORDER BY date DESC
-    """
-    max_temperature = fetch_last_data(query=query_temp, uri_connection=CONNECTION_URI)
-    max_temperature = max_temperature.to_pandas()
-    calendar_html = generate_calendar(max_temperature)
-    return calendar_html
+def update_calendar(n, shown_version):
+    # rendered once per version of idn_gsod, the browser is only sent a new calendar when new rows were loaded
+    version = fetch_data_version("idn_gsod", uri_connection=CONNECTION_URI)
+    if version is not None and version == shown_version:
+        return no_update, no_update
+
+    calendar_html = render_cache.get_or_render("calendar", version, lambda: render_calendar(CONNECTION_URI))
+    return calendar_html, version
 
 # ----- Callback for dates and times -----
 @app.callback(
@@ -426,11 +606,67 @@ def update_card_tittle(filter_time_period):
 @app.callback(
     Output("density_map", "figure"),
     Output("store_data", "data"),
-    Input("radioitems-input", "value")
+    Output("store_dates", "data"),
+    Output("map-day-slider", "max"),
+    Output("map-day-slider", "marks"),
+    Output("map-day-slider", "value"),
+    Output("store_map_key", "data"),
+    Input("radioitems-input", "value"),
+    State("page_location", "href"),
+    background=True,
+    interval=500
+)
+def update_density_map(filter_time_period, href):
+    # runs in a background job, outside of the Flask request: the tiles URL comes from the page address
+    fig, data, dates, map_key = generate_density_map(n_day=filter_time_period, uri_connection=CONNECTION_URI)
+    fig = with_tile_layers(fig, urljoin(href or "/", "/tiles/{z}/{x}/{y}.pbf"))
+
+    # label about eight days on the slider, always including the latest one
+    every = max(len(dates) // 8, 1)
+    marks = {i: date[5:] for i, date in enumerate(dates) if i % every == 0 or i == len(dates) - 1}
+    last = max(len(dates) - 1, 0)
+
+    return fig, data, dates, last, marks, last, map_key
+
+
+# ----- Callback density map viewport -----
+# After a zoom or a pan, only the hotspots of the visible area are fetched and shown
+@app.callback(
+    Output("density_map", "figure", allow_duplicate=True),
+    Output("store_map_key", "data", allow_duplicate=True),
+    Input("density_map", "relayoutData"),
+    State("radioitems-input", "value"),
+    State("map-day-slider", "value"),
+    State("store_dates", "data"),
+    prevent_initial_call=True
+)
+def update_density_map_viewport(relayout_data, filter_time_period, day_index, dates):
+    bounds = relayout_bounds(relayout_data)
+    if bounds is None or not dates or day_index is None or day_index >= len(dates):
+        return no_update, no_update
+
+    viewport = generate_viewport_frame(filter_time_period, bounds, dates[day_index], uri_connection=CONNECTION_URI)
+    if viewport is None:
+        return no_update, no_update
+
+    return viewport
+
+
+# ----- Callback density map day -----
+@app.callback(
+    Output("density_map", "figure", allow_duplicate=True),
+    Input("map-day-slider", "value"),
+    State("store_map_key", "data"),
+    State("store_dates", "data"),
+    State("store_data", "data"),
+    prevent_initial_call=True
 )
-def update_density_map(filter_time_period):
-    fig, data = generate_density_map(n_day=filter_time_period, uri_connection=CONNECTION_URI)
-    return fig, data
+def update_density_map_day(day_index, map_key, dates, jsonified_data):
+    if not dates or day_index is None or day_index >= len(dates):
+        return no_update
+
+    # the window of the viewport when the map was zoomed, the national one otherwise
+    return generate_density_frame(map_key, dates[day_index], jsonified_data)
 
 
 # ----- Callback dcc.loading -----
@@ -449,34 +685,86 @@ def update_loading_message(loading_state):
     Output("line_chart_viirs", "figure"),
     Output("count_fire", "children"),
     Output("count_confidence", "children"), 
-    Input("store_data", "data")
+    Input("store_data", "data"),
+    State("radioitems-input", "value")
 
 )
-def update_line_chart(jsonified_data):
-    fig, count_fire, count_confidence = generate_line_chart(jsonified_data)
+def update_line_chart(jsonified_data, filter_time_period):
+    # the graph already holds the cached layout, only the trace data is patched; the counts of a window are made
+    # once, by the warm-up after the ETL or by the first of these three callbacks
+    aggregates = cached_chart_aggregates(jsonified_data, filter_time_period, render_cache)
+    fig, count_fire, count_confidence = generate_line_chart(jsonified_data, patch=True, aggregates=aggregates)
     return fig, count_fire, count_confidence
 
 
 # ----- Callback top-5 province -----
 @app.callback(
     Output("top_10_prov", "figure"),
-    Input("store_data", "data")
+    Input("store_data", "data"),
+    State("radioitems-input", "value")
 
 )
-def update_bar_chart(jsonified_data):
-    fig = generate_top_prov(jsonified_data)
+def update_bar_chart(jsonified_data, filter_time_period):
+    aggregates = cached_chart_aggregates(jsonified_data, filter_time_period, render_cache)
+    fig = generate_top_prov(jsonified_data, patch=True, aggregates=aggregates)
     return fig
 
 # ----- Callback top-5 district -----
 @app.callback(
     Output("top_10_districts", "figure"),
-    Input("store_data", "data")
+    Input("store_data", "data"),
+    State("radioitems-input", "value")
 
 )
-def update_bar_chart(jsonified_data):
-    fig = generate_top_kabkot(jsonified_data)
+def update_bar_chart(jsonified_data, filter_time_period):
+    aggregates = cached_chart_aggregates(jsonified_data, filter_time_period, render_cache)
+    fig = generate_top_kabkot(jsonified_data, patch=True, aggregates=aggregates)
     return fig
 
 
+
+# ----- Callback choropleth -----
+def boundaries_url(layer, level):
+    return request.host_url + f"boundaries/{layer}-{level}.geojson"
+
+
+@app.callback(
+    Output("choropleth_map", "figure"),
+    Output("store_choropleth_level", "data"),
+    Input("store_data", "data"),
+    Input("choropleth-area", "value")
+)
+def update_choropleth(jsonified_data, layer):
+    if not jsonified_data:
+        return no_update, no_update
+
+    # a new figure is shown at the national zoom
+    level = boundary_level(0)
+    fig = generate_choropleth(jsonified_data, layer, boundaries_url(layer, level))
+    return fig, level
+
+
+# ----- Callback choropleth level of detail -----
+# Finer boundaries are only fetched once the map is zoomed in
+@app.callback(
+    Output("choropleth_map", "figure", allow_duplicate=True),
+    Output("store_choropleth_level", "data", allow_duplicate=True),
+    Input("choropleth_map", "relayoutData"),
+    State("choropleth-area", "value"),
+    State("store_choropleth_level", "data"),
+    prevent_initial_call=True
+)
+def update_choropleth_level(relayout_data, layer, shown_level):
+    zoom = (relayout_data or {}).get("mapbox.zoom")
+    if zoom is None:
+        return no_update, no_update
+
+    level = boundary_level(zoom)
+    if level == shown_level:
+        return no_update, no_update
+
+    return choropleth_level_patch(boundaries_url(layer, level)), level
+
+
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,104 @@
+-- processed_viirs, range-partitioned by month on acq_date.
+--
+-- The table used to be created by write_database(if_exists="append") on the first load, as a plain heap without
+-- any index. An existing table is renamed, its rows are copied into the partitioned table, then it is dropped.
+--
+-- Rows of a month without its partition land in processed_viirs_default; ensure_viirs_partitions moves them to the
+-- partition of their month when it creates it.
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class
+               WHERE oid = to_regclass('processed_viirs') AND relkind = 'r') THEN
+        ALTER TABLE processed_viirs RENAME TO processed_viirs_unpartitioned;
+    END IF;
+END $$;
+
+CREATE TABLE processed_viirs (
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    brightness REAL,
+    acq_date DATE NOT NULL,
+    acq_time INTEGER,
+    satellite TEXT,
+    instrument TEXT,
+    confidence TEXT,
+    version TEXT,
+    frp REAL,
+    daynight TEXT,
+    second_adm TEXT,
+    first_adm TEXT
+) PARTITION BY RANGE (acq_date);
+
+CREATE TABLE processed_viirs_default PARTITION OF processed_viirs DEFAULT;
+
+
+CREATE OR REPLACE FUNCTION ensure_viirs_partitions(first_day DATE, last_day DATE) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    month_start DATE := date_trunc('month', first_day)::DATE;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    -- two loads of the same new month must not both create its partition
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_viirs_partitions'));
+
+    WHILE month_start <= last_day LOOP
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+        partition_name := 'processed_viirs_' || to_char(month_start, '"y"YYYY"m"MM');
+
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE processed_viirs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                           partition_name);
+            EXECUTE format('WITH moved AS (DELETE FROM processed_viirs_default WHERE acq_date >= %L AND acq_date < %L '
+                           'RETURNING *) INSERT INTO %I SELECT * FROM moved', month_start, month_end, partition_name);
+            EXECUTE format('ALTER TABLE processed_viirs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_end);
+            created := created + 1;
+        END IF;
+
+        month_start := month_end;
+    END LOOP;
+
+    RETURN created;
+END $$;
+
+
+DO $$
+DECLARE
+    first_day DATE;
+    last_day DATE;
+BEGIN
+    IF to_regclass('processed_viirs_unpartitioned') IS NOT NULL THEN
+        SELECT MIN(acq_date), MAX(acq_date) INTO first_day, last_day FROM processed_viirs_unpartitioned;
+
+        IF first_day IS NOT NULL THEN
+            PERFORM ensure_viirs_partitions(first_day, last_day);
+        END IF;
+
+        INSERT INTO processed_viirs (latitude, longitude, brightness, acq_date, acq_time, satellite, instrument,
+                                     confidence, version, frp, daynight, second_adm, first_adm)
+        SELECT latitude, longitude, brightness, acq_date, acq_time, satellite, instrument,
+               confidence, version, frp, daynight, second_adm, first_adm
+        FROM processed_viirs_unpartitioned
+        ORDER BY acq_date, acq_time;
+
+        DROP TABLE processed_viirs_unpartitioned;
+    END IF;
+END $$;
+
+SELECT ensure_viirs_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '1 month')::DATE);
+
+
+-- Created on the parent, hence on every partition, present and future.
+-- Within a month, rows are appended day after day: a BRIN summary of the dates stays small and selective.
+CREATE INDEX processed_viirs_acq_date_brin ON processed_viirs USING brin (acq_date);
+
+-- The hotspots of a province or a district over a timeframe
+CREATE INDEX processed_viirs_adm_date_idx ON processed_viirs (first_adm, second_adm, acq_date);
+
+-- The hotspots inside a bounding box: point(longitude, latitude) <@ box(point(west, south), point(east, north))
+CREATE INDEX processed_viirs_location_gist ON processed_viirs USING gist (point(longitude, latitude));
+
+ANALYZE processed_viirs;
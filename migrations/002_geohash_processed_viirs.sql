@@ -0,0 +1,44 @@
+-- Geohash of every detection, computed by the ETL during the administrative tagging (src/geohash.py), so that the
+-- hotspots of a map viewport are read with range scans of the geohash index instead of the whole window.
+--
+-- COLLATE "C": the ranges of src/geohash.py.prefix_ranges rely on the bytewise order of the geohashes.
+
+ALTER TABLE processed_viirs ADD COLUMN geohash TEXT COLLATE "C";
+
+
+-- Same cells and bit order as src/geohash.py.encode, with the same floating point operations
+CREATE OR REPLACE FUNCTION viirs_geohash(latitude DOUBLE PRECISION, longitude DOUBLE PRECISION, chars INTEGER DEFAULT 8)
+RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE STRICT AS $$
+DECLARE
+    alphabet CONSTANT TEXT := '0123456789bcdefghjkmnpqrstuvwxyz';
+    lon_bits INTEGER := (5 * chars + 1) / 2;
+    lat_bits INTEGER := 5 * chars / 2;
+    lon_cell BIGINT := GREATEST(LEAST(floor((longitude + 180.0) / 360.0 * 2.0 ^ lon_bits), 2.0 ^ lon_bits - 1), 0);
+    lat_cell BIGINT := GREATEST(LEAST(floor((latitude + 90.0) / 180.0 * 2.0 ^ lat_bits), 2.0 ^ lat_bits - 1), 0);
+    code BIGINT := 0;
+    geohash TEXT := '';
+BEGIN
+    FOR i IN 1 .. 5 * chars LOOP
+        IF i % 2 = 1 THEN
+            code := code * 2 + ((lon_cell >> (lon_bits - (i + 1) / 2)) & 1);
+        ELSE
+            code := code * 2 + ((lat_cell >> (lat_bits - i / 2)) & 1);
+        END IF;
+    END LOOP;
+
+    FOR i IN REVERSE chars - 1 .. 0 LOOP
+        geohash := geohash || substr(alphabet, ((code >> (5 * i)) & 31)::INTEGER + 1, 1);
+    END LOOP;
+
+    RETURN geohash;
+END $$;
+
+-- The rows loaded before this migration
+UPDATE processed_viirs SET geohash = viirs_geohash(latitude, longitude)
+WHERE geohash IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL;
+
+-- A viewport query is a few geohash ranges within the dates of a timeframe
+CREATE INDEX processed_viirs_geohash_idx ON processed_viirs (geohash, acq_date);
+
+ANALYZE processed_viirs;
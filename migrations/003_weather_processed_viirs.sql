@@ -0,0 +1,13 @@
+-- Weather of every detection: the nearest GSOD station reporting on its acquisition day, the distance to it, and
+-- that day's readings at the station (src/weather.py). Null until the GSOD readings of the day are loaded, then
+-- filled in by `python -m src.weather`.
+
+ALTER TABLE processed_viirs
+    ADD COLUMN gsod_station TEXT,
+    ADD COLUMN gsod_station_km REAL,
+    ADD COLUMN gsod_max_temp_c REAL,
+    ADD COLUMN gsod_precipitation REAL,
+    ADD COLUMN gsod_wind_speed REAL;
+
+-- The detections still waiting for their readings, looked up by fill_weather
+CREATE INDEX processed_viirs_weather_pending_idx ON processed_viirs (acq_date) WHERE gsod_station IS NULL;
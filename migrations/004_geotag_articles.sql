@@ -0,0 +1,25 @@
+-- Provinces and districts named in each article (src/geotag.py), with the names of processed_viirs.first_adm and
+-- second_adm, so that the news can be filtered by the region shown on the dashboard:
+--
+--     SELECT ... FROM articles WHERE first_adm @> ARRAY['Riau']
+--
+-- The articles table used to be created by write_database on the first load; it is created here if it does not
+-- exist yet, so that the list columns are arrays and not text.
+
+CREATE TABLE IF NOT EXISTS articles (
+    keywords TEXT,
+    title TEXT,
+    article_text TEXT,
+    url TEXT,
+    image TEXT,
+    publisher TEXT,
+    published_time TIMESTAMPTZ,
+    published_date DATE
+);
+
+ALTER TABLE articles
+    ADD COLUMN IF NOT EXISTS first_adm TEXT[],
+    ADD COLUMN IF NOT EXISTS second_adm TEXT[];
+
+CREATE INDEX IF NOT EXISTS articles_first_adm_idx ON articles USING GIN (first_adm);
+CREATE INDEX IF NOT EXISTS articles_second_adm_idx ON articles USING GIN (second_adm);
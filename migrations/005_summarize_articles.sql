@@ -0,0 +1,12 @@
+-- Summaries of the articles (src/summarize.py): the sha256 of the article text, the summary and the model it was made
+-- with. The content hash is looked up before summarizing, so that a text already summarized by the same model is not
+-- sent again:
+--
+--     SELECT DISTINCT ON (content_hash) content_hash, summary FROM articles WHERE content_hash = ANY(...) AND ...
+
+ALTER TABLE articles
+    ADD COLUMN IF NOT EXISTS content_hash TEXT,
+    ADD COLUMN IF NOT EXISTS summary TEXT,
+    ADD COLUMN IF NOT EXISTS summary_model TEXT;
+
+CREATE INDEX IF NOT EXISTS articles_content_hash_idx ON articles (content_hash);
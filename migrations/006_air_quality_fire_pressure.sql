@@ -0,0 +1,25 @@
+-- Fire pressure on the air quality sensors (src/proximity.py): for every reading of air_quality_idn and every radius,
+-- the hotspots within that radius of the sensor, the sum of their FRP and the distance to the nearest one. The rows
+-- are joined to the readings on the sensor and the time of the reading:
+--
+--     SELECT ... FROM air_quality_idn a JOIN air_quality_fire_pressure p USING (address, city, province, updated_at)
+--
+-- The table used to be created by write_database on the first load; it is created here if it does not exist yet,
+-- so that the counts are integers and the times are timestamps.
+
+CREATE TABLE IF NOT EXISTS air_quality_fire_pressure (
+    address TEXT,
+    city TEXT,
+    province TEXT,
+    lat_sensor TEXT,
+    lon_sensor TEXT,
+    updated_at TIMESTAMP,
+    fetched_date DATE,
+    radius_km DOUBLE PRECISION NOT NULL,
+    n_hotspots INTEGER NOT NULL,
+    frp_sum DOUBLE PRECISION NOT NULL,
+    nearest_hotspot_km DOUBLE PRECISION
+);
+
+CREATE INDEX IF NOT EXISTS air_quality_fire_pressure_reading_idx
+    ON air_quality_fire_pressure (address, city, province, updated_at);
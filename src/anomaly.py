@@ -0,0 +1,278 @@
+import os
+import argparse
+import datetime
+
+import numpy as np
+import polars as pl
+
+from src.queries import fetch_query
+from src.metrics import instrumented, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Whether a district is burning more than usual for the time of year: the hotspots of a district over the last
+# WINDOW_DAYS days, compared with the same days of the previous years.
+#
+# The history is kept as one array of daily hotspot counts, district x year x day of the year (366 slots, 29 February
+# included), with the days of every year that were counted. It is filled from processed_viirs (the backfilled yearly
+# archives and the daily loads), saved to BASELINE_PATH, and updated with the days of each ETL batch:
+#
+#     python -m src.anomaly --since 2012-01-20     # count the whole history once
+#     python -m src.anomaly                        # count the last UPDATE_DAYS days again, list the districts above normal
+#
+# A day counted again replaces its previous counts, so an update can be rerun. About 500 districts over 10 years take
+# 7 MB in memory, and scoring all of them is a slice of that array.
+BASELINE_PATH = "./data/anomaly/district-baseline.npz"
+
+WINDOW_DAYS = 7
+
+# Days counted again by an update, covering the detections the daily loads may still add to the recent days
+UPDATE_DAYS = 7
+
+# Previous years needed before a district is scored
+MIN_YEARS = 3
+
+# z-score from which a district is listed as above normal
+ABOVE_NORMAL_Z = 2.0
+
+# First day of every month in a leap year, the day of the year slots
+_MONTH_STARTS = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335])
+
+SLOTS = 366
+
+
+def day_slots(dates: pl.Series) -> np.ndarray:
+    """
+    Returns the day of the year slot (0 to 365, in the calendar of a leap year) of each date.
+    """
+    return _MONTH_STARTS[dates.dt.month().to_numpy() - 1] + dates.dt.day().to_numpy() - 1
+
+
+def _day_range(first_day: datetime.date, last_day: datetime.date) -> pl.Series:
+    return pl.date_range(first_day, last_day, "1d", eager=True)
+
+
+def _same_day(day: datetime.date, year: int) -> datetime.date:
+    # the day of another year, 28 February for a 29 February outside the leap years
+    try:
+        return day.replace(year=year)
+    except ValueError:
+        return datetime.date(year, 2, 28)
+
+
+class DistrictBaseline:
+    """
+    Daily hotspot counts of every district over the years, scored against the same days of the previous years.
+
+    Parameters:
+    - districts (list): (province, district) pairs, the rows of counts.
+    - years (list): The years, the columns of counts.
+    - counts (np.ndarray): (districts, years, SLOTS) daily hotspot counts.
+    - observed (np.ndarray): (years, SLOTS) booleans, the days that were counted.
+    """
+
+    def __init__(self, districts: list = None, years: list = None, counts: np.ndarray = None,
+                 observed: np.ndarray = None):
+        self.districts = list(districts or [])
+        self.years = list(years or [])
+        self.counts = counts if counts is not None else np.zeros((len(self.districts), len(self.years), SLOTS),
+                                                                 dtype=np.int32)
+        self.observed = observed if observed is not None else np.zeros((len(self.years), SLOTS), dtype=bool)
+        self._district_index = {district: i for i, district in enumerate(self.districts)}
+
+    def _district_rows(self, provinces: list, districts: list) -> np.ndarray:
+        new = [key for key in dict.fromkeys(zip(provinces, districts)) if key not in self._district_index]
+        if new:
+            for key in new:
+                self._district_index[key] = len(self.districts)
+                self.districts.append(key)
+            self.counts = np.concatenate(
+                [self.counts, np.zeros((len(new), len(self.years), SLOTS), dtype=np.int32)], axis=0)
+
+        return np.array([self._district_index[key] for key in zip(provinces, districts)], dtype=np.int64)
+
+    def _year_columns(self, years: np.ndarray) -> np.ndarray:
+        new = sorted(set(years.tolist()) - set(self.years))
+        if new:
+            self.years = sorted(self.years + new)
+            order = {year: i for i, year in enumerate(self.years)}
+            counts = np.zeros((len(self.districts), len(self.years), SLOTS), dtype=np.int32)
+            observed = np.zeros((len(self.years), SLOTS), dtype=bool)
+            kept = [order[year] for year in self.years if year not in new]
+            counts[:, kept], observed[kept] = self.counts, self.observed
+            self.counts, self.observed = counts, observed
+
+        return np.searchsorted(self.years, years)
+
+    def update(self, daily: pl.DataFrame, first_day: datetime.date, last_day: datetime.date):
+        """
+        Replaces the counts of a range of days.
+
+        Parameters:
+        - daily (pl.DataFrame): One row per day and district with hotspots, with the columns acq_date, first_adm,
+                                second_adm and n_hotspots, as returned by the district_daily_counts query.
+        - first_day (datetime.date): First day of the range. The days of the range missing from daily had no hotspot.
+        - last_day (datetime.date): Last day of the range.
+        """
+        days = _day_range(first_day, last_day)
+        columns, slots = self._year_columns(days.dt.year().to_numpy()), day_slots(days)
+        self.counts[:, columns, slots] = 0
+        self.observed[columns, slots] = True
+
+        daily = daily.filter(pl.col("acq_date").is_between(first_day, last_day))
+        if daily.is_empty():
+            return
+
+        rows = self._district_rows(daily["first_adm"].to_list(), daily["second_adm"].to_list())
+        columns = self._year_columns(daily["acq_date"].dt.year().to_numpy())
+        np.add.at(self.counts, (rows, columns, day_slots(daily["acq_date"])), daily["n_hotspots"].to_numpy())
+
+    def score(self, day: datetime.date, window_days: int = WINDOW_DAYS) -> pl.DataFrame:
+        """
+        Scores the hotspots of every district over the window_days days up to a day against the same days of the
+        previous years.
+
+        Parameters:
+        - day (datetime.date): Last day of the window.
+        - window_days (int): Length of the window, in days.
+
+        Returns:
+        - pl.DataFrame: One row per district with the columns first_adm, second_adm, n_hotspots (in the window),
+                        baseline_mean, baseline_std, n_years (previous years with the whole window counted), z_score
+                        and percentile (share of the previous years with fewer hotspots, ties counted half), sorted
+                        by z_score. The scores are null for the districts with less than MIN_YEARS previous years.
+        """
+        years = np.array([year for year in self.years if year <= day.year], dtype=np.int64)
+        # the window of each year from its own dates: the same day of that year (28 February for a 29 February) and
+        # the window_days - 1 days before it, which may start in the previous year. Leap days are in the windows of
+        # the leap years only.
+        dates = pl.Series([_same_day(day, int(year)) - datetime.timedelta(days=k)
+                           for year in years for k in range(window_days - 1, -1, -1)], dtype=pl.Date)
+        slots = day_slots(dates).reshape(len(years), window_days)
+        # (years, window) columns of the counts, known where the year of the date was counted
+        wanted = dates.dt.year().to_numpy().astype(np.int64).reshape(len(years), window_days)
+        columns = np.searchsorted(self.years, wanted)
+        known = (columns < len(self.years)) & (np.take(self.years, np.minimum(columns, len(self.years) - 1)) == wanted)
+        columns = np.where(known, columns, 0)
+
+        complete = (known & self.observed[columns, slots]).all(axis=1)
+        # the cells of the years never counted point at column 0: left out of the sums, not read as other counts
+        sums = np.where(known[None, :, :], self.counts[:, columns, slots], 0).sum(axis=2)
+
+        current = years == day.year
+        n_hotspots = sums[:, current].sum(axis=1) if current.any() else np.zeros(len(self.districts), dtype=np.int64)
+
+        history = sums[:, complete & ~current].astype(np.float64)
+        n_years = history.shape[1]
+
+        if n_years >= MIN_YEARS:
+            mean = history.mean(axis=1)
+            std = history.std(axis=1, ddof=1)
+            # at least one hotspot: a district without any fire in its history is not above normal for one detection
+            z_score = (n_hotspots - mean) / np.maximum(std, 1.0)
+            percentile = ((history < n_hotspots[:, None]).sum(axis=1)
+                          + 0.5 * (history == n_hotspots[:, None]).sum(axis=1)) / n_years
+        else:
+            mean = std = z_score = percentile = np.full(len(self.districts), np.nan)
+
+        return pl.DataFrame({
+            "first_adm": [province for province, _ in self.districts],
+            "second_adm": [district for _, district in self.districts],
+            "n_hotspots": n_hotspots.astype(np.int64),
+            "baseline_mean": np.round(mean, 2),
+            "baseline_std": np.round(std, 2),
+            "n_years": np.full(len(self.districts), n_years, dtype=np.int32),
+            "z_score": np.round(z_score, 2),
+            "percentile": np.round(percentile, 3),
+        }, schema_overrides={"first_adm": pl.Utf8, "second_adm": pl.Utf8}).with_columns(
+            pl.col(["baseline_mean", "baseline_std", "z_score", "percentile"]).fill_nan(None)
+        ).sort("z_score", descending=True, nulls_last=True)
+
+    def save(self, path: str = BASELINE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # written whole, then renamed: a reader never sees half of it
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez_compressed(f, counts=self.counts, observed=self.observed, years=np.array(self.years),
+                                provinces=np.array([province for province, _ in self.districts], dtype=str),
+                                districts=np.array([district for _, district in self.districts], dtype=str))
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path: str = BASELINE_PATH) -> "DistrictBaseline":
+        """
+        Reads a saved baseline.
+
+        Returns:
+        - DistrictBaseline: The baseline, empty if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path) as saved:
+            return cls(list(zip(saved["provinces"].tolist(), saved["districts"].tolist())), saved["years"].tolist(),
+                       saved["counts"], saved["observed"])
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("transform")
+def update_baseline(uri_connection: str, first_day: datetime.date = None, last_day: datetime.date = None,
+                    path: str = BASELINE_PATH) -> DistrictBaseline:
+    """
+    Counts the hotspots of a range of days from processed_viirs into the saved baseline.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Supabase database.
+    - first_day (datetime.date): First day counted. Defaults to UPDATE_DAYS days before last_day.
+    - last_day (datetime.date): Last day counted. Defaults to today.
+    - path (str): Where the baseline is saved.
+
+    Returns:
+    - DistrictBaseline: The updated baseline, or None if the counts could not be read.
+    """
+    last_day = last_day or datetime.date.today()
+    first_day = first_day or last_day - datetime.timedelta(days=UPDATE_DAYS - 1)
+
+    daily = fetch_query("district_daily_counts", uri_connection, first_day=first_day, last_day=last_day)
+    if daily is None:
+        return None
+
+    baseline = DistrictBaseline.load(path)
+    baseline.update(daily, first_day, last_day)
+    baseline.save(path)
+
+    return baseline
+
+
+def districts_above_normal(baseline: DistrictBaseline, day: datetime.date = None, window_days: int = WINDOW_DAYS,
+                           threshold: float = ABOVE_NORMAL_Z) -> pl.DataFrame:
+    """
+    Lists the districts whose hotspots of the last window_days days are above normal for the time of year.
+
+    Parameters:
+    - baseline (DistrictBaseline): The counts of the previous years and of the window.
+    - day (datetime.date): Last day of the window. Defaults to today.
+    - window_days (int): Length of the window, in days.
+    - threshold (float): Smallest z-score listed.
+
+    Returns:
+    - pl.DataFrame: The rows of DistrictBaseline.score above the threshold, most unusual first.
+    """
+    scores = baseline.score(day or datetime.date.today(), window_days)
+    return scores.filter(pl.col("z_score") >= threshold)
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Updates the per-district baseline of the hotspots and lists the "
+                                                 "districts above normal.")
+    parser.add_argument("--since", type=datetime.date.fromisoformat,
+                        help=f"first day counted, defaults to the last {UPDATE_DAYS} days")
+    parser.add_argument("--path", default=BASELINE_PATH)
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    baseline = update_baseline(config.get("CONNECTION_URI"), first_day=args.since, path=args.path)
+    if baseline is not None:
+        with pl.Config(tbl_rows=50):
+            print(districts_above_normal(baseline))
+    write_summary(args.metrics_json)
@@ -0,0 +1,146 @@
+import json
+import hashlib
+import threading
+
+import polars as pl
+
+from src.queries import fetch_query
+from src.cache import SHARED_FRAMES
+from src.metrics import instrumented, count_cache
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Read API of the numbers shown by the dashboard, served by the /api/v1 routes of the dashboard server:
+#
+#     /api/v1/hotspots/daily?days=7          hotspots and high-confidence hotspots per day, and their totals
+#     /api/v1/hotspots/provinces?days=7      per province, most hotspots first (limit=5: the top five of the dashboard)
+#     /api/v1/hotspots/districts?days=7      per district, the same
+#
+# The aggregates are counted from the hotspots of the timeframe that the density map fetched (the shared
+# density_map-<days> frame), so they are the numbers of the dashboard and cost no query of their own. Every response
+# carries a strong ETag made of the request and of the data version of processed_viirs: a client polling with
+# If-None-Match gets a 304 without a body until the next load, and the JSON of a version is serialized once.
+API_DAYS = (7, 15, 30)
+
+AGGREGATES = ("daily", "provinces", "districts")
+
+# Default number of provinces or districts listed, as in the bar charts of the dashboard
+TOP_N = 5
+
+
+def _dumps(obj) -> bytes:
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(obj, default=str, separators=(",", ":")).encode()
+
+    return orjson.dumps(obj)
+
+
+def hotspot_window(n_day: int, version: str, uri_connection: str) -> pl.DataFrame:
+    """
+    Returns the hotspots of the last n_day days, the frame shared with generate_density_map.
+    """
+    return SHARED_FRAMES.get_or_fetch(f"density_map-{int(n_day)}", version,
+                                      lambda: fetch_query("density_map", uri_connection, n_day=int(n_day)))
+
+
+def _counts(df: pl.DataFrame, by: list) -> pl.DataFrame:
+    return df.group_by(by).agg(
+        pl.count().alias("n_hotspots"),
+        (pl.col("confidence") == "High").sum().cast(pl.Int64).alias("n_high_confidence"),
+        pl.col("frp").cast(pl.Float64).sum().round(1).alias("frp_sum"),
+    )
+
+
+def daily_stats(hotspots: pl.DataFrame) -> dict:
+    """
+    Counts the hotspots of each day, the days without any included, as the line chart of the dashboard.
+
+    Returns:
+    - dict: The totals (n_hotspots, n_high_confidence) and the list of days (date, n_hotspots, n_high_confidence,
+            frp_sum).
+    """
+    daily = _counts(hotspots, ["acq_date"]).sort("acq_date")
+    if not daily.is_empty():
+        days = pl.DataFrame({"acq_date": pl.date_range(daily["acq_date"].min(), daily["acq_date"].max(), "1d",
+                                                       eager=True)})
+        daily = days.join(daily, on="acq_date", how="left").fill_null(0)
+
+    return {
+        "n_hotspots": hotspots.height,
+        "n_high_confidence": int((hotspots["confidence"] == "High").sum()),
+        "daily": daily.rename({"acq_date": "date"}).to_dicts(),
+    }
+
+
+def region_stats(hotspots: pl.DataFrame, level: str, limit: int = TOP_N) -> dict:
+    """
+    Counts the hotspots of each province or district, as the bar charts of the dashboard.
+
+    Parameters:
+    - hotspots (pl.DataFrame): The hotspots, as returned by the density_map query.
+    - level (str): "provinces" or "districts".
+    - limit (int): Regions listed, most hotspots first. All if None.
+
+    Returns:
+    - dict: The list of regions (province, and district for the districts, n_hotspots, n_high_confidence, frp_sum).
+    """
+    if level == "provinces":
+        by, names = ["first_adm"], {"first_adm": "province"}
+    else:
+        by, names = ["second_adm", "first_adm"], {"second_adm": "district", "first_adm": "province"}
+
+    regions = (_counts(hotspots.drop_nulls(by[0]), by)
+               .sort(["n_hotspots", by[0]], descending=[True, False])
+               .rename(names))
+    if limit is not None:
+        regions = regions.head(limit)
+
+    return {level: regions.to_dicts()}
+
+
+def api_etag(aggregate: str, n_day: int, limit: int, version: str) -> str:
+    """
+    Returns the strong ETag of a response: the same for the same request and data version, and only then.
+    """
+    return hashlib.sha1(f"{aggregate}|{n_day}|{limit}|{version}".encode()).hexdigest()[:20]
+
+
+# Serialized responses, by (aggregate, n_day, limit): (data version, JSON). Only the latest version is kept.
+_bodies = {}
+_bodies_lock = threading.Lock()
+
+
+@instrumented("api")
+def api_body(aggregate: str, n_day: int, limit: int, version: str, uri_connection: str) -> bytes:
+    """
+    Makes the JSON of an aggregate, once per data version.
+
+    Parameters:
+    - aggregate (str): One of AGGREGATES.
+    - n_day (int): The timeframe, one of API_DAYS.
+    - limit (int): Regions listed by the provinces and districts aggregates, all if None.
+    - version (str): The current data version of processed_viirs.
+    - uri_connection (str): The connection URI to the Supabase database.
+
+    Returns:
+    - bytes: The JSON body, or None if the hotspots could not be read.
+    """
+    key = (aggregate, n_day, limit)
+    with _bodies_lock:
+        cached = _bodies.get(key)
+    count_cache("api", cached is not None and cached[0] == version)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    hotspots = hotspot_window(n_day, version, uri_connection)
+    if hotspots is None:
+        return None
+
+    stats = daily_stats(hotspots) if aggregate == "daily" else region_stats(hotspots, aggregate, limit)
+    body = _dumps({"days": n_day, "data_version": version, **stats})
+
+    with _bodies_lock:
+        _bodies[key] = (version, body)
+
+    return body
@@ -0,0 +1,281 @@
+import io
+import os
+import glob
+import argparse
+import multiprocessing
+import concurrent.futures
+
+import polars as pl
+
+from src.procedures import load_administrative_boundaries, extract_administrative, cleaning_fetched_data
+from src.metrics import instrumented, write_summary
+from src.migrate import ensure_partitions
+from src.geohash import encode as encode_geohash
+from src.gsod import scan_gsod, station_daily
+from src.weather import StationIndex, enrich_weather, WEATHER_COLUMNS
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Backfill of processed_viirs from the FIRMS yearly archives (data/viirs-yearly-summary/viirs-snpp_<year>.csv), in three
+# resumable stages, each one skipping the work already done:
+#   1. split: every archive is cut into one Parquet file per month (checkpoint_dir/raw)
+#   2. process: the months are tagged with their administrative areas and cleaned in a process pool (checkpoint_dir/clean),
+#      and with the readings of their nearest GSOD station when GSOD files are given (src/weather.py)
+#   3. load: the cleaned months are copied into the database, each one in a transaction that also records it in
+#      backfill_chunks, so that a month is never loaded twice
+PROCESSED_COLUMNS = ["latitude", "longitude", "brightness", "acq_date", "acq_time", "satellite", "instrument",
+                     "confidence", "version", "frp", "daynight", "second_adm", "first_adm", "geohash", *WEATHER_COLUMNS]
+
+# The yearly archives do not agree on their date format (2021 and 2023 are "%m/%d/%Y", 2022 is "%Y-%m-%d")
+ARCHIVE_DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y"]
+
+
+def _write_atomic(df: pl.DataFrame, path: str):
+    # a crash never leaves a half-written checkpoint behind
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _chunk_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+@instrumented("extract")
+def split_archive(path: str, checkpoint_dir: str) -> list:
+    """
+    Cuts a yearly archive into one Parquet file per month, with the columns cast like the FIRMS API data.
+    Already split archives are skipped.
+
+    Parameters:
+    - path (str): The archive csv file.
+    - checkpoint_dir (str): Root of the backfill checkpoints.
+
+    Returns:
+    - list: Paths of the monthly raw chunks of the archive.
+    """
+    raw_dir = os.path.join(checkpoint_dir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+    stem = _chunk_name(path)
+    done_marker = os.path.join(raw_dir, f"{stem}.done")
+
+    if os.path.exists(done_marker):
+        return sorted(glob.glob(os.path.join(raw_dir, f"{stem}_*.parquet")))
+
+    archive = pl.read_csv(path, infer_schema_length=0)
+
+    # same names and types as the API data, so that the chunks go through cleaning_fetched_data
+    archive = archive.select(
+        pl.col("latitude").cast(pl.Float64),
+        pl.col("longitude").cast(pl.Float64),
+        pl.col("brightness").cast(pl.Float32).alias("bright_ti4"),
+        pl.col("scan").cast(pl.Float32),
+        pl.col("track").cast(pl.Float32),
+        pl.coalesce([pl.col("acq_date").str.strptime(pl.Date, fmt, strict=False) for fmt in ARCHIVE_DATE_FORMATS]).alias("acq_date"),
+        pl.col("acq_time").cast(pl.Int32),
+        pl.col("satellite").cast(pl.Utf8),
+        pl.col("instrument").cast(pl.Utf8),
+        pl.col("confidence").cast(pl.Utf8),
+        pl.col("version").cast(pl.Utf8),
+        pl.col("bright_t31").cast(pl.Float32).alias("bright_ti5"),
+        pl.col("frp").cast(pl.Float32),
+        pl.col("daynight").cast(pl.Utf8),
+        pl.lit("IDN").alias("country_id"),
+    )
+
+    chunks = []
+    archive = archive.with_columns(pl.col("acq_date").dt.strftime("%Y-%m").alias("month"))
+    for month_df in archive.partition_by("month"):
+        chunk_path = os.path.join(raw_dir, f"{stem}_{month_df['month'][0]}.parquet")
+        _write_atomic(month_df.drop("month"), chunk_path)
+        chunks.append(chunk_path)
+
+    open(done_marker, "w").close()
+
+    return sorted(chunks)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+_boundaries = None
+_stations = None
+
+
+def _init_worker(boundaries_path: str, gsod_paths: list = None):
+    # each worker process reads the district boundaries and the GSOD readings once, not once per chunk
+    global _boundaries, _stations
+    _boundaries = load_administrative_boundaries(boundaries_path)
+    if gsod_paths:
+        _stations = StationIndex(station_daily(scan_gsod(gsod_paths)).collect())
+
+
+def process_chunk(raw_path: str, clean_dir: str) -> str:
+    """
+    Tags a monthly raw chunk with its administrative areas and cleans it like the daily ETL does, then tags it with
+    the weather of its nearest GSOD stations.
+    Runs in a worker process initialized by _init_worker.
+
+    Parameters:
+    - raw_path (str): The raw chunk written by split_archive.
+    - clean_dir (str): Where the cleaned chunk is written.
+
+    Returns:
+    - str: Path of the cleaned chunk.
+    """
+    clean_path = os.path.join(clean_dir, os.path.basename(raw_path))
+
+    raw = pl.read_parquet(raw_path).with_columns(pl.col("acq_date").dt.strftime("%Y-%m-%d"))
+    joined = extract_administrative(raw, adm_df=_boundaries)
+    cleaned = cleaning_fetched_data(joined)
+
+    if cleaned is None:
+        raise RuntimeError(f"Cleaning failed for {raw_path}")
+
+    _write_atomic(enrich_weather(cleaned, _stations).select(PROCESSED_COLUMNS), clean_path)
+
+    return clean_path
+
+
+@instrumented("transform")
+def process_chunks(raw_paths: list, checkpoint_dir: str, workers: int = None,
+                   boundaries_path: str = "./data/IndonesianCitiesDistrictsUpdated.json", gsod_paths: list = None) -> list:
+    """
+    Processes the raw chunks that have no cleaned counterpart yet, in a pool of worker processes.
+
+    Parameters:
+    - raw_paths (list): Raw chunks written by split_archive.
+    - checkpoint_dir (str): Root of the backfill checkpoints.
+    - workers (int): Number of worker processes. Defaults to the number of cores.
+    - boundaries_path (str): The districts GeoJSON used for the administrative tagging.
+    - gsod_paths (list): GSOD files or glob patterns, as accepted by scan_gsod. If None, the weather columns are left
+                         empty, for `python -m src.weather` to fill in.
+
+    Returns:
+    - list: Paths of all the cleaned chunks, including the ones of previous runs.
+    """
+    clean_dir = os.path.join(checkpoint_dir, "clean")
+    os.makedirs(clean_dir, exist_ok=True)
+
+    todo = [path for path in raw_paths if not os.path.exists(os.path.join(clean_dir, os.path.basename(path)))]
+    print(f"{len(raw_paths) - len(todo)} chunks already processed, {len(todo)} to go")
+
+    if todo:
+        # spawned, not forked: a forked worker would inherit the locks of the Polars thread pool of this process
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                                    initargs=(boundaries_path, gsod_paths)) as pool:
+            futures = {pool.submit(process_chunk, path, clean_dir): path for path in todo}
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    print(f"Processed {os.path.basename(future.result())}")
+                except Exception as e:
+                    print(f"An error occurred while processing {futures[future]}: {e}")
+
+    return sorted(os.path.join(clean_dir, os.path.basename(path)) for path in raw_paths
+                  if os.path.exists(os.path.join(clean_dir, os.path.basename(path))))
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("load")
+def load_chunks(clean_paths: list, uri_connection: str, table_name: str = "processed_viirs") -> int:
+    """
+    Copies the cleaned chunks into the database with COPY, skipping the ones already recorded in backfill_chunks.
+    The monthly partitions of processed_viirs are created on the way (see src/migrate.py).
+
+    Parameters:
+    - clean_paths (list): Cleaned chunks written by process_chunks.
+    - uri_connection (str): The connection URI to the Postgres (Supabase) database.
+    - table_name (str): The table the detections are appended to.
+
+    Returns:
+    - int: The number of rows loaded by this run.
+    """
+    import psycopg2
+
+    loaded_rows = 0
+
+    with psycopg2.connect(uri_connection) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS backfill_chunks (
+                    chunk TEXT PRIMARY KEY, table_name TEXT, n_rows INTEGER, loaded_at TIMESTAMPTZ DEFAULT NOW()
+                )""")
+            cursor.execute("SELECT chunk FROM backfill_chunks WHERE table_name = %s", (table_name,))
+            done = {row[0] for row in cursor.fetchall()}
+        connection.commit()
+
+        for path in clean_paths:
+            chunk = _chunk_name(path)
+            if chunk in done:
+                continue
+
+            chunk_df = pl.read_parquet(path)
+            # chunks cleaned before the geohash column existed
+            if "geohash" not in chunk_df.columns:
+                chunk_df = chunk_df.with_columns(pl.Series("geohash", encode_geohash(chunk_df["latitude"].to_numpy(),
+                                                                                    chunk_df["longitude"].to_numpy())))
+            # chunks cleaned before the weather columns existed
+            chunk_df = chunk_df.with_columns(pl.lit(None).alias(column) for column in WEATHER_COLUMNS
+                                             if column not in chunk_df.columns)
+            chunk_df = chunk_df.select(PROCESSED_COLUMNS)
+            columns = ", ".join(PROCESSED_COLUMNS)
+
+            buffer = io.BytesIO()
+            chunk_df.write_csv(buffer)
+            buffer.seek(0)
+
+            # the rows and the record of the chunk are committed together
+            with connection.cursor() as cursor:
+                if table_name == "processed_viirs" and chunk_df.height:
+                    ensure_partitions(cursor, chunk_df["acq_date"].min(), chunk_df["acq_date"].max())
+                cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)", buffer)
+                cursor.execute("INSERT INTO backfill_chunks (chunk, table_name, n_rows) VALUES (%s, %s, %s)",
+                               (chunk, table_name, chunk_df.height))
+            connection.commit()
+
+            loaded_rows += chunk_df.height
+            print(f"Loaded {chunk} ({chunk_df.height:,} rows)")
+
+    return loaded_rows
+
+
+def backfill(paths: list, checkpoint_dir: str, uri_connection: str = None, workers: int = None,
+             gsod_paths: list = None) -> int:
+    """
+    Runs the three stages of the backfill over yearly archives. Running it again after a crash resumes
+    where it stopped.
+
+    Parameters:
+    - paths (list): Archive csv files or glob patterns.
+    - checkpoint_dir (str): Root of the backfill checkpoints.
+    - uri_connection (str): The connection URI to the database. If None, the chunks are only prepared.
+    - workers (int): Number of worker processes. Defaults to the number of cores.
+    - gsod_paths (list): GSOD files or glob patterns for the weather of the detections.
+
+    Returns:
+    - int: The number of rows loaded by this run.
+    """
+    files = sorted(file for path in paths for file in glob.glob(path))
+    raw_paths = [chunk for file in files for chunk in split_archive(file, checkpoint_dir)]
+    clean_paths = process_chunks(raw_paths, checkpoint_dir, workers=workers, gsod_paths=gsod_paths)
+
+    if uri_connection is None:
+        return 0
+
+    return load_chunks(clean_paths, uri_connection)
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Backfills processed_viirs from the FIRMS yearly archives.")
+    parser.add_argument("paths", nargs="+", help="archive csv files or glob patterns")
+    parser.add_argument("--checkpoint-dir", default="./.backfill")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--gsod", nargs="+", help="GSOD csv files or glob patterns, for the weather of the detections")
+    parser.add_argument("--no-load", action="store_true", help="only prepare the cleaned chunks")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    uri = None if args.no_load else config.get("CONNECTION_URI")
+    loaded = backfill(args.paths, args.checkpoint_dir, uri_connection=uri, workers=args.workers, gsod_paths=args.gsod)
+    print(f"{loaded:,} rows loaded")
+    write_summary(args.metrics_json)
@@ -0,0 +1,198 @@
+import os
+import gzip
+import argparse
+import threading
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Lighter versions of the province and district boundaries for the choropleth of the dashboard, one per level of
+# detail, written to BOUNDARIES_DIR by `python -m src.boundaries` (or on first use):
+#
+#     <layer>-<level>.geojson    quantized GeoJSON, read by the plotly choropleth
+#     <layer>-<level>.topojson   quantized TopoJSON (shared arcs, delta-encoded), for the other clients
+#
+# The boundaries are simplified as a coverage (shapely.coverage_simplify): the border between two neighbours is
+# simplified once, so that no gap or overlap opens between them. Most of the coordinates of the source files are
+# small islands, which the coarser levels leave out (the largest part of every area is always kept).
+BOUNDARY_SOURCES = {
+    "provinces": ("./data/batas-provinsi.geojson", ["provinsi"]),
+    "districts": ("./data/IndonesianCitiesDistrictsUpdated.json", ["id", "provinsi"]),
+}
+
+# The property matched with the hotspot counts, per layer
+FEATURE_ID = {"provinces": "provinsi", "districts": "id"}
+
+# The detections are tagged with the province names of the district file (first_adm), three of which are spelled
+# differently in the province file
+PROVINCE_NAMES = {
+    "D.I. Yogyakarta": "Daerah Istimewa Yogyakarta",
+    "DKI Jakarta": "Dki Jakarta",
+    "Bangka Belitung": "Kepulauan Bangka Belitung",
+}
+
+BOUNDARIES_DIR = "./data/boundaries"
+
+# level: (from zoom, simplification tolerance in degrees, smallest island kept in square degrees, decimals kept)
+LEVELS = {
+    "national": (0, 0.08, 0.1, 2),
+    "regional": (6, 0.01, 0.002, 3),
+    "local": (8, 0.002, 0.0, 4),
+}
+
+FORMATS = ("geojson", "topojson")
+
+_build_lock = threading.Lock()
+
+
+def boundary_level(zoom: float) -> str:
+    """
+    Returns the level of detail of the boundaries for a map zoom.
+
+    Parameters:
+    - zoom (float): The mapbox zoom.
+
+    Returns:
+    - str: A key of LEVELS.
+    """
+    level = "national"
+    for name, (min_zoom, _, _, _) in LEVELS.items():
+        if zoom >= min_zoom:
+            level = name
+    return level
+
+
+def boundary_path(layer: str, level: str, fmt: str = "geojson", directory: str = BOUNDARIES_DIR) -> str:
+    return os.path.join(directory, f"{layer}-{level}.{fmt}")
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def _polygon_parts(geometry) -> np.ndarray:
+    # make_valid may leave lines next to the polygons
+    parts = shapely.get_parts(shapely.get_parts(geometry))
+    return parts[shapely.get_type_id(parts) == 3]
+
+
+def _drop_small_parts(geometry, min_area: float):
+    parts = _polygon_parts(geometry)
+    if len(parts) == 0:
+        return geometry
+
+    areas = shapely.area(parts)
+    parts = parts[(areas >= min_area) | (areas == areas.max())]
+
+    return parts[0] if len(parts) == 1 else shapely.multipolygons(parts)
+
+
+def simplify_layer(gdf: gpd.GeoDataFrame, level: str) -> gpd.GeoDataFrame:
+    """
+    Builds one level of detail of a boundary layer.
+
+    Parameters:
+    - gdf (gpd.GeoDataFrame): The full resolution boundaries, in EPSG:4326.
+    - level (str): A key of LEVELS.
+
+    Returns:
+    - gpd.GeoDataFrame: The simplified boundaries, with their coordinates rounded to the decimals of the level.
+    """
+    _, tolerance, min_area, decimals = LEVELS[level]
+
+    geometries = shapely.make_valid(gdf.geometry.values)
+    geometries = np.array([_drop_small_parts(geometry, min_area) for geometry in geometries], dtype=object)
+    geometries = shapely.coverage_simplify(geometries, tolerance)
+    geometries = shapely.transform(geometries, lambda coordinates: np.round(coordinates, decimals))
+
+    return gdf.set_geometry(gpd.GeoSeries(geometries, index=gdf.index, crs=gdf.crs))
+
+
+def to_topojson(gdf: gpd.GeoDataFrame, decimals: int) -> str:
+    """
+    Encodes boundaries as TopoJSON, quantized to about the given number of decimals of a degree.
+
+    Returns:
+    - str: The TopoJSON document, or None if the topojson package is not installed.
+    """
+    try:
+        import topojson
+    except ImportError:
+        print("topojson is not installed, the TopoJSON encodings are skipped")
+        return None
+
+    return topojson.Topology(gdf, prequantize=int(360 * 10 ** decimals), topology=True).to_json()
+
+
+def build_boundaries(directory: str = BOUNDARIES_DIR) -> dict:
+    """
+    Writes every level of detail of every layer, as GeoJSON and TopoJSON.
+
+    Parameters:
+    - directory (str): Where the files are written.
+
+    Returns:
+    - dict: {layer: {"source": bytes, level: {format: bytes}}}, the sizes of the source and of the written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sizes = {}
+
+    for layer, (source, columns) in BOUNDARY_SOURCES.items():
+        gdf = gpd.read_file(source)[columns + ["geometry"]]
+        gdf["provinsi"] = gdf["provinsi"].replace(PROVINCE_NAMES)
+        sizes[layer] = {"source": os.path.getsize(source)}
+
+        for level, (_, _, _, decimals) in LEVELS.items():
+            simplified = simplify_layer(gdf, level)
+            encodings = {"geojson": simplified.to_json(drop_id=True, separators=(",", ":")),
+                         "topojson": to_topojson(simplified, decimals)}
+            sizes[layer][level] = {}
+
+            for fmt, document in encodings.items():
+                if document is None:
+                    continue
+                # written whole, then renamed: a server reading the file never sees half of it
+                path = boundary_path(layer, level, fmt, directory)
+                with open(f"{path}.tmp", "w") as f:
+                    f.write(document)
+                os.replace(f"{path}.tmp", path)
+                sizes[layer][level][fmt] = len(document.encode())
+
+    return sizes
+
+
+def boundary_file(layer: str, level: str, fmt: str = "geojson", directory: str = BOUNDARIES_DIR) -> str:
+    """
+    Returns the path of a level of detail, building the files first if they are missing.
+
+    Parameters:
+    - layer (str): "provinces" or "districts".
+    - level (str): A key of LEVELS.
+    - fmt (str): "geojson" or "topojson".
+
+    Returns:
+    - str: The path of the file.
+    """
+    if layer not in BOUNDARY_SOURCES or level not in LEVELS or fmt not in FORMATS:
+        raise ValueError(f"Unknown boundaries: {layer}-{level}.{fmt}")
+
+    path = boundary_path(layer, level, fmt, directory)
+    with _build_lock:
+        if not os.path.exists(path):
+            build_boundaries(directory)
+
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the simplified boundaries of the choropleth.")
+    parser.add_argument("--directory", default=BOUNDARIES_DIR)
+    args = parser.parse_args()
+
+    for layer, layer_sizes in build_boundaries(args.directory).items():
+        source = layer_sizes.pop("source")
+        print(f"{layer}: source {source / 1024:,.0f} KB")
+        for level, level_sizes in layer_sizes.items():
+            for fmt, size in level_sizes.items():
+                with open(boundary_path(layer, level, fmt, args.directory), "rb") as f:
+                    compressed = len(gzip.compress(f.read()))
+                print(f"    {level:<10}{fmt:<10}{size / 1024:>8,.0f} KB{compressed / 1024:>8,.0f} KB gzipped"
+                      f"{source / size:>8.1f}x smaller")
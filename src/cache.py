@@ -0,0 +1,414 @@
+import os
+import glob
+import time
+import shutil
+import contextlib
+import hashlib
+import threading
+
+import polars as pl
+
+from src.queries import fetch_query
+from src.metrics import count_cache
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Rendered dashboard components are kept in memory and on disk, keyed by the version of the data they were made from.
+# The on-disk copy lets a restarted (or another) worker skip the rendering as long as the data did not change.
+CACHE_DIR = os.environ.get("KABAR_API_CACHE_DIR", "./.cache")
+
+# How long a data version is trusted before asking the database again, in seconds
+VERSION_TTL = 300
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def fetch_data_version(table_name: str, uri_connection: str) -> str:
+    """
+    Returns a short fingerprint of the rows in a table, changing whenever rows are appended.
+    The fingerprint is the last date and the number of rows, and is reused for VERSION_TTL seconds. For
+    processed_viirs, only the rows of the last 31 days are counted: a backfill of older days is not seen.
+
+    Parameters:
+    - table_name (str): The table to fingerprint, "processed_viirs" or "idn_gsod" (the <table>_version query of
+                        src/queries.py).
+    - uri_connection (str): The connection URI to the Supabase database.
+
+    Returns:
+    - str: The data version, or None if the database could not be reached.
+    """
+    now = time.monotonic()
+
+    with _versions_lock:
+        cached = _versions.get(table_name)
+    fresh = cached is not None and now - cached[0] < VERSION_TTL
+    count_cache("data_version", fresh)
+    if fresh:
+        return cached[1]
+
+    stats = fetch_query(f"{table_name}_version", uri_connection)
+
+    if stats is None or stats.is_empty():
+        return cached[1] if cached is not None else None
+
+    version = f"{stats['last_date'][0]}-{stats['n_rows'][0]}"
+
+    with _versions_lock:
+        _versions[table_name] = (now, version)
+
+    return version
+
+
+def forget_data_version(table_name: str):
+    """
+    Drops the remembered version of a table, so that the next fetch_data_version asks the database again.
+    Called by the loaders right after appending rows.
+
+    Parameters:
+    - table_name (str): The table whose rows changed.
+    """
+    with _versions_lock:
+        _versions.pop(table_name, None)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class RenderCache:
+    """
+    Two-level (memory, then disk) cache of rendered text, such as chart HTML. Only the latest version of each name
+    is kept: storing a new version replaces the previous one in memory and removes its file.
+
+    Parameters:
+    - directory (str): Where the rendered files are written. Defaults to CACHE_DIR.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or CACHE_DIR
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str, version: str) -> str:
+        digest = hashlib.sha1(str(version).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}-{digest}.html")
+
+    def get(self, name: str, version: str):
+        """
+        Returns the text rendered for a version, from memory or else from disk.
+
+        Parameters:
+        - name (str): The component name, e.g. "calendar".
+        - version (str): The data version the text must have been rendered from.
+
+        Returns:
+        - str: The cached text, or None on a miss.
+        """
+        with self._lock:
+            cached = self._memory.get(name)
+        if cached is not None and cached[0] == version:
+            count_cache(f"render_{name}", True)
+            return cached[1]
+
+        try:
+            with open(self._path(name, version), encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            count_cache(f"render_{name}", False)
+            return None
+
+        count_cache(f"render_{name}", True)
+
+        with self._lock:
+            self._memory[name] = (version, text)
+
+        return text
+
+    def put(self, name: str, version: str, text: str):
+        """
+        Stores the text rendered for a version, replacing the previous version of the same name.
+
+        Parameters:
+        - name (str): The component name, e.g. "calendar".
+        - version (str): The data version the text was rendered from.
+        - text (str): The rendered text.
+        """
+        with self._lock:
+            previous = self._memory.get(name)
+            self._memory[name] = (version, text)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(name, version)
+
+            # write aside then rename, so other workers never read a half-written file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+        except OSError as e:
+            print(f"An error occurred while writing the cache of {name}: {e}")
+
+        if previous is not None and previous[0] != version:
+            # another worker may have removed it already
+            with contextlib.suppress(OSError):
+                os.remove(self._path(name, previous[0]))
+
+    def get_or_render(self, name: str, version: str, render):
+        """
+        Returns the cached text of a version, calling render() and storing its result on a miss.
+
+        Parameters:
+        - name (str): The component name, e.g. "calendar".
+        - version (str): The current data version. If None, render() is called and nothing is cached.
+        - render (callable): Produces the text, called without arguments.
+
+        Returns:
+        - str: The rendered text.
+        """
+        if version is None:
+            return render()
+
+        text = self.get(name, version)
+        if text is None:
+            text = render()
+            self.put(name, version, text)
+
+        return text
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class TileCache:
+    """
+    Disk cache of encoded map tiles, one directory per name and data version. Only the latest version of each name
+    is kept: storing a tile of a new version removes the tiles of the previous one.
+
+    Parameters:
+    - directory (str): Where the tiles are written. Defaults to CACHE_DIR/tiles.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.path.join(CACHE_DIR, "tiles")
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _version_dir(self, name: str, version: str) -> str:
+        digest = hashlib.sha1(str(version).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}-{digest}")
+
+    def _path(self, name: str, version: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self._version_dir(name, version), str(z), str(x), f"{y}.pbf")
+
+    def get(self, name: str, version: str, z: int, x: int, y: int):
+        """
+        Returns a cached tile.
+
+        Parameters:
+        - name (str): The tile set, e.g. "viirs-7" for the hotspots of the last 7 days.
+        - version (str): The data version the tile must have been made from.
+        - z, x, y (int): The tile coordinates.
+
+        Returns:
+        - bytes: The tile as stored, or None on a miss.
+        """
+        try:
+            with open(self._path(name, version, z, x, y), "rb") as f:
+                tile = f.read()
+        except OSError:
+            count_cache("tiles", False)
+            return None
+
+        count_cache("tiles", True)
+        return tile
+
+    def put(self, name: str, version: str, z: int, x: int, y: int, tile: bytes):
+        """
+        Stores a tile, dropping the tiles of the previous version of the same name.
+
+        Parameters:
+        - name (str): The tile set.
+        - version (str): The data version the tile was made from.
+        - z, x, y (int): The tile coordinates.
+        - tile (bytes): The encoded tile.
+        """
+        with self._lock:
+            previous = self._versions.get(name)
+            self._versions[name] = version
+
+        if previous != version:
+            # also the versions left by other workers or by a previous run
+            current = self._version_dir(name, version)
+            for version_dir in glob.glob(os.path.join(self.directory, f"{name}-*")):
+                if version_dir != current:
+                    shutil.rmtree(version_dir, ignore_errors=True)
+
+        path = self._path(name, version, z, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(tile)
+            os.replace(tmp_path, path)
+
+        except OSError as e:
+            print(f"An error occurred while writing the tile {name}/{z}/{x}/{y}: {e}")
+
+    def get_or_render(self, name: str, version: str, z: int, x: int, y: int, render) -> bytes:
+        """
+        Returns the cached tile of a version, calling render() and storing its result on a miss.
+
+        Parameters:
+        - name (str): The tile set.
+        - version (str): The current data version. If None, render() is called and nothing is cached.
+        - z, x, y (int): The tile coordinates.
+        - render (callable): Produces the tile, called without arguments.
+
+        Returns:
+        - bytes: The tile.
+        """
+        if version is None:
+            return render()
+
+        tile = self.get(name, version, z, x, y)
+        if tile is None:
+            tile = render()
+            self.put(name, version, z, x, y, tile)
+
+        return tile
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Fetched frames shared by the workers of a host. Each version of a dataset is written once as an uncompressed Arrow
+# IPC file, in shared memory when the host has /dev/shm, and every worker memory-maps that file instead of fetching and
+# keeping its own copy.
+SHARED_DIR = os.environ.get("KABAR_API_SHARED_DIR") or (
+    "/dev/shm/kabar-api" if os.path.isdir("/dev/shm") else os.path.join(CACHE_DIR, "frames")
+)
+
+
+class FrameCache:
+    """
+    Cache of polars DataFrames shared between processes through memory-mapped Arrow IPC files. Only the latest
+    version of each name is kept: storing a new version removes the file of the previous one (workers still mapping
+    it keep their pages until they let it go).
+
+    Parameters:
+    - directory (str): Where the Arrow IPC files are written. Defaults to SHARED_DIR.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or SHARED_DIR
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str, version: str) -> str:
+        digest = hashlib.sha1(str(version).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}-{digest}.arrow")
+
+    @contextlib.contextmanager
+    def _fetch_lock(self, name: str):
+        # held by the process fetching a name, so that the other workers wait for its file instead of fetching too
+        import fcntl
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f"{name}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, name: str, version: str) -> pl.DataFrame:
+        """
+        Returns the frame stored for a version, mapped from its file.
+
+        Parameters:
+        - name (str): The dataset name, e.g. "density_map-7".
+        - version (str): The data version the frame must have been fetched for.
+
+        Returns:
+        - pl.DataFrame: The frame, backed by the mapped file, or None on a miss.
+        """
+        with self._lock:
+            cached = self._frames.get(name)
+        if cached is not None and cached[0] == version:
+            count_cache("frames", True)
+            return cached[1]
+
+        try:
+            frame = pl.read_ipc(self._path(name, version), memory_map=True)
+        except OSError:
+            count_cache("frames", False)
+            return None
+
+        count_cache("frames", True)
+
+        with self._lock:
+            self._frames[name] = (version, frame)
+
+        return frame
+
+    def put(self, name: str, version: str, frame: pl.DataFrame) -> pl.DataFrame:
+        """
+        Stores the frame fetched for a version, replacing the previous version of the same name.
+
+        Parameters:
+        - name (str): The dataset name.
+        - version (str): The data version the frame was fetched for.
+        - frame (pl.DataFrame): The fetched frame.
+
+        Returns:
+        - pl.DataFrame: The frame mapped from the written file, so that this process drops its own copy, or the given
+                        frame if it could not be written.
+        """
+        path = self._path(name, version)
+        # written aside then renamed, so other workers never map a half-written file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            frame.write_ipc(tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path)
+
+        except OSError as e:
+            print(f"An error occurred while writing the shared frame {name}: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            return frame
+
+        # the previous versions, also those left by other workers or by a previous run
+        for previous in glob.glob(os.path.join(self.directory, f"{name}-{'?' * 16}.arrow")):
+            if previous != path:
+                with contextlib.suppress(OSError):
+                    os.remove(previous)
+
+        return self.get(name, version)
+
+    def get_or_fetch(self, name: str, version: str, fetch) -> pl.DataFrame:
+        """
+        Returns the shared frame of a version, calling fetch() and storing its result on a miss. A single worker of
+        the host fetches a version, the others wait for it and map its file.
+
+        Parameters:
+        - name (str): The dataset name, e.g. "density_map-7".
+        - version (str): The current data version. If None, fetch() is called and nothing is cached.
+        - fetch (callable): Fetches the frame, called without arguments. It may return None on failure.
+
+        Returns:
+        - pl.DataFrame: The frame, or None if it had to be fetched and fetch() failed.
+        """
+        if version is None:
+            return fetch()
+
+        frame = self.get(name, version)
+        if frame is not None:
+            return frame
+
+        with self._fetch_lock(name):
+            # fetched by another worker while this one waited
+            frame = self.get(name, version)
+            if frame is None:
+                frame = fetch()
+                if frame is not None:
+                    frame = self.put(name, version, frame)
+
+        return frame
+
+
+# The hotspot windows of the density map and of the tiles
+SHARED_FRAMES = FrameCache()
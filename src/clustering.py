@@ -0,0 +1,517 @@
+import os
+import argparse
+import datetime
+
+import numpy as np
+import polars as pl
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.queries import fetch_query
+from src.metrics import instrumented, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Fire events are groups of VIIRS detections close in space and time, found with a DBSCAN-style rule:
+# two detections are neighbors when they are at most eps_km apart and at most eps_hours apart, a detection with at least
+# min_samples neighbors (itself included) is a core detection, and core detections chained through neighbors form
+# one event.
+#
+# Detections are hashed into a (lat, lon, time) grid whose cells are eps_km / sqrt(2) wide and eps_hours long, so that
+# all the detections of a cell are neighbors of each other: a cell is linked as a whole, and distances only have to be
+# checked between the detections of nearby cells.
+#
+# The events are kept in EVENTS_PATH and extended with the days of processed_viirs not clustered yet, one day per batch:
+#
+#     python -m src.clustering --since 2023-08-01     # start the file from a day
+#     python -m src.clustering                        # add the days up to yesterday, list the active events
+EVENTS_PATH = "./data/clustering/fire-events.parquet"
+
+# Days clustered when there is no file yet and no first day is given
+UPDATE_DAYS = 7
+
+# Columns of the detections kept in the file
+EVENT_COLUMNS = ["latitude", "longitude", "acq_date", "acq_time", "frp", "second_adm", "first_adm"]
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+
+# Offsets to the cells that may hold neighbors of a cell: two cells away in space (enough up to 45 degrees of latitude),
+# one in time
+_NEIGHBOR_OFFSETS = np.array([(i, j, k) for i in range(-2, 3) for j in range(-2, 3) for k in (-1, 0, 1)], dtype=np.int64)
+
+# Half of them (without the cell itself), so that each pair of cells is visited once
+_HALF_OFFSETS = np.array([offset for offset in _NEIGHBOR_OFFSETS if tuple(offset) > (0, 0, 0)], dtype=np.int64)
+
+# Cells grouped in blocks as wide as the neighbor reach, used to find the detections a new batch can affect
+_BLOCK = np.array([2, 2, 1], dtype=np.int64)
+
+# Cell coordinates are packed in one int64 key, 21 bits each
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+
+# Number of candidate detection pairs checked at once, bounds the memory used in dense areas
+PAIR_CHUNK_SIZE = 2_000_000
+
+
+def detection_hours(df: pl.DataFrame) -> np.ndarray:
+    """
+    Returns the acquisition time of each detection in hours since 1970-01-01 (UTC).
+
+    Parameters:
+    - df (pl.DataFrame): Detections with acq_date (Date) and acq_time (HHMM integer) columns.
+
+    Returns:
+    - np.ndarray: The acquisition times as float64 hours.
+    """
+    days = df["acq_date"].cast(pl.Int32).to_numpy().astype(np.float64)
+    acq_time = df["acq_time"].cast(pl.Int32).to_numpy()
+
+    return days * 24.0 + acq_time // 100 + (acq_time % 100) / 60.0
+
+
+def _pack(cells: np.ndarray) -> np.ndarray:
+    shifted = cells + _KEY_OFFSET
+    return (shifted[:, 0] << (2 * _KEY_BITS)) | (shifted[:, 1] << _KEY_BITS) | shifted[:, 2]
+
+
+def _unpack(keys: np.ndarray) -> np.ndarray:
+    mask = (1 << _KEY_BITS) - 1
+    return np.column_stack([keys >> (2 * _KEY_BITS), (keys >> _KEY_BITS) & mask, keys & mask]) - _KEY_OFFSET
+
+
+def _blocks_around(blocks: np.ndarray, reach: int) -> np.ndarray:
+    # keys of all the blocks at most `reach` blocks away from the given ones
+    steps = range(-reach, reach + 1)
+    offsets = np.array([(i, j, k) for i in steps for j in steps for k in steps], dtype=np.int64)
+    return np.unique(_pack((_unpack(blocks)[:, None, :] + offsets).reshape(-1, 3)))
+
+
+class _Grid:
+    """
+    Detections sorted by grid cell: the members of unique cell c are order[starts[c]:starts[c] + counts[c]].
+    """
+
+    def __init__(self, cells: np.ndarray):
+        keys = _pack(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.cells = cells[self.order[self.starts]]
+
+        # unique cell of each detection
+        self.cell_of = np.empty(len(keys), dtype=np.int64)
+        self.cell_of[self.order] = np.repeat(np.arange(len(self.keys)), self.counts)
+
+
+def _close_pairs(grid: _Grid, lat, lon, hours, eps_km: float, eps_hours: float, cell_filter=None):
+    """
+    Yields, chunk by chunk, the pairs of neighbor detections lying in different cells of the grid.
+
+    Parameters:
+    - grid (_Grid): The grid of the detections.
+    - lat, lon, hours (np.ndarray): Coordinates of the detections.
+    - eps_km (float), eps_hours (float): The neighbor thresholds.
+    - cell_filter (np.ndarray): Boolean per unique cell; if given, only pairs with a detection in such a cell are searched.
+
+    Yields:
+    - tuple: Two int arrays (i, j) indexing the detections.
+    """
+    lon_km = KM_PER_DEG_LON * np.cos(np.radians(lat))
+
+    for offset in _HALF_OFFSETS:
+        target = _pack(grid.cells + offset)
+        other = np.minimum(np.searchsorted(grid.keys, target), len(grid.keys) - 1)
+        found = grid.keys[other] == target
+        a, b = np.nonzero(found)[0], other[found]
+
+        if cell_filter is not None:
+            keep = cell_filter[a] | cell_filter[b]
+            a, b = a[keep], b[keep]
+
+        sizes = grid.counts[a] * grid.counts[b]
+        if len(sizes) == 0:
+            continue
+
+        # split the cell pairs so that each chunk expands to about PAIR_CHUNK_SIZE detection pairs
+        total = np.cumsum(sizes)
+        bounds = np.searchsorted(total, np.arange(PAIR_CHUNK_SIZE, total[-1], PAIR_CHUNK_SIZE), side="right")
+
+        for a_chunk, b_chunk in zip(np.split(a, bounds), np.split(b, bounds)):
+            if len(a_chunk) == 0:
+                continue
+
+            # all detection pairs between the members of cell a and cell b
+            n_b = grid.counts[b_chunk]
+            chunk_sizes = grid.counts[a_chunk] * n_b
+            pair = np.repeat(np.arange(len(a_chunk)), chunk_sizes)
+            within = np.arange(chunk_sizes.sum()) - np.repeat(np.cumsum(chunk_sizes) - chunk_sizes, chunk_sizes)
+            i = grid.order[grid.starts[a_chunk][pair] + within // n_b[pair]]
+            j = grid.order[grid.starts[b_chunk][pair] + within % n_b[pair]]
+
+            # space-time check, with the longitude scaled at the latitude of the first detection (the two are
+            # at most a few kilometers apart)
+            dx = (lon[i] - lon[j]) * lon_km[i]
+            dy = (lat[i] - lat[j]) * KM_PER_DEG_LAT
+            close = (dx * dx + dy * dy <= eps_km * eps_km) & (np.abs(hours[i] - hours[j]) <= eps_hours)
+
+            yield i[close], j[close]
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class FireEventClusterer:
+    """
+    Clusters VIIRS detections into fire events, batch after batch. Each new batch only re-clusters the grid cells
+    around its detections: events can grow and merge when new detections arrive, but existing ones never split.
+
+    Parameters:
+    - eps_km (float): Maximum distance between two neighbor detections, in kilometers.
+    - eps_hours (float): Maximum time between two neighbor detections, in hours.
+    - min_samples (int): Minimum number of neighbors (itself included) for a detection to start or extend an event.
+                         With 1, every detection belongs to an event.
+    """
+
+    def __init__(self, eps_km: float = 1.0, eps_hours: float = 24.0, min_samples: int = 1):
+        self.eps_km = eps_km
+        self.eps_hours = eps_hours
+        self.min_samples = min_samples
+
+        # grid cell size, in degrees and hours; a degree of longitude is at most KM_PER_DEG_LON long
+        side_km = eps_km / np.sqrt(2)
+        self._cell_size = np.array([side_km / KM_PER_DEG_LAT, side_km / KM_PER_DEG_LON, eps_hours])
+
+        # the arrays of every detection, in insertion order, are the first _n rows of buffers grown geometrically
+        self._n = 0
+        self._batches = []
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self._hours = np.empty(0)
+        self._cells = np.empty((0, 3), dtype=np.int64)
+        self._core = np.empty(0, dtype=bool)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._next_event = 0
+
+        # old event id -> surviving event id, for the events merged by the last batch
+        self.last_merges = {}
+
+    def _grid(self, lat, lon, hours) -> np.ndarray:
+        return np.floor(np.column_stack([lat, lon, hours]) / self._cell_size).astype(np.int64)
+
+    def _reserve(self, n: int):
+        # room for n detections, doubling the buffers so that a batch costs its own size and not the history's
+        if n <= len(self._labels):
+            return
+        capacity = max(2 * len(self._labels), n, 1024)
+        for name in ("_lat", "_lon", "_hours", "_cells", "_core", "_labels"):
+            buffer = getattr(self, name)
+            grown = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+            grown[:self._n] = buffer[:self._n]
+            setattr(self, name, grown)
+
+    def add_batch(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Adds a batch of detections and updates the events around them.
+
+        Parameters:
+        - df (pl.DataFrame): Detections with at least latitude, longitude, acq_date (Date) and acq_time columns,
+                             e.g. a cleaned batch of processed_viirs.
+
+        Returns:
+        - pl.DataFrame: The batch with an event_id column (-1 for detections not part of any event).
+        """
+        if df.is_empty():
+            return df.with_columns(pl.lit(-1, dtype=pl.Int64).alias("event_id"))
+
+        n_old = self._n
+        lat = df["latitude"].cast(pl.Float64).to_numpy()
+        lon = df["longitude"].cast(pl.Float64).to_numpy()
+        hours = detection_hours(df)
+        cells = self._grid(lat, lon, hours)
+
+        self._reserve(n_old + len(df))
+        batch = slice(n_old, n_old + len(df))
+        self._lat[batch] = lat
+        self._lon[batch] = lon
+        self._hours[batch] = hours
+        self._cells[batch] = cells
+        self._core[batch] = False
+        self._labels[batch] = -1
+        self._n += len(df)
+
+        # touched detections: the ones that may be neighbors of the new detections, i.e. in the blocks around them.
+        # Their neighbors (one more block away) are re-clustered with them, older detections elsewhere are left as is
+        subset = np.arange(n_old, self._n)
+        in_touched = np.ones(len(df), dtype=bool)
+
+        if n_old:
+            new_blocks = np.unique(_pack(cells // _BLOCK))
+            window = self._cells[:n_old, 2] >= cells[:, 2].min() - 2 * _BLOCK[2]
+            window &= self._cells[:n_old, 2] <= cells[:, 2].max() + 2 * _BLOCK[2]
+            candidates = np.nonzero(window)[0]
+
+            old_blocks = _pack(self._cells[candidates] // _BLOCK)
+            near = np.isin(old_blocks, _blocks_around(new_blocks, 2))
+            touched = np.isin(old_blocks[near], _blocks_around(new_blocks, 1))
+
+            subset = np.concatenate([candidates[near], subset])
+            in_touched = np.concatenate([touched, in_touched])
+
+        self._recluster(subset, in_touched)
+
+        # the batches are only joined when the whole history is asked for (detections, events, save)
+        self._batches.append(df.drop([column for column in ("event_id", "core") if column in df.columns]))
+
+        return df.with_columns(pl.Series("event_id", self._labels[batch].copy()))
+
+    def _recluster(self, subset: np.ndarray, in_touched: np.ndarray):
+        m = len(subset)
+        lat, lon, hours = self._lat[subset], self._lon[subset], self._hours[subset]
+        grid = _Grid(self._cells[subset])
+
+        # a detection in a cell of at least min_samples detections is a core one; in sparser cells the neighbors
+        # from the other cells are counted. Counts are complete for the touched detections only, the others keep
+        # their core status
+        border_pairs = []
+        if self.min_samples > 1:
+            sparse = grid.counts < self.min_samples
+            counts = grid.counts[grid.cell_of]
+            for i, j in _close_pairs(grid, lat, lon, hours, self.eps_km, self.eps_hours, cell_filter=sparse):
+                counts += np.bincount(i, minlength=m) + np.bincount(j, minlength=m)
+                border_pairs.append((i, j))
+            is_core = counts >= self.min_samples
+        else:
+            is_core = np.ones(m, dtype=bool)
+
+        core = self._core[subset] | (in_touched & is_core)
+        self._core[subset] = core
+
+        # graph of the core detections: each one linked to the first core detection of its cell, the first core
+        # detections of two cells linked when any of their core detections are neighbors, plus one node per
+        # existing event linked to its core detections
+        core_idx = np.nonzero(core)[0]
+        core_grid = _Grid(self._cells[subset][core_idx])
+        first = core_idx[core_grid.order[core_grid.starts]]
+
+        rows = [core_idx]
+        cols = [first[core_grid.cell_of]]
+        for i, j in _close_pairs(core_grid, lat[core_idx], lon[core_idx], hours[core_idx], self.eps_km, self.eps_hours):
+            linked_cells = np.unique(core_grid.cell_of[i] * len(first) + core_grid.cell_of[j])
+            rows.append(first[linked_cells // len(first)])
+            cols.append(first[linked_cells % len(first)])
+
+        labels = self._labels[subset]
+        labeled_core = np.nonzero(core & (labels >= 0))[0]
+        old_events, event_node = np.unique(labels[labeled_core], return_inverse=True)
+        rows.append(labeled_core)
+        cols.append(m + event_node)
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(m + len(old_events),) * 2)
+        _, component = connected_components(graph, directed=False)
+
+        # each component keeps the smallest event id it contains, or opens a new event
+        no_event = np.iinfo(np.int64).max
+        component_event = np.full(component.max() + 1, no_event)
+        np.minimum.at(component_event, component[m:], old_events)
+        fresh = np.unique(component[core_idx][component_event[component[core_idx]] == no_event])
+        component_event[fresh] = np.arange(self._next_event, self._next_event + len(fresh))
+        self._next_event += len(fresh)
+
+        new_labels = labels.copy()
+        new_labels[core_idx] = component_event[component[core_idx]]
+
+        # border detections join the event of a core neighbor, from their own cell or a nearby one
+        if self.min_samples > 1:
+            cell_event = np.full(len(grid.keys), -1)
+            cell_event[grid.cell_of[core_idx]] = new_labels[core_idx]
+            border = (~core) & (new_labels < 0)
+            new_labels[border] = cell_event[grid.cell_of[border]]
+
+            for i, j in border_pairs:
+                for a, b in ((i, j), (j, i)):
+                    border = (~core[a]) & core[b] & (new_labels[a] < 0)
+                    new_labels[a[border]] = new_labels[b[border]]
+
+        self._labels[subset] = new_labels
+
+        # events connected by the new detections are merged into the oldest one
+        merged = component_event[component[m:]]
+        self.last_merges = {int(old): int(new) for old, new in zip(old_events, merged) if old != new}
+        if self.last_merges:
+            remap = np.arange(self._next_event)
+            remap[list(self.last_merges)] = list(self.last_merges.values())
+            labels = self._labels[:self._n]
+            labeled = labels >= 0
+            labels[labeled] = remap[labels[labeled]]
+
+    @property
+    def labels(self) -> np.ndarray:
+        """
+        The event id of every detection added so far, in insertion order (-1 when not part of an event).
+        """
+        return self._labels[:self._n]
+
+    @property
+    def detections(self) -> pl.DataFrame:
+        """
+        Every detection added so far, in insertion order, with its current event_id. None before the first batch.
+        """
+        if not self._batches:
+            return None
+        if len(self._batches) > 1:
+            self._batches = [pl.concat(self._batches, how="diagonal")]
+
+        # labels of older detections may have changed since their batch (merged events, new border detections)
+        return self._batches[0].with_columns(pl.Series("event_id", self.labels.copy()))
+
+    def events(self) -> pl.DataFrame:
+        """
+        Summarizes the events found so far.
+
+        Returns:
+        - pl.DataFrame: One row per event with its number of detections, first and last acquisition dates,
+                        centroid, and summed fire radiative power when the detections carry a frp column.
+        """
+        detections = self.detections
+        if detections is None:
+            return pl.DataFrame()
+
+        aggregations = [
+            pl.count().alias("n_detections"),
+            pl.col("acq_date").min().alias("start_date"),
+            pl.col("acq_date").max().alias("end_date"),
+            pl.col("latitude").mean().alias("latitude"),
+            pl.col("longitude").mean().alias("longitude"),
+        ]
+        if "frp" in detections.columns:
+            aggregations.append(pl.col("frp").sum().alias("total_frp"))
+
+        return (
+            detections
+            .filter(pl.col("event_id") >= 0)
+            .group_by("event_id")
+            .agg(aggregations)
+            .sort("event_id")
+        )
+
+    def save(self, path: str):
+        """
+        Writes the clustered detections to a Parquet file, so that the next ETL run can continue from them.
+
+        Parameters:
+        - path (str): The Parquet file to write.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # written whole, then renamed: a reader never sees half of it
+        self.detections.with_columns(pl.Series("core", self._core[:self._n])).write_parquet(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path: str, **params) -> "FireEventClusterer":
+        """
+        Restores a clusterer from a file written by save.
+
+        Parameters:
+        - path (str): The Parquet file to read.
+        - **params: eps_km, eps_hours and min_samples, which must match the ones used to build the file.
+
+        Returns:
+        - FireEventClusterer: The restored clusterer, empty if the file does not exist.
+        """
+        clusterer = cls(**params)
+        if not os.path.exists(path):
+            return clusterer
+
+        detections = pl.read_parquet(path)
+
+        clusterer._core = detections["core"].to_numpy().astype(bool)
+        clusterer._labels = detections["event_id"].to_numpy().astype(np.int64)
+        clusterer._lat = detections["latitude"].cast(pl.Float64).to_numpy()
+        clusterer._lon = detections["longitude"].cast(pl.Float64).to_numpy()
+        clusterer._hours = detection_hours(detections)
+        clusterer._cells = clusterer._grid(clusterer._lat, clusterer._lon, clusterer._hours)
+        clusterer._n = detections.height
+        clusterer._next_event = int(clusterer._labels.max()) + 1 if len(clusterer._labels) else 0
+        clusterer._batches = [detections.drop(["core", "event_id"])]
+
+        return clusterer
+
+
+def cluster_detections(df: pl.DataFrame, eps_km: float = 1.0, eps_hours: float = 24.0, min_samples: int = 1) -> pl.DataFrame:
+    """
+    Clusters a set of detections into fire events in one go.
+
+    Parameters:
+    - df (pl.DataFrame): Detections with latitude, longitude, acq_date (Date) and acq_time columns.
+    - eps_km (float): Maximum distance between two neighbor detections, in kilometers.
+    - eps_hours (float): Maximum time between two neighbor detections, in hours.
+    - min_samples (int): Minimum number of neighbors (itself included) for a detection to start or extend an event.
+
+    Returns:
+    - pl.DataFrame: The detections with an event_id column (-1 for detections not part of any event).
+    """
+    clusterer = FireEventClusterer(eps_km=eps_km, eps_hours=eps_hours, min_samples=min_samples)
+    return clusterer.add_batch(df)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("transform")
+def update_events(uri_connection: str, first_day: datetime.date = None, last_day: datetime.date = None,
+                  path: str = EVENTS_PATH, **params) -> FireEventClusterer:
+    """
+    Clusters the detections of processed_viirs not clustered yet into the saved events, one day per batch.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Supabase database.
+    - first_day (datetime.date): First day clustered, for a new file. Defaults to UPDATE_DAYS days before last_day.
+                                 With a file, the days up to its last one are not clustered again.
+    - last_day (datetime.date): Last day clustered. Defaults to yesterday, the last complete day of detections.
+    - path (str): Where the clustered detections are saved.
+    - **params: eps_km, eps_hours and min_samples, the same for every run on a file.
+
+    Returns:
+    - FireEventClusterer: The updated clusterer, or None if the detections could not be read (the file is left as is).
+    """
+    last_day = last_day or datetime.date.today() - datetime.timedelta(days=1)
+    first_day = first_day or last_day - datetime.timedelta(days=UPDATE_DAYS - 1)
+
+    clusterer = FireEventClusterer.load(path, **params)
+    if clusterer.detections is not None:
+        # batches are only appended: a day already in the file would be counted twice
+        first_day = max(first_day, clusterer.detections["acq_date"].max() + datetime.timedelta(days=1))
+
+    day = first_day
+    while day <= last_day:
+        batch = fetch_query("export_hotspots", uri_connection, day=day, provinces="", districts="")
+        if batch is None:
+            return None
+        clusterer.add_batch(batch.select(EVENT_COLUMNS))
+        day += datetime.timedelta(days=1)
+
+    if clusterer.detections is not None:
+        clusterer.save(path)
+
+    return clusterer
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Clusters the new hotspots into the saved fire events and lists the "
+                                                 "active events.")
+    parser.add_argument("--since", type=datetime.date.fromisoformat,
+                        help=f"first day clustered without a file, defaults to the last {UPDATE_DAYS} days")
+    parser.add_argument("--path", default=EVENTS_PATH)
+    parser.add_argument("--eps-km", type=float, default=1.0)
+    parser.add_argument("--eps-hours", type=float, default=24.0)
+    parser.add_argument("--min-samples", type=int, default=1)
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    clusterer = update_events(config.get("CONNECTION_URI"), first_day=args.since, path=args.path, eps_km=args.eps_km,
+                              eps_hours=args.eps_hours, min_samples=args.min_samples)
+    if clusterer is not None:
+        events = clusterer.events()
+        if not events.is_empty():
+            # the events with detections on the last day clustered
+            with pl.Config(tbl_rows=20):
+                print(events.filter(pl.col("end_date") == events["end_date"].max())
+                      .sort("n_detections", descending=True).head(20))
+    write_summary(args.metrics_json)
@@ -0,0 +1,199 @@
+import os
+import re
+import zlib
+import argparse
+
+import numpy as np
+import polars as pl
+
+from src.metrics import instrumented, count_cache
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Near-duplicate articles: the outlets syndicate the same wire story with small edits (a new title, a paragraph cut or
+# added), which the URL does not catch. Every article gets a MinHash signature of the word SHINGLE_WORDS-grams of its
+# text, whose share of equal values estimates the Jaccard similarity of two texts. The signatures are cut in BANDS
+# bands of ROWS values, and two articles are compared only when they share a whole band (locality-sensitive hashing):
+# a new article is looked up in BANDS hash tables instead of against every past article.
+#
+# With 32 bands of 4 rows, two texts of Jaccard similarity 0.7 share a band with probability 0.9998, 0.5 with 0.87 and
+# 0.2 with 0.05; the candidates are then kept above DUPLICATE_SIMILARITY. A rewritten lead or an added "Baca juga" line
+# leave a syndicated copy well above it.
+#
+# The index of the stories already seen is saved to INDEX_PATH between the ETL runs: the signatures of the first
+# article of every story, and the URL of every article seen with the story it belongs to. The texts of less than
+# SHINGLE_WORDS words have no shingle to compare: they are kept, and only their URL is recorded.
+INDEX_PATH = "./data/dedup/article-minhash.npz"
+
+SHINGLE_WORDS = 3
+
+BANDS = 32
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+
+DUPLICATE_SIMILARITY = 0.7
+
+# Universal hashing of the 32-bit shingle hashes, (a * x + b) mod p, with p the smallest prime above 2 ** 32
+_PRIME = np.uint64((1 << 32) + 15)
+_rng = np.random.default_rng(20231001)
+_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str) -> np.ndarray:
+    """
+    Returns the 32-bit hashes of the word SHINGLE_WORDS-grams of a text, case and punctuation ignored.
+    """
+    words = _WORD.findall(text.lower())
+    grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint64, count=len(grams)))
+
+
+def minhash(text: str) -> np.ndarray:
+    """
+    Returns the MinHash signature of a text, NUM_PERM uint32 values.
+    """
+    hashes = shingles(text)
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def _band_keys(signature: np.ndarray) -> list:
+    return [(band, signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+
+class MinHashIndex:
+    """
+    LSH index of the signatures of the stories seen.
+
+    Parameters:
+    - signatures (np.ndarray): (stories, NUM_PERM) signatures of the first article of every story.
+    - story_urls (list): URL of the first article of every story.
+    - seen (dict): {url: story URL} of every article seen.
+    """
+
+    def __init__(self, signatures: np.ndarray = None, story_urls: list = None, seen: dict = None):
+        self.story_urls = list(story_urls or [])
+        self.seen = dict(seen or {})
+        # grown by doubling, the signatures of the stories are self._signatures[:len(self)]
+        self._signatures = signatures if signatures is not None else np.empty((0, NUM_PERM), dtype=np.uint32)
+        self.buckets = {}
+        for story, signature in enumerate(self.signatures):
+            self._index(story, signature)
+
+    def __len__(self):
+        return len(self.story_urls)
+
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._signatures[:len(self)]
+
+    def _index(self, story: int, signature: np.ndarray):
+        for key in _band_keys(signature):
+            self.buckets.setdefault(key, []).append(story)
+
+    def query(self, signature: np.ndarray, threshold: float = DUPLICATE_SIMILARITY) -> str:
+        """
+        Finds the most similar story above a threshold.
+
+        Returns:
+        - str: The URL of the story, or None if the signature is of a new story.
+        """
+        candidates = {story for key in _band_keys(signature) for story in self.buckets.get(key, ())}
+        if not candidates:
+            return None
+
+        candidates = np.fromiter(candidates, dtype=np.int64)
+        similarity = (self._signatures[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+
+        return self.story_urls[candidates[best]] if similarity[best] >= threshold else None
+
+    def add(self, url: str, signature: np.ndarray, story_url: str = None):
+        """
+        Records an article, as the first of a new story if story_url is None.
+        """
+        if story_url is None:
+            story_url = url
+            story = len(self)
+            if story == len(self._signatures):
+                grown = np.empty((max(2 * story, 1024), NUM_PERM), dtype=np.uint32)
+                grown[:story] = self.signatures
+                self._signatures = grown
+            self._signatures[story] = signature
+            self._index(story, signature)
+            self.story_urls.append(url)
+        self.seen[url] = story_url
+
+    def save(self, path: str = INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # written whole, then renamed: a reader never sees half of it
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez_compressed(f, signatures=self.signatures, story_urls=np.array(self.story_urls, dtype=str),
+                                urls=np.array(list(self.seen), dtype=str),
+                                url_stories=np.array(list(self.seen.values()), dtype=str))
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH) -> "MinHashIndex":
+        """
+        Reads a saved index.
+
+        Returns:
+        - MinHashIndex: The index, empty if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path) as saved:
+            return cls(saved["signatures"], saved["story_urls"].tolist(),
+                       dict(zip(saved["urls"].tolist(), saved["url_stories"].tolist())))
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("transform")
+def dedup_articles(df: pl.DataFrame, index: MinHashIndex, threshold: float = DUPLICATE_SIMILARITY) -> pl.DataFrame:
+    """
+    Drops the articles already seen or near-duplicates of a story already seen, and adds the new stories to the index.
+
+    Parameters:
+    - df (pl.DataFrame): The articles, as returned by cleaning_articles.
+    - index (MinHashIndex): The stories seen by the previous runs, updated in place.
+    - threshold (float): Estimated Jaccard similarity from which two texts are the same story.
+
+    Returns:
+    - pl.DataFrame: The first article of every new story, in the order of df. The earliest published article of a
+                    story is kept.
+    """
+    keep = np.zeros(df.height, dtype=bool)
+    order = np.argsort(df["published_time"].to_physical().fill_null(0).to_numpy(), kind="stable")
+    urls, texts = df["url"].to_list(), df["article_text"].fill_null("").to_list()
+
+    for i in order:
+        if urls[i] in index.seen:
+            count_cache("articles_dedup", True)
+            continue
+
+        if len(_WORD.findall(texts[i].lower())) < SHINGLE_WORDS:
+            # too short for a single shingle: every such text would get the same signature. Kept, and only its URL
+            # recorded, as a story of its own without a signature
+            index.seen[urls[i]] = urls[i]
+            count_cache("articles_dedup", False)
+            keep[i] = True
+            continue
+
+        signature = minhash(texts[i])
+        story_url = index.query(signature, threshold)
+        index.add(urls[i], signature, story_url)
+        count_cache("articles_dedup", story_url is not None)
+        keep[i] = story_url is None
+
+    return df.filter(pl.Series(keep))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Describes the saved index of the articles seen.")
+    parser.add_argument("--path", default=INDEX_PATH)
+    args = parser.parse_args()
+
+    index = MinHashIndex.load(args.path)
+    print(f"{len(index.seen):,} articles seen, {len(index):,} stories")
@@ -0,0 +1,339 @@
+import io
+import os
+import glob
+import zlib
+import shutil
+import hashlib
+import datetime
+import threading
+import contextlib
+
+import polars as pl
+
+from src.cache import CACHE_DIR
+from src.queries import fetch_query
+from src.metrics import count_cache
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Exports of processed_viirs for the analysts, by date range, provinces and districts, served by the /export route of
+# the dashboard server. The rows are read one day at a time with the export_hotspots query (one partition of the
+# table, a few thousand rows), written as they come and sent in chunks, so that an export of millions of rows never
+# sits whole in memory:
+#   - csv      CSV with a header, compressed whole with gzip or zstd (.csv.gz, .csv.zst)
+#   - parquet  Parquet, one row group per day, the column chunks compressed with gzip or zstd
+#   - arrow    Arrow IPC stream, one record batch per day, compressed whole with gzip or zstd (.arrows.gz, .arrows.zst)
+#
+# An export is made once per data version of processed_viirs: while it is streamed, it is also written to
+# EXPORT_DIR, and the next requests of the same export, including the Range requests of a download resumed after a
+# cut, are served from that file. Only the files of the latest data version are kept.
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+
+EXPORT_COLUMNS = {
+    "latitude": pl.Float64, "longitude": pl.Float64, "brightness": pl.Float32, "acq_date": pl.Date,
+    "acq_time": pl.Int32, "satellite": pl.Utf8, "instrument": pl.Utf8, "confidence": pl.Utf8, "version": pl.Utf8,
+    "frp": pl.Float32, "daynight": pl.Utf8, "second_adm": pl.Utf8, "first_adm": pl.Utf8,
+}
+
+# format: (file extension, mimetype)
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrows", "application/vnd.apache.arrow.stream"),
+}
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+# Longest date range of an export
+EXPORT_MAX_DAYS = 3_660
+
+# Bytes gathered before a chunk is sent
+CHUNK_BYTES = 1 << 20
+
+
+class ExportRequest:
+    """
+    The rows and the file format of an export.
+
+    Parameters:
+    - first_day (datetime.date): First acquisition day.
+    - last_day (datetime.date): Last acquisition day.
+    - provinces (list): Provinces (first_adm) kept, all if empty.
+    - districts (list): Districts (second_adm) kept, all if empty.
+    - fmt (str): A key of EXPORT_FORMATS.
+    - compression (str): One of COMPRESSIONS.
+    """
+
+    def __init__(self, first_day: datetime.date, last_day: datetime.date, provinces: list = None,
+                 districts: list = None, fmt: str = "csv", compression: str = "gzip"):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd" and fmt != "parquet":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise ValueError("zstandard is not installed, zstd compression is not available")
+        if last_day < first_day or (last_day - first_day).days >= EXPORT_MAX_DAYS:
+            raise ValueError(f"The date range must be 1 to {EXPORT_MAX_DAYS} days")
+        if any("," in name for name in [*(provinces or []), *(districts or [])]):
+            raise ValueError("Province and district names cannot contain commas")
+
+        self.first_day = first_day
+        self.last_day = last_day
+        self.provinces = sorted(set(provinces or []))
+        self.districts = sorted(set(districts or []))
+        self.fmt = fmt
+        self.compression = compression
+
+    @classmethod
+    def from_args(cls, fmt: str, args) -> "ExportRequest":
+        """
+        Reads an export request from the query string of the /export route: start and end (YYYY-MM-DD, end defaults
+        to start), province and district (repeated for several) and compression (gzip by default).
+        """
+        try:
+            first_day = datetime.date.fromisoformat(args.get("start", ""))
+            last_day = datetime.date.fromisoformat(args.get("end") or args.get("start"))
+        except ValueError:
+            raise ValueError("start and end must be dates, YYYY-MM-DD")
+
+        return cls(first_day, last_day, args.getlist("province"), args.getlist("district"), fmt,
+                   args.get("compression", "gzip"))
+
+    @property
+    def key(self) -> str:
+        text = "|".join([self.first_day.isoformat(), self.last_day.isoformat(), ",".join(self.provinces),
+                         ",".join(self.districts), self.fmt, self.compression])
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    @property
+    def filename(self) -> str:
+        extension = EXPORT_FORMATS[self.fmt][0]
+        if self.fmt != "parquet" and self.compression != "none":
+            extension += ".gz" if self.compression == "gzip" else ".zst"
+        return f"hotspots-{self.first_day}-{self.last_day}.{extension}"
+
+    @property
+    def mimetype(self) -> str:
+        if self.fmt != "parquet" and self.compression == "gzip":
+            return "application/gzip"
+        if self.fmt != "parquet" and self.compression == "zstd":
+            return "application/zstd"
+        return EXPORT_FORMATS[self.fmt][1]
+
+
+def export_chunks(request: ExportRequest, uri_connection: str):
+    """
+    Reads the rows of an export one day at a time.
+
+    Yields:
+    - pl.DataFrame: The rows of a day, with the EXPORT_COLUMNS, possibly empty.
+
+    Raises:
+    - RuntimeError: If a query failed, ending the export.
+    """
+    day = request.first_day
+    while day <= request.last_day:
+        rows = fetch_query("export_hotspots", uri_connection, day=day, provinces=",".join(request.provinces),
+                           districts=",".join(request.districts))
+        if rows is None:
+            raise RuntimeError(f"The hotspots of {day} could not be read")
+        yield rows.select(pl.col(column).cast(dtype) for column, dtype in EXPORT_COLUMNS.items())
+        day += datetime.timedelta(days=1)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Writers of each format: write(df) and close() return the bytes written since the last call
+class _Sink(io.RawIOBase):
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer += b
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class _CsvWriter:
+    def __init__(self):
+        self._header = True
+
+    def write(self, df: pl.DataFrame) -> bytes:
+        if df.is_empty() and not self._header:
+            return b""
+        buffer = io.BytesIO()
+        df.write_csv(buffer, has_header=self._header)
+        self._header = False
+        return buffer.getvalue()
+
+    def close(self) -> bytes:
+        # an export without any row still gets its header
+        return self.write(pl.DataFrame(schema=EXPORT_COLUMNS)) if self._header else b""
+
+
+class _ArrowWriter:
+    # an Arrow IPC stream, or a Parquet file if parquet_compression is given
+    def __init__(self, parquet_compression: str = None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._sink = _Sink()
+        schema = pl.DataFrame(schema=EXPORT_COLUMNS).to_arrow().schema
+        if parquet_compression is None:
+            self._writer = pa.ipc.new_stream(self._sink, schema)
+        else:
+            self._writer = pq.ParquetWriter(self._sink, schema, compression=parquet_compression)
+
+    def write(self, df: pl.DataFrame) -> bytes:
+        if not df.is_empty():
+            self._writer.write_table(df.to_arrow())
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def _compressor(compression: str):
+    if compression == "gzip":
+        # wbits 31: a gzip member, readable by gunzip
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def stream_export(request: ExportRequest, uri_connection: str):
+    """
+    Makes the file of an export, chunk by chunk.
+
+    Parameters:
+    - request (ExportRequest): The export.
+    - uri_connection (str): The connection URI to the Supabase database.
+
+    Yields:
+    - bytes: The file, in chunks of about CHUNK_BYTES.
+    """
+    if request.fmt == "csv":
+        writer = _CsvWriter()
+    elif request.fmt == "parquet":
+        writer = _ArrowWriter(parquet_compression=request.compression)
+    else:
+        writer = _ArrowWriter()
+    compressor = _compressor(request.compression) if request.fmt != "parquet" else None
+
+    pending = []
+
+    def gather(data: bytes, final: bool = False):
+        if compressor is not None:
+            data = compressor.compress(data) + (compressor.flush() if final else b"")
+        pending.append(data)
+        if final or sum(map(len, pending)) >= CHUNK_BYTES:
+            chunk = b"".join(pending)
+            pending.clear()
+            return chunk
+        return b""
+
+    for rows in export_chunks(request, uri_connection):
+        chunk = gather(writer.write(rows))
+        if chunk:
+            yield chunk
+
+    chunk = gather(writer.close(), final=True)
+    if chunk:
+        yield chunk
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class ExportSpool:
+    """
+    Disk copies of the exports, one directory per data version. Only the latest version is kept: an export of a new
+    version removes the files of the previous ones.
+
+    Parameters:
+    - directory (str): Where the exports are written. Defaults to EXPORT_DIR.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or EXPORT_DIR
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(str(version).encode()).hexdigest()[:16])
+
+    def path(self, request: ExportRequest, version: str) -> str:
+        return os.path.join(self._version_dir(version), f"{request.key}-{request.filename}")
+
+    def get(self, request: ExportRequest, version: str) -> str:
+        """
+        Returns:
+        - str: The path of the complete file of an export, or None if it was not made yet for this version.
+        """
+        path = self.path(request, version)
+        found = os.path.exists(path)
+        count_cache("exports", found)
+        return path if found else None
+
+    def _drop_other_versions(self, version: str):
+        with self._lock:
+            previous, self._version = self._version, version
+        if previous == version:
+            return
+        # also the versions left by other workers or by a previous run
+        current = self._version_dir(version)
+        for version_dir in glob.glob(os.path.join(self.directory, "*")):
+            if version_dir != current:
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    def stream(self, request: ExportRequest, version: str, uri_connection: str):
+        """
+        Streams an export while writing it to disk. The file is kept only if the export went through to the end,
+        the client still connected.
+
+        Yields:
+        - bytes: The chunks of stream_export.
+        """
+        self._drop_other_versions(version)
+        path = self.path(request, version)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            spool = open(tmp_path, "wb")
+        except OSError as e:
+            print(f"An error occurred while writing the export {request.filename}: {e}")
+            spool = None
+
+        complete = False
+        try:
+            for chunk in stream_export(request, uri_connection):
+                if spool is not None:
+                    try:
+                        spool.write(chunk)
+                    except OSError:
+                        spool.close()
+                        spool = None
+                yield chunk
+            complete = True
+
+        finally:
+            if spool is not None:
+                spool.close()
+                with contextlib.suppress(OSError):
+                    if complete:
+                        os.replace(tmp_path, path)
+                    else:
+                        os.remove(tmp_path)
@@ -0,0 +1,340 @@
+import json
+import threading
+import functools
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+from dash import Patch
+
+from src.metrics import count_cache
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Shared styling of the dashboard charts. The layouts below are built (and validated by plotly) only once per process,
+# every callback afterwards only fills in the trace data of a plain dict figure.
+BAR_COLOR = "indianred"
+AXIS_TITLE = "<b>Titik Api Terdeteksi</b>"
+TRANSPARENT_BG = {'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',}
+
+MAP_CENTER = dict(lat=-2.5, lon=118)
+MAP_ZOOM = 3.6
+MAP_COLORBAR = dict(len=0.3, title="Fire Radiative Power", thickness=10, orientation="h", y=0, x=0.15, title_side="top")
+CHOROPLETH_COLORBAR = dict(len=0.3, title="Titik Api", thickness=10, orientation="h", y=0, x=0.15, title_side="top")
+CHOROPLETH_HOVER = "<b>%{location}</b><br>" + AXIS_TITLE + "=%{z}<extra></extra>"
+MAP_HOVER = ("<b>%{hovertext}</b><br><br>Date=%{customdata[0]}<br>Confidence=%{customdata[1]}"
+             "<br>Fire Radiative Power=%{z}<br>District=%{customdata[2]}<br>Brightness=%{customdata[3]}<extra></extra>")
+
+
+def _to_dict(fig: go.Figure) -> dict:
+    # plain JSON types only, so the cached layout can be shared and serialized without plotly validation
+    return json.loads(fig.to_json())
+
+
+@functools.lru_cache(maxsize=None)
+def _base_layout(kind: str) -> dict:
+    """
+    Builds the layout of a dashboard chart once and keeps it for the lifetime of the process.
+
+    Parameters:
+    - kind (str): One of "bar", "area", "map" or "choropleth".
+
+    Returns:
+    - dict: The layout as a plain dict. It is shared between callers and must not be mutated.
+    """
+    fig = go.Figure(layout=dict(template="plotly_dark", autosize=True, margin={"r":0,"t":0,"l":0,"b":0}))
+    fig.update_layout(TRANSPARENT_BG)
+
+    if kind == "bar":
+        fig.update_layout(yaxis={'categoryorder':'total ascending'}, xaxis_title=AXIS_TITLE, yaxis_title="")
+        fig.update_xaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
+        fig.update_layout(xaxis_showgrid=False, yaxis_showgrid=False)
+
+    elif kind == "area":
+        fig.update_layout(xaxis_title="", yaxis_title=AXIS_TITLE)
+        fig.update_yaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
+        fig.update_layout(xaxis_showgrid=True, yaxis_showgrid=False)
+
+    elif kind == "map":
+        fig.update_layout(mapbox=dict(center=MAP_CENTER, zoom=MAP_ZOOM, style="carto-positron"),
+                          coloraxis=dict(colorscale="matter_r"))
+        fig.update_coloraxes(showscale=True, colorbar=MAP_COLORBAR)
+
+    elif kind == "choropleth":
+        fig.update_layout(mapbox=dict(center=MAP_CENTER, zoom=MAP_ZOOM, style="carto-positron"),
+                          coloraxis=dict(colorscale="matter_r"))
+        fig.update_coloraxes(showscale=True, colorbar=CHOROPLETH_COLORBAR)
+
+    else:
+        raise ValueError(f"Unknown figure kind: {kind}")
+
+    return _to_dict(fig)["layout"]
+
+
+@functools.lru_cache(maxsize=None)
+def _base_trace(kind: str) -> dict:
+    """
+    Builds the static attributes of the single trace of a dashboard chart once.
+
+    Parameters:
+    - kind (str): One of "bar", "area", "map" or "choropleth".
+
+    Returns:
+    - dict: The trace attributes without data. It is shared between callers and must not be mutated.
+    """
+    if kind == "bar":
+        trace = go.Bar(orientation="h", marker_color=BAR_COLOR, textposition="auto", showlegend=False, name="",
+                       hovertemplate=AXIS_TITLE + "=%{x}<br>%{y}<extra></extra>")
+    elif kind == "area":
+        trace = go.Scatter(mode="lines", stackgroup="1", line_color=BAR_COLOR, showlegend=False, name="",
+                           hovertemplate="%{x}<br>" + AXIS_TITLE + "=%{y}<extra></extra>")
+    elif kind == "map":
+        trace = go.Densitymapbox(radius=3, coloraxis="coloraxis", subplot="mapbox", name="", hovertemplate=MAP_HOVER)
+    elif kind == "choropleth":
+        trace = go.Choroplethmapbox(coloraxis="coloraxis", subplot="mapbox", name="", marker_opacity=0.8,
+                                    marker_line_width=0.5, marker_line_color="#343a40", hovertemplate=CHOROPLETH_HOVER)
+    else:
+        raise ValueError(f"Unknown figure kind: {kind}")
+
+    return trace.to_plotly_json()
+
+
+def base_figure(kind: str) -> dict:
+    """
+    Returns an empty chart carrying only the cached layout, used as the initial figure of a dcc.Graph so that
+    the callbacks can answer with a Dash Patch instead of a full figure.
+
+    Parameters:
+    - kind (str): One of "bar", "area", "map" or "choropleth".
+
+    Returns:
+    - dict: A figure dict with one empty trace.
+    """
+    return {"data": [dict(_base_trace(kind))], "layout": dict(_base_layout(kind))}
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def bar_figure(labels: list, values: list, patch: bool = False):
+    """
+    Fills the horizontal bar chart used by the top-5 provinces and districts cards.
+
+    Parameters:
+    - labels (list): Category labels, placed on the y axis.
+    - values (list): Number of detected fires for each label.
+    - patch (bool): If True, returns a Dash Patch that only replaces the trace data on the client.
+
+    Returns:
+    - dict | Patch: The full figure dict, or the partial update.
+    """
+    if patch:
+        fig = Patch()
+        fig["data"][0]["x"] = values
+        fig["data"][0]["y"] = labels
+        fig["data"][0]["text"] = values
+        return fig
+
+    trace = dict(_base_trace("bar"), x=values, y=labels, text=values)
+    return {"data": [trace], "layout": dict(_base_layout("bar"))}
+
+
+def area_figure(dates: list, counts: list, patch: bool = False):
+    """
+    Fills the area chart of the national daily number of detected fires.
+
+    Parameters:
+    - dates (list): ISO formatted dates, placed on the x axis.
+    - counts (list): Number of detected fires for each date.
+    - patch (bool): If True, returns a Dash Patch that only replaces the trace data on the client.
+
+    Returns:
+    - dict | Patch: The full figure dict, or the partial update.
+    """
+    if patch:
+        fig = Patch()
+        fig["data"][0]["x"] = dates
+        fig["data"][0]["y"] = counts
+        return fig
+
+    trace = dict(_base_trace("area"), x=dates, y=counts)
+    return {"data": [trace], "layout": dict(_base_layout("area"))}
+
+
+def density_trace(day_df) -> dict:
+    """
+    Builds one density mapbox trace out of the hotspots of a single day.
+
+    Parameters:
+    - day_df (pd.DataFrame): Hotspots with the renamed dashboard columns (Date, Confidence, District, ...).
+
+    Returns:
+    - dict: The trace dict, holding plain lists only.
+    """
+    customdata = day_df[["Date", "Confidence", "District", "Brightness"]].values.tolist()
+
+    return dict(_base_trace("map"),
+                lat=day_df["latitude"].tolist(),
+                lon=day_df["longitude"].tolist(),
+                z=day_df["Fire Radiative Power"].tolist(),
+                hovertext=day_df["Province"].tolist(),
+                customdata=customdata)
+
+
+def density_map_figure(trace: dict = None) -> dict:
+    """
+    Assembles the density map out of the trace of a single day. The other days are not shipped with the figure,
+    they are requested one by one through the date slider (see DayFrameCache).
+
+    Parameters:
+    - trace (dict): The trace of the day to show, as built by density_trace. Defaults to an empty trace.
+
+    Returns:
+    - dict: The figure dict.
+    """
+    return {"data": [trace if trace is not None else dict(_base_trace("map"))], "layout": dict(_base_layout("map"))}
+
+
+def with_tile_layers(fig: dict, tiles_url: str) -> dict:
+    """
+    Draws the province and district outlines of the vector tile endpoint (src/tiles.py) under the density map.
+    The browser only downloads the tiles of the viewport.
+
+    Parameters:
+    - fig (dict): A density map figure, as built by density_map_figure. It is not modified.
+    - tiles_url (str): Absolute URL template of the tiles, e.g. "https://host/tiles/{z}/{x}/{y}.pbf".
+
+    Returns:
+    - dict: The figure with the tile layers.
+    """
+    layers = [
+        dict(sourcetype="vector", source=[tiles_url], sourcelayer="districts", type="line", below="traces",
+             color="#6c757d", opacity=0.5, line=dict(width=0.4)),
+        dict(sourcetype="vector", source=[tiles_url], sourcelayer="provinces", type="line", below="traces",
+             color="#adb5bd", opacity=0.7, line=dict(width=0.8)),
+    ]
+    layout = dict(fig["layout"], mapbox=dict(fig["layout"]["mapbox"], layers=layers))
+
+    return dict(fig, layout=layout)
+
+
+def relayout_bounds(relayout_data: dict) -> tuple:
+    """
+    Reads the visible area of the density map out of the relayoutData of its dcc.Graph.
+
+    Parameters:
+    - relayout_data (dict): The relayoutData property, set by plotly after a zoom or a pan.
+
+    Returns:
+    - tuple: The viewport (west, south, east, north) in degrees, or None if the event did not move the map.
+    """
+    corners = ((relayout_data or {}).get("mapbox._derived") or {}).get("coordinates")
+    if not corners:
+        return None
+
+    longitudes = [corner[0] for corner in corners]
+    latitudes = [corner[1] for corner in corners]
+
+    return min(longitudes), min(latitudes), max(longitudes), max(latitudes)
+
+
+def density_frame_patch(trace: dict = None) -> Patch:
+    """
+    Swaps the day shown on the density map on the client, keeping its layout, zoom and center.
+
+    Parameters:
+    - trace (dict): The trace of the requested day, as built by density_trace. Defaults to an empty trace.
+
+    Returns:
+    - Patch: The partial update of the figure.
+    """
+    fig = Patch()
+    fig["data"][0] = trace if trace is not None else dict(_base_trace("map"))
+    return fig
+
+def choropleth_figure(geojson_url: str, feature_id: str, locations: list, counts: list) -> dict:
+    """
+    Fills the choropleth of the number of detected fires per province or district.
+
+    Parameters:
+    - geojson_url (str): URL of the boundaries (see src/boundaries.py), fetched by the browser rather than shipped
+                         with the figure.
+    - feature_id (str): The property of the boundaries matched with the locations, e.g. "provinsi".
+    - locations (list): The province or district names.
+    - counts (list): Number of detected fires for each location.
+
+    Returns:
+    - dict: The figure dict.
+    """
+    trace = dict(_base_trace("choropleth"), geojson=geojson_url, featureidkey=f"properties.{feature_id}",
+                 locations=locations, z=counts)
+    return {"data": [trace], "layout": dict(_base_layout("choropleth"))}
+
+
+def choropleth_level_patch(geojson_url: str) -> Patch:
+    """
+    Swaps the boundaries of the choropleth for another level of detail, keeping its counts, zoom and center.
+
+    Parameters:
+    - geojson_url (str): URL of the boundaries of the new level.
+
+    Returns:
+    - Patch: The partial update of the figure.
+    """
+    fig = Patch()
+    fig["data"][0]["geojson"] = geojson_url
+    return fig
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class DayFrameCache:
+    """
+    Keeps the hotspots of the last fetched window of each timeframe split per day, and builds the trace of a day
+    only the first time it is requested from the date slider.
+
+    Parameters:
+    - max_windows (int): Number of timeframes kept at once, the oldest one is dropped first.
+    """
+
+    def __init__(self, max_windows: int = 8):
+        self.max_windows = max_windows
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+
+    def store(self, key, df_viirs) -> list:
+        """
+        Splits the hotspots of a window per day, replacing what was stored under the same key.
+
+        Parameters:
+        - key: Identifier of the window, e.g. the number of days of the timeframe.
+        - df_viirs (pd.DataFrame): Hotspots with the renamed dashboard columns.
+
+        Returns:
+        - list: The sorted dates of the window.
+        """
+        days = {date: [day_df, None] for date, day_df in df_viirs.groupby("Date", sort=True)}
+
+        with self._lock:
+            self._days[key] = days
+            self._days.move_to_end(key)
+            while len(self._days) > self.max_windows:
+                self._days.popitem(last=False)
+
+        return list(days)
+
+    def get(self, key, date: str):
+        """
+        Returns the trace of one day of a stored window, building and keeping it on first access.
+
+        Parameters:
+        - key: Identifier of the window given to store.
+        - date (str): The requested day, formatted as "YYYY-MM-DD".
+
+        Returns:
+        - dict: The trace dict, or None if the window or the day is not cached in this process.
+        """
+        with self._lock:
+            entry = self._days.get(key, {}).get(date)
+
+        count_cache("day_frames", entry is not None)
+        if entry is None:
+            return None
+
+        if entry[1] is None:
+            entry[1] = density_trace(entry[0])
+
+        return entry[1]
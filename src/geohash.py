@@ -0,0 +1,106 @@
+import numpy as np
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Geohashes of the detections (the geohash column of processed_viirs), and the geohash ranges covering a bounding box,
+# so that the hotspots of a map viewport are read with a few index range scans.
+#
+# A geohash interleaves the bits of the longitude and latitude cells, longitude first, five bits per character. At a
+# given length the geohashes sort like the integers they encode, and every longer geohash sorts right after its
+# prefix: the cells of consecutive codes form one range of the column (compared bytewise, hence COLLATE "C").
+#
+# migrations/002_geohash_processed_viirs.sql computes the same geohashes in SQL (viirs_geohash), with the same
+# floating point operations.
+ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Length of the stored geohashes: cells of about 38 x 19 m, finer than the 375 m VIIRS pixels
+GEOHASH_PRECISION = 8
+
+# Most cells a bounding box is covered with; the finest length staying under it is used
+MAX_COVER_CELLS = 64
+
+_ALPHABET_BYTES = np.frombuffer(ALPHABET.encode("ascii"), dtype=np.uint8)
+
+
+def _bits(precision: int) -> tuple:
+    return (5 * precision + 1) // 2, 5 * precision // 2
+
+
+def _cell(value, low: float, span: float, bits: int) -> np.ndarray:
+    value = np.asarray(value, dtype=np.float64)
+    return np.clip(np.floor((value - low) / span * 2.0 ** bits), 0, 2 ** bits - 1).astype(np.int64)
+
+
+def _interleave(lon_cell: np.ndarray, lat_cell: np.ndarray, precision: int) -> np.ndarray:
+    lon_bits, lat_bits = _bits(precision)
+    code = np.zeros(np.broadcast(lon_cell, lat_cell).shape, dtype=np.int64)
+
+    for i in range(1, 5 * precision + 1):
+        if i % 2:
+            bit = (lon_cell >> (lon_bits - (i + 1) // 2)) & 1
+        else:
+            bit = (lat_cell >> (lat_bits - i // 2)) & 1
+        code = code * 2 + bit
+
+    return code
+
+
+def _to_strings(code: np.ndarray, precision: int) -> np.ndarray:
+    shifts = 5 * np.arange(precision - 1, -1, -1, dtype=np.int64)
+    chars = _ALPHABET_BYTES[(code.reshape(-1, 1) >> shifts) & 31]
+    return np.ascontiguousarray(chars).view(f"S{precision}").ravel().astype(str)
+
+
+def encode(latitude, longitude, precision: int = GEOHASH_PRECISION) -> np.ndarray:
+    """
+    Computes the geohashes of points.
+
+    Parameters:
+    - latitude (np.ndarray | list): Latitudes, in degrees.
+    - longitude (np.ndarray | list): Longitudes, in degrees.
+    - precision (int): Length of the geohashes, at most 12.
+
+    Returns:
+    - np.ndarray: The geohashes, as strings.
+    """
+    lon_bits, lat_bits = _bits(precision)
+    code = _interleave(_cell(longitude, -180.0, 360.0, lon_bits), _cell(latitude, -90.0, 180.0, lat_bits), precision)
+
+    return _to_strings(np.atleast_1d(code), precision)
+
+
+def prefix_ranges(west: float, south: float, east: float, north: float, max_cells: int = MAX_COVER_CELLS) -> list:
+    """
+    Covers a bounding box with geohash cells, and returns the ranges of the geohash column holding them.
+    The cells overshoot the box, the hotspots still have to be filtered on their coordinates.
+
+    Parameters:
+    - west, south, east, north (float): The bounding box, in degrees.
+    - max_cells (int): Most cells used; the finest geohash length staying under it is chosen.
+
+    Returns:
+    - list: (low, high) tuples, the rows of a range being low <= geohash < high. high is None for a range running
+            to the end of the column.
+    """
+    west, east = max(min(west, east), -180.0), min(max(west, east), 180.0)
+    south, north = max(min(south, north), -90.0), min(max(south, north), 90.0)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lon_bits, lat_bits = _bits(precision)
+        x0, x1 = _cell([west, east], -180.0, 360.0, lon_bits)
+        y0, y1 = _cell([south, north], -90.0, 180.0, lat_bits)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_cells or precision == 1:
+            break
+
+    columns, rows = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+    codes = np.sort(_interleave(columns.ravel(), rows.ravel(), precision))
+
+    # consecutive codes are merged into one range
+    starts = np.flatnonzero(np.diff(codes, prepend=-2) != 1)
+    ends = np.append(starts[1:], len(codes)) - 1
+    lows = _to_strings(codes[starts], precision)
+
+    last = 2 ** (5 * precision) - 1
+    highs = [None if code == last else high for code, high in
+             zip(codes[ends], _to_strings(np.minimum(codes[ends] + 1, last), precision))]
+
+    return list(zip(lows.tolist(), highs))
@@ -0,0 +1,160 @@
+import functools
+
+import polars as pl
+import geopandas as gpd
+
+from src.metrics import instrumented
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Places named in the news: every article is scanned once for the names of the provinces and districts of the boundary
+# file the detections are tagged with (first_adm, second_adm), with an Aho-Corasick automaton holding all of them.
+#
+# A regency "Bogor" is matched as "Kabupaten Bogor", "Kab. Bogor", "Kab Bogor" or "Bogor", a city "Kota Bogor" as
+# "Kota Bogor" or "Bogor"; a bare name shared by a regency and a city tags both. The longest name wins where several
+# overlap ("Kota Bogor" rather than "Bogor", "Kepulauan Riau" rather than "Riau"), and a name only counts between word
+# boundaries.
+DISTRICTS_PATH = "./data/IndonesianCitiesDistrictsUpdated.json"
+
+# Bare district names that are also common Indonesian words ("baru" is "new", "hutan" is "forest"), only matched with
+# their prefix
+COMMON_WORDS = {"baru", "batu", "buru", "pati", "malang", "banjar", "hutan", "puncak", "batang", "landak", "metro"}
+
+REGENCY_PREFIXES = ("kabupaten ", "kab. ", "kab ")
+CITY_PREFIX = "kota "
+
+# Other spellings and the abbreviations used by the press, per province of the boundary file
+PROVINCE_VARIANTS = {
+    "Dki Jakarta": ["jakarta", "dki"],
+    "Daerah Istimewa Yogyakarta": ["yogyakarta", "diy", "jogja", "yogya"],
+    "Kepulauan Bangka Belitung": ["bangka belitung", "babel"],
+    "Kepulauan Riau": ["kepri"],
+    "Nusa Tenggara Barat": ["ntb"],
+    "Nusa Tenggara Timur": ["ntt"],
+    "Sumatera Utara": ["sumatra utara", "sumut"],
+    "Sumatera Barat": ["sumatra barat", "sumbar"],
+    "Sumatera Selatan": ["sumatra selatan", "sumsel"],
+    "Kalimantan Barat": ["kalbar"],
+    "Kalimantan Tengah": ["kalteng"],
+    "Kalimantan Selatan": ["kalsel"],
+    "Kalimantan Timur": ["kaltim"],
+    "Kalimantan Utara": ["kaltara"],
+    "Sulawesi Utara": ["sulut"],
+    "Sulawesi Tengah": ["sulteng"],
+    "Sulawesi Selatan": ["sulsel"],
+    "Sulawesi Tenggara": ["sultra"],
+    "Sulawesi Barat": ["sulbar"],
+    "Jawa Barat": ["jabar"],
+    "Jawa Tengah": ["jateng"],
+    "Jawa Timur": ["jatim"],
+}
+
+
+def name_variants(districts: gpd.GeoDataFrame) -> dict:
+    """
+    Lists the ways each province and district may be written.
+
+    Parameters:
+    - districts (gpd.GeoDataFrame): The district boundaries, with the district in "id" and its province in "provinsi".
+
+    Returns:
+    - dict: {lowercase name: set of (province, district) pairs}, district None for a province.
+    """
+    variants = {}
+
+    def add(name: str, place: tuple):
+        variants.setdefault(name.lower(), set()).add(place)
+
+    for district, province in districts[["id", "provinsi"]].itertuples(index=False):
+        place = (province, district)
+        if district.lower().startswith(CITY_PREFIX):
+            add(district, place)
+            bare = district[len(CITY_PREFIX):]
+        else:
+            for prefix in REGENCY_PREFIXES:
+                add(prefix + district, place)
+            bare = district
+        if bare.lower() not in COMMON_WORDS:
+            add(bare, place)
+
+    for province in districts["provinsi"].unique():
+        add(province, (province, None))
+        for variant in PROVINCE_VARIANTS.get(province, []):
+            add(variant, (province, None))
+
+    return variants
+
+
+@functools.lru_cache(maxsize=None)
+def gazetteer(path: str = DISTRICTS_PATH):
+    """
+    Builds the Aho-Corasick automaton of the province and district names, once per process.
+
+    Returns:
+    - ahocorasick.Automaton: The automaton, each name mapping to (length, places), or None if pyahocorasick is not
+                             installed.
+    """
+    try:
+        import ahocorasick
+    except ImportError:
+        print("pyahocorasick is not installed, the articles are not geotagged")
+        return None
+
+    automaton = ahocorasick.Automaton()
+    for name, places in name_variants(gpd.read_file(path)).items():
+        automaton.add_word(name, (len(name), tuple(sorted(places, key=str))))
+    automaton.make_automaton()
+
+    return automaton
+
+
+def find_places(text: str, automaton) -> tuple:
+    """
+    Finds the provinces and districts named in a text.
+
+    Parameters:
+    - text (str): The text.
+    - automaton (ahocorasick.Automaton): As built by gazetteer.
+
+    Returns:
+    - tuple: The sorted lists of provinces (first_adm) and districts (second_adm) named, with the provinces of the
+             districts named.
+    """
+    text = text.lower()
+    provinces, districts = set(), set()
+
+    for end, (length, places) in automaton.iter_long(text):
+        start = end - length + 1
+        if (start > 0 and text[start - 1].isalnum()) or (end + 1 < len(text) and text[end + 1].isalnum()):
+            continue
+        for province, district in places:
+            provinces.add(province)
+            if district is not None:
+                districts.add(district)
+
+    return sorted(provinces), sorted(districts)
+
+
+@instrumented("transform")
+def geotag_articles(df: pl.DataFrame, path: str = DISTRICTS_PATH) -> pl.DataFrame:
+    """
+    Tags the articles with the provinces and districts named in their title or text.
+
+    Parameters:
+    - df (pl.DataFrame): The articles, as returned by cleaning_articles.
+    - path (str): The districts GeoJSON the names are read from.
+
+    Returns:
+    - pl.DataFrame: The articles with first_adm and second_adm list columns, null when the gazetteer is unavailable.
+    """
+    automaton = gazetteer(path)
+    if automaton is None:
+        return df.with_columns(pl.lit(None, dtype=pl.List(pl.Utf8)).alias("first_adm"),
+                               pl.lit(None, dtype=pl.List(pl.Utf8)).alias("second_adm"))
+
+    places = [find_places(f"{title}\n{text}", automaton)
+              for title, text in zip(df["title"].fill_null("").to_list(), df["article_text"].fill_null("").to_list())]
+
+    return df.with_columns(
+        pl.Series("first_adm", [provinces for provinces, _ in places], dtype=pl.List(pl.Utf8)),
+        pl.Series("second_adm", [districts for _, districts in places], dtype=pl.List(pl.Utf8)),
+    )
@@ -0,0 +1,214 @@
+import glob
+import argparse
+import datetime
+
+import polars as pl
+
+from src.queries import fetch_query
+from src.cache import forget_data_version
+from src.metrics import instrumented, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# GSOD (Global Surface Summary of the Day) daily station readings, as exported from NOAA in the layout of
+# data/GSOD-Jan_to_Sept.csv. Every column comes quoted and the measurements are left-padded strings ("  88.5").
+GSOD_COLUMNS = ["STATION", "NAME", "LATITUDE", "LONGITUDE", "DATE", "MAX", "TEMP", "VISIB", "WDSP", "PRCP"]
+
+# Values used by GSOD for a missing measurement, per column
+MISSING_VALUES = {"MAX": 9999.9, "TEMP": 9999.9, "VISIB": 999.9, "WDSP": 999.9, "PRCP": 99.99}
+
+# Indonesian stations are the ones whose name ends with the country code
+COUNTRY_SUFFIX = ", ID"
+
+
+def _measurement(column: str, alias: str) -> pl.Expr:
+    value = pl.col(column).str.strip_chars().cast(pl.Float64, strict=False)
+    return pl.when(value == MISSING_VALUES[column]).then(None).otherwise(value).alias(alias)
+
+
+def _fahrenheit_to_celsius(expr: pl.Expr) -> pl.Expr:
+    return ((expr - 32) * 5 / 9).round(2)
+
+
+def scan_gsod(paths) -> pl.LazyFrame:
+    """
+    Lazily reads GSOD daily station files and returns the cleaned readings of the Indonesian stations.
+
+    Parameters:
+    - paths (str | list): A path, a glob pattern (e.g. "data/gsod/*.csv") or a list of them.
+
+    Returns:
+    - pl.LazyFrame: One row per station and day, with the columns station_id, station_name, latitude, longitude, date,
+                    max_temp_f, temperature_f, visibility, wind_speed, precipitation and max_temp_c.
+                    Missing measurements are null.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    files = sorted(file for path in paths for file in glob.glob(path))
+    if not files:
+        raise FileNotFoundError(f"No GSOD file matches {paths}")
+
+    # read everything as strings, the numbers are padded and parsed below
+    frames = [pl.scan_csv(file, infer_schema_length=0).select(GSOD_COLUMNS) for file in files]
+    raw = pl.concat(frames, how="vertical")
+
+    return (
+        raw
+        .filter(pl.col("NAME").str.contains(COUNTRY_SUFFIX, literal=True))
+        .select(
+            pl.col("STATION").alias("station_id"),
+            pl.col("NAME").alias("station_name"),
+            pl.col("LATITUDE").str.strip_chars().cast(pl.Float64, strict=False).alias("latitude"),
+            pl.col("LONGITUDE").str.strip_chars().cast(pl.Float64, strict=False).alias("longitude"),
+            pl.col("DATE").str.strptime(pl.Date, "%Y-%m-%d").alias("date"),
+            _measurement("MAX", "max_temp_f"),
+            _measurement("TEMP", "temperature_f"),
+            _measurement("VISIB", "visibility"),
+            _measurement("WDSP", "wind_speed"),
+            _measurement("PRCP", "precipitation"),
+        )
+        .with_columns(
+            _fahrenheit_to_celsius(pl.col("max_temp_f")).alias("max_temp_c"),
+        )
+    )
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def station_daily(readings: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Aggregates the readings to one row per station and day. Overlapping exports of the same station and day
+    (e.g. a re-downloaded month) are averaged instead of counted twice.
+
+    Parameters:
+    - readings (pl.LazyFrame): Readings as returned by scan_gsod.
+
+    Returns:
+    - pl.LazyFrame: Daily readings per station, sorted by date and station.
+    """
+    return (
+        readings
+        .group_by(["station_id", "date"])
+        .agg(
+            pl.col("station_name").first(),
+            pl.col("latitude").first(),
+            pl.col("longitude").first(),
+            pl.col("max_temp_c").mean().round(2),
+            pl.col("temperature_f").mean().pipe(_fahrenheit_to_celsius).alias("temperature_c"),
+            pl.col("precipitation").mean(),
+            pl.col("visibility").mean(),
+            pl.col("wind_speed").mean(),
+        )
+        .sort(["date", "station_id"])
+    )
+
+
+def national_daily(readings: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Computes the national daily statistics stored in idn_gsod, across all the Indonesian stations.
+
+    Parameters:
+    - readings (pl.LazyFrame): Readings as returned by scan_gsod.
+
+    Returns:
+    - pl.LazyFrame: One row per day with the columns date, temperature_c_median, temperature_c_mean, max_temp_c,
+                    precipitation_mean, visibility_mean and wind_speed_mean, sorted by date.
+    """
+    return (
+        readings
+        .group_by("date")
+        .agg(
+            pl.col("max_temp_c").median().alias("temperature_c_median"),
+            pl.col("max_temp_c").mean().alias("temperature_c_mean"),
+            pl.col("max_temp_c").max().alias("max_temp_c"),
+            pl.col("precipitation").mean().alias("precipitation_mean"),
+            pl.col("visibility").mean().alias("visibility_mean"),
+            pl.col("wind_speed").mean().alias("wind_speed_mean"),
+        )
+        .sort("date")
+    )
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def fetch_last_gsod_date(uri_connection: str):
+    """
+    Retrieves the most recent date already loaded in idn_gsod.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Supabase database.
+
+    Returns:
+    - datetime.date: The last loaded date, or None if the table is empty.
+
+    Raises:
+    - RuntimeError: If the table could not be read, which must not be taken for an empty table.
+    """
+    last_date = fetch_query("idn_gsod_last_date", uri_connection)
+
+    if last_date is None:
+        raise RuntimeError("The last date of idn_gsod could not be read")
+    if last_date.is_empty():
+        return None
+
+    return last_date["last_date"][0]
+
+
+@instrumented("load")
+def load_gsod(paths, uri_connection: str, since: datetime.date = None) -> dict:
+    """
+    Appends the GSOD days that are not loaded yet to the database: the national statistics to idn_gsod and
+    the per-station readings to idn_gsod_stations.
+
+    Parameters:
+    - paths (str | list): GSOD files, as accepted by scan_gsod.
+    - uri_connection (str): The connection URI to the Supabase database.
+    - since (datetime.date): Only days after this date are appended. Defaults to the last date found in idn_gsod,
+                             all the days if it is empty.
+
+    Returns:
+    - dict: The number of rows appended to each table. Nothing is appended if the last date could not be read.
+    """
+    if since is None:
+        try:
+            since = fetch_last_gsod_date(uri_connection)
+        except RuntimeError as e:
+            # appending every day again would duplicate the rows already loaded
+            print(f"{e}, no GSOD data is loaded")
+            return {"idn_gsod": 0, "idn_gsod_stations": 0}
+
+    readings = scan_gsod(paths)
+    if since is not None:
+        readings = readings.filter(pl.col("date") > since)
+
+    # both aggregates share the parsed readings, so the files are read only once
+    readings = readings.collect().lazy()
+    national = national_daily(readings).collect()
+    stations = station_daily(readings).collect()
+
+    try:
+        if not national.is_empty():
+            national.write_database(table_name="idn_gsod", connection=uri_connection, if_exists="append")
+        if not stations.is_empty():
+            stations.write_database(table_name="idn_gsod_stations", connection=uri_connection, if_exists="append")
+
+    except Exception as e:
+        print(f"An error occurred while loading GSOD data: {e}")
+        return {"idn_gsod": 0, "idn_gsod_stations": 0}
+
+    # the calendar heatmap is rendered again on its next request
+    forget_data_version("idn_gsod")
+
+    return {"idn_gsod": national.height, "idn_gsod_stations": stations.height}
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Appends new GSOD days to idn_gsod and idn_gsod_stations.")
+    parser.add_argument("paths", nargs="+", help="GSOD csv files or glob patterns")
+    parser.add_argument("--since", type=datetime.date.fromisoformat,
+                        help="only days after this date are appended, defaults to the last date of idn_gsod (needed "
+                             "for the first load, before the table exists)")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    print(load_gsod(args.paths, uri_connection=config.get("CONNECTION_URI"), since=args.since))
+    write_summary(args.metrics_json)
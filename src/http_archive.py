@@ -0,0 +1,269 @@
+import io
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import threading
+import http.client
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Record/replay of the HTTP traffic of the ETL (FIRMS, SIPONGI, Google News and the news publishers), to profile and
+# regression-test the extract stage without the network.
+#
+# Every request made with requests goes through HTTPAdapter.send, including the ones of newspaper. The Google News
+# feeds are fetched by feedparser with urllib, so feedparser.parse is routed through requests while the archive is
+# active. fetch_viirs_data downloads the FIRMS csv with requests for the same reason.
+#
+# An archive is a gzipped JSON lines file, one exchange per line: method, url, status, headers, body (base64) and the
+# elapsed time of the original response.
+REDACTED = "REDACTED"
+
+# The date range of the Google News queries, which follows the day the ETL runs
+GNEWS_DATES = r"%20(before|after)%3A\d{4}-\d{2}-\d{2}"
+
+
+class ArchiveMiss(requests.ConnectionError):
+    """
+    Raised in replay mode for a request that is not in the archive, like a connection error would be.
+    """
+
+
+def _encode(exchange: dict) -> str:
+    return json.dumps(dict(exchange, body=base64.b64encode(exchange["body"]).decode("ascii")))
+
+
+def _decode(line: str) -> dict:
+    exchange = json.loads(line)
+    exchange["body"] = base64.b64decode(exchange["body"])
+    return exchange
+
+
+def load_archive(path: str) -> list:
+    """
+    Reads the exchanges of an archive.
+
+    Parameters:
+    - path (str): The archive file, e.g. "./.http-archive/etl.jsonl.gz".
+
+    Returns:
+    - list: The exchanges as dicts, in the order they were recorded.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [_decode(line) for line in f if line.strip()]
+
+
+def save_archive(path: str, exchanges: list):
+    """
+    Writes exchanges to an archive, replacing it.
+
+    Parameters:
+    - path (str): The archive file.
+    - exchanges (list): The exchanges as dicts, as returned by load_archive.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for exchange in exchanges:
+            f.write(_encode(exchange) + "\n")
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class HttpArchive:
+    """
+    Context manager recording the HTTP responses received inside it to an archive, or serving them back from it.
+
+        with HttpArchive("./.http-archive/etl.jsonl.gz", mode="record", secrets=[token]):
+            viirs = fetch_viirs_data(today, "1", token)
+
+        with HttpArchive("./.http-archive/etl.jsonl.gz", mode="replay", latency="recorded"):
+            viirs = fetch_viirs_data(today, "1", token)   # no network
+
+    Requests are matched on their method and URL. A URL requested several times is answered with its recordings
+    in turn, the last one being repeated. The requests missing from the archive are kept in misses, and unused()
+    lists the recordings never served, so that a replay can be checked against its recording.
+
+    Parameters:
+    - path (str): The archive file.
+    - mode (str): "record" or "replay".
+    - latency (float | str): In replay mode, seconds waited before each response, or "recorded" to wait as long as
+                             the original response took.
+    - secrets (list): Strings (e.g. the FIRMS token) replaced by REDACTED in the archived URLs, and when matching.
+    - ignore (list): Regular expressions removed from the URLs before archiving and matching, for the parts that
+                     change from one run to the other (e.g. the dates of the Google News queries, see GNEWS_DATES).
+    - responder (callable): In record mode, called as responder(method, url) to answer instead of the network; it
+                            returns (status, headers, body) or None to let the request through. Used to build
+                            archives out of synthetic data.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency=0.0, secrets: list = (), ignore: list = (),
+                 responder=None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown archive mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.secrets = [secret for secret in secrets if secret]
+        self.ignore = [re.compile(pattern) for pattern in ignore]
+        self.responder = responder
+
+        self.exchanges = []
+        self.misses = []
+        self._replayed = {}
+        self._lock = threading.Lock()
+        self._patched = None
+
+    def _redact(self, url: str) -> str:
+        for secret in self.secrets:
+            url = url.replace(secret, REDACTED)
+        for pattern in self.ignore:
+            url = pattern.sub("", url)
+        return url
+
+    def __enter__(self):
+        if self.mode == "replay":
+            index = {}
+            for exchange in load_archive(self.path):
+                index.setdefault((exchange["method"], exchange["url"]), []).append(exchange)
+            self._index = index
+
+        import feedparser
+
+        self._patched = (HTTPAdapter.send, feedparser.parse)
+        archive, original_send, original_parse = self, HTTPAdapter.send, feedparser.parse
+
+        def send(adapter, request, *args, **kwargs):
+            return archive._send(original_send, adapter, request, *args, **kwargs)
+
+        def parse(url_file_stream_or_string, *args, **kwargs):
+            return archive._parse_feed(original_parse, url_file_stream_or_string, *args, **kwargs)
+
+        HTTPAdapter.send = send
+        feedparser.parse = parse
+
+        return self
+
+    def __exit__(self, *exc_info):
+        import feedparser
+
+        HTTPAdapter.send, feedparser.parse = self._patched
+        self._patched = None
+
+        if self.mode == "record":
+            save_archive(self.path, self.exchanges)
+
+        return False
+
+    # ----------------------------------------------------- ******************************** -----------------------------------------------------
+    def _send(self, original_send, adapter, request, *args, **kwargs) -> requests.Response:
+        url = self._redact(request.url)
+
+        if self.mode == "replay":
+            return self._replay(request, url)
+
+        start = time.perf_counter()
+        answer = self.responder(request.method, request.url) if self.responder is not None else None
+
+        if answer is None:
+            response = original_send(adapter, request, *args, **kwargs)
+            # the body is kept decoded, its original encoding and length no longer apply
+            status, body = response.status_code, response.content
+            headers = {name: value for name, value in response.headers.items()
+                       if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        else:
+            status, headers, body = answer
+            response = self._response(request, status, headers, body)
+
+        exchange = {"method": request.method, "url": url, "status": status, "headers": headers, "body": body,
+                    "elapsed": time.perf_counter() - start}
+        with self._lock:
+            self.exchanges.append(exchange)
+
+        return response
+
+    def _replay(self, request, url: str) -> requests.Response:
+        key = (request.method, url)
+
+        with self._lock:
+            recordings = self._index.get(key)
+            if not recordings:
+                self.misses.append(key)
+                raise ArchiveMiss(f"{request.method} {url} is not in the archive {self.path}", request=request)
+            served = self._replayed.get(key, 0)
+            self._replayed[key] = served + 1
+
+        exchange = recordings[min(served, len(recordings) - 1)]
+
+        delay = exchange["elapsed"] if self.latency == "recorded" else float(self.latency)
+        if delay > 0:
+            time.sleep(delay)
+
+        return self._response(request, exchange["status"], exchange["headers"], exchange["body"])
+
+    def unused(self) -> list:
+        """
+        Lists the recordings a replay did not serve.
+
+        Returns:
+        - list: (method, url, recordings not served) of every URL requested fewer times than it was recorded.
+        """
+        with self._lock:
+            return [(method, url, len(recordings) - self._replayed.get((method, url), 0))
+                    for (method, url), recordings in self._index.items()
+                    if self._replayed.get((method, url), 0) < len(recordings)]
+
+    @staticmethod
+    def _response(request, status: int, headers: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = http.client.responses.get(status, "")
+
+        return response
+
+    def _parse_feed(self, original_parse, url_file_stream_or_string, *args, **kwargs):
+        if not (isinstance(url_file_stream_or_string, str) and url_file_stream_or_string.startswith(("http://", "https://"))):
+            return original_parse(url_file_stream_or_string, *args, **kwargs)
+
+        # fetched with requests (hence archived), then parsed from the bytes
+        agent = kwargs.pop("agent", None)
+        kwargs.pop("handlers", None)
+        response = requests.get(url_file_stream_or_string, headers={"User-Agent": agent} if agent else None)
+
+        feed = original_parse(response.content, *args, response_headers=dict(response.headers), **kwargs)
+        feed["status"] = response.status_code
+        feed["href"] = response.url
+
+        return feed
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def archive_summary(path: str) -> dict:
+    """
+    Describes an archive: the number of exchanges, bytes and recorded seconds per host.
+
+    Parameters:
+    - path (str): The archive file.
+
+    Returns:
+    - dict: {host: {"requests": int, "bytes": int, "seconds": float}}
+    """
+    summary = {}
+
+    for exchange in load_archive(path):
+        host = requests.utils.urlparse(exchange["url"]).netloc
+        stats = summary.setdefault(host, {"requests": 0, "bytes": 0, "seconds": 0.0})
+        stats["requests"] += 1
+        stats["bytes"] += len(exchange["body"])
+        stats["seconds"] = round(stats["seconds"] + exchange["elapsed"], 3)
+
+    return summary
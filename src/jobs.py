@@ -0,0 +1,126 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dash import DiskcacheManager
+
+from src.cache import CACHE_DIR
+from src.metrics import count_cache
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Background callbacks of the dashboard: the long callbacks (the density map of a timeframe) run as jobs instead of in
+# the request thread of a gunicorn worker, and the browser polls for their result. The job states and results go
+# through a diskcache directory, shared by the workers of the host.
+#
+# Identical requests share one job: the cache key of a call is its inputs plus the data version (cache_by), so when
+# 50 users pick "30 Hari Terakhir" at once, the first one starts the job and the others wait on it. Its result is
+# then kept until the data changes, or JOB_RESULT_TTL seconds after it was last read.
+#
+# The jobs run in a thread pool of the worker, not in the forked processes of Dash's DiskcacheManager: a process
+# forked from a worker that already used polars deadlocks in its thread pool.
+JOBS_DIR = os.path.join(CACHE_DIR, "jobs")
+
+JOB_RESULT_TTL = 3600
+
+# Longest a job is expected to run; after that, its requests stop waiting on it
+JOB_TIMEOUT = 300
+
+# Jobs running at once in a worker, the others are queued
+JOB_THREADS = 4
+
+# How long a finished job is still reported as running, so that a request polling right when it ends reads its result
+JOB_DONE_GRACE = 10
+
+# diskcache size limit, the least recently read results are evicted first
+JOBS_SIZE_LIMIT = 2 ** 30
+
+
+def _job_key(key: str) -> str:
+    return f"{key}-job"
+
+
+def _state_key(job: str) -> str:
+    return f"job-{job}-state"
+
+
+class CoalescingJobManager(DiskcacheManager):
+    """
+    Dash background callback manager starting at most one job per cache key: a request arriving while the same
+    computation is queued or running is given that job, and a request whose result is cached does not compute it again.
+
+    Parameters:
+    - cache (diskcache.Cache): Where the job states and results are kept.
+    - cache_by (list): Zero-argument functions whose values are part of the cache keys, e.g. the data version.
+    - expire (int): Seconds a result is kept after it was last read.
+    - threads (int): Jobs running at once in this process.
+    """
+
+    def __init__(self, cache=None, cache_by=None, expire=None, threads: int = JOB_THREADS):
+        super().__init__(cache, cache_by=cache_by, expire=expire)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="dash-job")
+
+    def _run(self, job, key, job_fn, args, context):
+        try:
+            job_fn(key, self._make_progress_key(key), args, context)
+        finally:
+            self.handle.set(_state_key(job), "done", expire=JOB_DONE_GRACE)
+
+    def call_job_fn(self, key, job_fn, args, context):
+        import diskcache
+
+        # one request at a time per key, across the workers
+        with diskcache.Lock(self.handle, f"{key}-lock", expire=60):
+            if self.result_ready(key):
+                count_cache("background_jobs", True)
+                return uuid.uuid4().hex
+
+            job = self.handle.get(_job_key(key))
+            if job is not None and self.handle.get(_state_key(job)) == "running":
+                count_cache("background_jobs", True)
+                return job
+
+            job = uuid.uuid4().hex
+            self.handle.set(_state_key(job), "running", expire=JOB_TIMEOUT)
+            self.handle.set(_job_key(key), job, expire=JOB_TIMEOUT)
+
+        count_cache("background_jobs", False)
+        self.executor.submit(self._run, job, key, job_fn, args, context)
+        return job
+
+    def job_running(self, job):
+        return bool(job) and self.handle.get(_state_key(job)) is not None
+
+    def terminate_job(self, job):
+        # Dash cancels the job of a user who changed the inputs, but others may be waiting on it: it is left to
+        # finish, its result stays cached
+        pass
+
+    def terminate_unhealthy_job(self, job):
+        return False
+
+    def get_result(self, key, job):
+        result = super().get_result(key, job)
+
+        # the error of a failed job is shown to the requests waiting on it, then dropped: the next request tries again
+        if isinstance(result, dict) and "long_callback_error" in result:
+            self.handle.touch(key, expire=JOB_DONE_GRACE)
+
+        return result
+
+
+def job_manager(cache_by: list, directory: str = JOBS_DIR) -> CoalescingJobManager:
+    """
+    Creates the background callback manager of the dashboard.
+
+    Parameters:
+    - cache_by (list): Zero-argument functions whose values are part of the cache keys, e.g. the data version.
+                       Required: without it, Dash drops a result once its first poller has read it.
+    - directory (str): The diskcache directory.
+
+    Returns:
+    - CoalescingJobManager: The manager, given to dash.Dash as background_callback_manager.
+    """
+    import diskcache
+
+    cache = diskcache.Cache(directory, size_limit=JOBS_SIZE_LIMIT, eviction_policy="least-recently-used")
+    return CoalescingJobManager(cache, cache_by=cache_by, expire=JOB_RESULT_TTL)
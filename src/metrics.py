@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Process-wide metrics of the ETL stages and of the dashboard callbacks: stage timings, rows produced, errors,
+# bytes fetched and cache hits. They are exposed by the Dash server in the Prometheus text format (/metrics), and
+# summarized as JSON at the end of an ETL run (see write_summary).
+#
+# Every process keeps its own metrics: behind gunicorn, each worker answers /metrics with its own counts.
+NAMESPACE = "kabar_api"
+
+# Upper bounds of the stage duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counters (monotonic totals) and histograms (durations), both keyed by a metric name and
+    a tuple of label pairs.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Adds value to a counter.
+
+        Parameters:
+        - name (str): The metric name, without the namespace, e.g. "bytes_fetched_total".
+        - value (float): The increment.
+        - labels: The labels of the series, e.g. source="firms".
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Records a duration in a histogram.
+
+        Parameters:
+        - name (str): The metric name, without the namespace, e.g. "stage_duration_seconds".
+        - seconds (float): The observed duration.
+        - labels: The labels of the series, e.g. stage="cleaning_fetched_data".
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    # ----------------------------------------------------- ******************************** -----------------------------------------------------
+    def prometheus_text(self) -> str:
+        """
+        Renders all the metrics in the Prometheus text exposition format (version 0.0.4).
+
+        Returns:
+        - str: The metrics page.
+        """
+        def series(name, labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return f"{NAMESPACE}_{name}"
+            rendered = ",".join(f'{label}="{str(value)}"'.replace("\n", " ") for label, value in pairs)
+            return f"{NAMESPACE}_{name}{{{rendered}}}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.total, h.count)) for key, h in self._histograms.items())
+
+        lines = []
+        typed = set()
+
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {NAMESPACE}_{name} counter")
+                typed.add(name)
+            lines.append(f"{series(name, labels)} {value}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {NAMESPACE}_{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(list(DURATION_BUCKETS) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{series(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{series(name + '_sum', labels)} {total}")
+            lines.append(f"{series(name + '_count', labels)} {count}")
+
+        lines.append(f"# TYPE {NAMESPACE}_process_start_time_seconds gauge")
+        lines.append(f"{NAMESPACE}_process_start_time_seconds {self.started_at}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """
+        Summarizes the metrics per stage, source and cache, e.g. for the log of an ETL run.
+
+        Returns:
+        - dict: {"stages": {stage: {"kind", "calls", "errors", "seconds", "max_seconds", "rows"}},
+                 "bytes_fetched": {source: bytes}, "caches": {cache: {"hits", "misses"}}, "model_tokens": {model: tokens},
+                 "elapsed_seconds": float}
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.total, h.count, h.max) for key, h in self._histograms.items()}
+
+        stages = {}
+        for (name, labels), (total, count, slowest) in histograms.items():
+            if name != "stage_duration_seconds":
+                continue
+            labels = dict(labels)
+            stages[labels["stage"]] = {"kind": labels.get("kind"), "calls": count, "errors": 0,
+                                       "seconds": round(total, 4), "max_seconds": round(slowest, 4), "rows": 0}
+
+        bytes_fetched, caches, tokens = {}, {}, {}
+        for (name, labels), value in counters.items():
+            labels = dict(labels)
+            if name == "stage_errors_total" and labels["stage"] in stages:
+                stages[labels["stage"]]["errors"] = value
+            elif name == "stage_rows_total" and labels["stage"] in stages:
+                stages[labels["stage"]]["rows"] = value
+            elif name == "bytes_fetched_total":
+                bytes_fetched[labels["source"]] = value
+            elif name == "model_tokens_total":
+                tokens[labels["model"]] = tokens.get(labels["model"], 0) + value
+            elif name == "cache_requests_total":
+                cache = caches.setdefault(labels["cache"], {"hits": 0, "misses": 0})
+                cache["hits" if labels["result"] == "hit" else "misses"] += value
+
+        return {"stages": stages, "bytes_fetched": bytes_fetched, "caches": caches, "model_tokens": tokens,
+                "elapsed_seconds": round(time.time() - self.started_at, 3)}
+
+
+REGISTRY = MetricsRegistry()
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+def _rows(result):
+    # DataFrames (pandas, Polars, GeoPandas) count their rows, anything else (figures, Patch, tuples) does not
+    shape = getattr(result, "shape", None)
+    return shape[0] if isinstance(shape, tuple) and shape else None
+
+
+def instrumented(kind: str, stage: str = None):
+    """
+    Decorator timing a pipeline function, and counting its calls, errors and produced rows.
+    Following the convention of src/procedures.py, a function returning None has failed (the error was printed).
+
+    Parameters:
+    - kind (str): The kind of stage: "extract", "transform", "load", "query" or "chart".
+    - stage (str): The stage name. Defaults to the function name.
+
+    Returns:
+    - callable: The decorator.
+    """
+    def decorator(func):
+        name = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                REGISTRY.inc("stage_errors_total", stage=name, kind=kind)
+                raise
+            finally:
+                REGISTRY.observe("stage_duration_seconds", time.perf_counter() - start, stage=name, kind=kind)
+
+            if result is None:
+                REGISTRY.inc("stage_errors_total", stage=name, kind=kind)
+            else:
+                rows = _rows(result)
+                if rows is not None:
+                    REGISTRY.inc("stage_rows_total", rows, stage=name, kind=kind)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def count_bytes(source: str, n_bytes: int):
+    """
+    Counts bytes downloaded from a source, e.g. count_bytes("firms", len(r.content)).
+    """
+    REGISTRY.inc("bytes_fetched_total", n_bytes, source=source)
+
+
+def count_tokens(model: str, n_tokens: int):
+    """
+    Counts the tokens sent to and requested from a language model, e.g. count_tokens(backend.name, 1200).
+    """
+    REGISTRY.inc("model_tokens_total", n_tokens, model=model)
+
+
+def count_cache(cache: str, hit: bool):
+    """
+    Counts a lookup in a cache, e.g. count_cache("day_frames", trace is not None).
+    """
+    REGISTRY.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def write_summary(path: str = None) -> dict:
+    """
+    Writes the summary of the metrics of this process as JSON, at the end of an ETL run.
+
+    Parameters:
+    - path (str): The JSON file. Defaults to the KABAR_API_METRICS_JSON environment variable; if neither is set,
+                  the summary is printed.
+
+    Returns:
+    - dict: The summary.
+    """
+    summary = REGISTRY.summary()
+    path = path or os.environ.get("KABAR_API_METRICS_JSON")
+
+    if path:
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(json.dumps(summary, indent=2))
+
+    return summary
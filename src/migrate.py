@@ -0,0 +1,191 @@
+import os
+import glob
+import argparse
+import datetime
+
+from src.metrics import instrumented
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Schema migrations of the database, kept as numbered SQL files in ./migrations (001_<name>.sql, 002_<name>.sql, ...)
+# and applied in order, each one in its own transaction. Applied versions are recorded in schema_migrations, so
+# running the migrations again only applies the new files:
+#
+#     python -m src.migrate             # apply the pending migrations
+#     python -m src.migrate --status    # list the migrations and whether they are applied
+#
+# The loads that append to processed_viirs call ensure_partitions first, so that every month has its partition.
+MIGRATIONS_DIR = "./migrations"
+
+# Months ahead of the current one that get their processed_viirs partition on every run of the migrations
+PARTITIONS_AHEAD = 1
+
+
+def list_migrations(directory: str = MIGRATIONS_DIR) -> list:
+    """
+    Lists the migration files of a directory.
+
+    Parameters:
+    - directory (str): The directory holding the <version>_<name>.sql files.
+
+    Returns:
+    - list: (version, name, path) tuples, sorted by version.
+    """
+    migrations = []
+
+    for path in glob.glob(os.path.join(directory, "*.sql")):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        version, _, name = stem.partition("_")
+        if not version.isdigit():
+            raise ValueError(f"Migration file without a version number: {path}")
+        migrations.append((int(version), name, path))
+
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Two migrations share a version number in {directory}")
+
+    return sorted(migrations)
+
+
+def applied_migrations(connection) -> dict:
+    """
+    Returns the migrations already applied to a database, creating schema_migrations if needed.
+
+    Parameters:
+    - connection (psycopg2.extensions.connection): An open connection to the database.
+
+    Returns:
+    - dict: {version: applied_at}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMPTZ DEFAULT NOW()
+            )""")
+        cursor.execute("SELECT version, applied_at FROM schema_migrations")
+        applied = dict(cursor.fetchall())
+    connection.commit()
+
+    return applied
+
+
+def apply_migrations(connection, directory: str = MIGRATIONS_DIR) -> list:
+    """
+    Applies the pending migrations of a directory, in order. A failing migration is rolled back and stops the run,
+    the ones before it stay applied.
+
+    Parameters:
+    - connection (psycopg2.extensions.connection): An open connection to the database.
+    - directory (str): The directory holding the migration files.
+
+    Returns:
+    - list: The versions applied by this run.
+    """
+    applied = applied_migrations(connection)
+    done = []
+
+    for version, name, path in list_migrations(directory):
+        if version in applied:
+            continue
+
+        with open(path) as f:
+            script = f.read()
+
+        # the script and its record are committed together
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+            cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cursor.fetchone() is None:
+                cursor.execute(script)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        connection.commit()
+
+        done.append(version)
+        print(f"Applied migration {version:03d} {name}")
+
+    return done
+
+
+def ensure_partitions(cursor, first_day: datetime.date, last_day: datetime.date) -> int:
+    """
+    Creates the missing monthly partitions of processed_viirs between two dates, in the transaction of the cursor.
+    Rows already in the default partition move to the partition of their month.
+
+    Parameters:
+    - cursor (psycopg2.extensions.cursor): A cursor of the transaction loading the rows.
+    - first_day (datetime.date): The first date to be loaded.
+    - last_day (datetime.date): The last date to be loaded.
+
+    Returns:
+    - int: The number of partitions created.
+    """
+    cursor.execute("SELECT ensure_viirs_partitions(%s, %s)", (first_day, last_day))
+    return cursor.fetchone()[0]
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("load")
+def migrate(uri_connection: str, directory: str = MIGRATIONS_DIR) -> list:
+    """
+    Applies the pending migrations, then creates the partitions of processed_viirs up to PARTITIONS_AHEAD months
+    from now. Meant to be run on every deployment, and at least once a month.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Postgres (Supabase) database.
+    - directory (str): The directory holding the migration files.
+
+    Returns:
+    - list: The versions applied by this run, or None if the migrations failed.
+    """
+    import psycopg2
+
+    try:
+        with psycopg2.connect(uri_connection) as connection:
+            done = apply_migrations(connection, directory)
+
+            today = datetime.date.today()
+            ahead = datetime.date(today.year + (today.month + PARTITIONS_AHEAD - 1) // 12,
+                                  (today.month + PARTITIONS_AHEAD - 1) % 12 + 1, 1)
+            with connection.cursor() as cursor:
+                created = ensure_partitions(cursor, today, ahead)
+            connection.commit()
+
+            if created:
+                print(f"Created {created} partitions of processed_viirs")
+
+        return done
+
+    except Exception as e:
+        print(f"An error occurred while migrating the database: {e}")
+        return None
+
+
+def migration_status(uri_connection: str, directory: str = MIGRATIONS_DIR) -> list:
+    """
+    Lists the migrations of a directory with the time they were applied at.
+
+    Returns:
+    - list: (version, name, applied_at) tuples, applied_at being None for the pending ones.
+    """
+    import psycopg2
+
+    with psycopg2.connect(uri_connection) as connection:
+        applied = applied_migrations(connection)
+
+    return [(version, name, applied.get(version)) for version, name, _ in list_migrations(directory)]
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Applies the schema migrations of ./migrations.")
+    parser.add_argument("--status", action="store_true", help="only list the migrations")
+    parser.add_argument("--directory", default=MIGRATIONS_DIR)
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    uri = config.get("CONNECTION_URI")
+
+    if args.status:
+        for version, name, applied_at in migration_status(uri, args.directory):
+            print(f"{version:03d} {name:<40}{applied_at or 'pending'}")
+    elif migrate(uri, args.directory) is None:
+        raise SystemExit(1)
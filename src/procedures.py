@@ -5,18 +5,24 @@ import datetime
 import time
 import json
 import io
+import hashlib
 
 import geopandas as gpd
-from shapely.geometry import Point
 
 from gnews import GNews
 from newspaper import Article
 
-import plotly.express as px
-import plotly.graph_objects as go
 import altair as alt
 
+from src.metrics import instrumented, count_bytes
+from src.geohash import encode as encode_geohash, prefix_ranges
+from src.queries import fetch_query
+from src.cache import fetch_data_version, SHARED_FRAMES, RenderCache
+from src.figures import bar_figure, area_figure, density_map_figure, density_frame_patch, DayFrameCache, choropleth_figure
+from src.boundaries import FEATURE_ID
+
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("extract")
 def fetch_viirs_data(today: str, day_range: str, token: str) -> pl.DataFrame:
     """
     Retrieves VIIRS active fires data from the NASA FIRMS API for a given date and date range.
@@ -38,7 +44,10 @@ def fetch_viirs_data(today: str, day_range: str, token: str) -> pl.DataFrame:
         country = "IDN"
 
         url = (host + token + "/" + source + "/" + country + "/" + day_range + "/" + today)
-        viirs_df = pl.read_csv(url)
+        r = requests.get(url)
+        r.raise_for_status()
+        count_bytes("firms", len(r.content))
+        viirs_df = pl.read_csv(io.BytesIO(r.content))
         
         return viirs_df
 
@@ -49,25 +58,52 @@ def fetch_viirs_data(today: str, day_range: str, token: str) -> pl.DataFrame:
         print(f"An unexpected error occurred: {e}")
         return None
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
-def extract_administrative(df: pl.DataFrame) -> pd.DataFrame:
+def load_administrative_boundaries(file_path: str = "./data/IndonesianCitiesDistrictsUpdated.json") -> gpd.GeoDataFrame:
+    """
+    Loads the district boundaries used to tag the detections.
+
+    Parameters:
+    - file_path (str): Path to the districts GeoJSON, with the district name in "id" and its province in "provinsi".
+
+    Returns:
+    - gpd.GeoDataFrame: The district boundaries.
+    """
+    return gpd.read_file(file_path)
+
+
+@instrumented("transform")
+def extract_administrative(df: pl.DataFrame, adm_df: gpd.GeoDataFrame = None) -> pd.DataFrame:
+    """
+    Tags each VIIRS detection with the district (id) and province (provinsi) it falls in, with a spatial join,
+    and with its geohash (see src/geohash.py).
+
+    Parameters:
+    - df (pl.DataFrame): The fetched VIIRS detections.
+    - adm_df (gpd.GeoDataFrame): The district boundaries. Defaults to reading them from
+                                 ./data/IndonesianCitiesDistrictsUpdated.json; pass them in when tagging many batches.
+
+    Returns:
+    - pd.DataFrame: The detections joined with their administrative areas.
+    """
 
     # cast to pandas dataframe
     # load administrative boundaries
     viirs = df.to_pandas()
-    file_path = "./data/IndonesianCitiesDistrictsUpdated.json"
-    adm_df = gpd.read_file(file_path)
+    if adm_df is None:
+        adm_df = load_administrative_boundaries()
 
-    # Zip lat-lon as tuple, convert to Points object
-    viirs["coords"] = list(zip(viirs["longitude"], viirs["latitude"]))
-    viirs["coords"] = viirs["coords"].apply(Point)
+    # Lat-lon to Points objects
+    viirs["coords"] = gpd.points_from_xy(viirs["longitude"], viirs["latitude"])
+    viirs["geohash"] = encode_geohash(viirs["latitude"].to_numpy(), viirs["longitude"].to_numpy())
 
     # Turn into geodataframe, perform spatial join
-    points = gpd.GeoDataFrame(viirs, geometry="coords")
+    points = gpd.GeoDataFrame(viirs, geometry="coords", crs=adm_df.crs)
     joined_df = gpd.tools.sjoin(points, adm_df, predicate="within", how='left')
 
     return joined_df
 
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("query")
 def fetch_last_data(query: str, uri_connection: str) -> pl.DataFrame:
     """
     Retrieves the most recently updated data from the database based on the provided SQL query.
@@ -88,6 +124,7 @@ def fetch_last_data(query: str, uri_connection: str) -> pl.DataFrame:
         return None
 
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("transform")
 def cleaning_fetched_data(df: pd.DataFrame) -> pl.DataFrame:
     """
     Cleans the newly fetched data by dropping unnecessary columns, adding a new column,
@@ -157,6 +194,7 @@ def cleaning_fetched_data(df: pd.DataFrame) -> pl.DataFrame:
         return None
 
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("extract")
 def fetch_air_quality_data() -> pl.DataFrame:
     """
     Fetches air quality data from the provided API endpoint, processes it, and returns a Polars DataFrame.
@@ -168,33 +206,49 @@ def fetch_air_quality_data() -> pl.DataFrame:
         # Set endpoint, request it and extract the JSON object by parsing it into a Pandas DataFrame
         endpoint = "https://sipongi.menlhk.go.id/api/aqms"
         r = requests.get(endpoint, headers={'Accept': 'application/json'})
+        count_bytes("aqms", len(r.content))
         aqms_json = r.json()
-        aqms_df = pd.json_normalize(aqms_json["features"])
 
-        # Select the desired columns, and rename them
-        columns_to_select = ["properties.alamat", "geometry.coordinates", "properties.kota", "properties.provinsi", "properties.nilai", "properties.cat", "properties.waktu"]
-        aqms_df = aqms_df[columns_to_select]
-        aqms_df.columns = ["address", "coordinates", "city", "province", "air_quality_index", "category", "updated_at"]
-        aqms_df["latitude"] = aqms_df["coordinates"].apply(lambda x: x[1])
-        aqms_df["longitude"] = aqms_df["coordinates"].apply(lambda x: x[0])
-        aqms_df.drop(columns=["coordinates"], inplace=True)
+        return parse_aqms(aqms_json)
 
-        # Add a new "fetched_date" column with today's date
-        today_date = datetime.date.today()
-        aqms_df["fetched_date"] = today_date
+    except Exception as e:
+        print(f"An error occurred while fetching air quality data: {e}")
+        return None
 
-        aqms_df.dropna(subset=["air_quality_index"], inplace=True)
 
-        # Convert to a Polars DataFrame
-        pl_aqms = pl.from_pandas(aqms_df)
+def parse_aqms(aqms_json: dict) -> pl.DataFrame:
+    """
+    Flattens the GeoJSON answered by the SIPONGI AQMS endpoint into one row per sensor.
 
-        return pl_aqms
+    Parameters:
+    - aqms_json (dict): The decoded GeoJSON FeatureCollection.
 
-    except Exception as e:
-        print(f"An error occurred while fetching air quality data: {e}")
-        return None
+    Returns:
+    - pl.DataFrame: A Polars DataFrame with the sensor readings and today's date as fetched_date.
+    """
+    aqms_df = pd.json_normalize(aqms_json["features"])
+
+    # Select the desired columns, and rename them
+    columns_to_select = ["properties.alamat", "geometry.coordinates", "properties.kota", "properties.provinsi", "properties.nilai", "properties.cat", "properties.waktu"]
+    aqms_df = aqms_df[columns_to_select]
+    aqms_df.columns = ["address", "coordinates", "city", "province", "air_quality_index", "category", "updated_at"]
+    aqms_df["latitude"] = aqms_df["coordinates"].apply(lambda x: x[1])
+    aqms_df["longitude"] = aqms_df["coordinates"].apply(lambda x: x[0])
+    aqms_df.drop(columns=["coordinates"], inplace=True)
+
+    # Add a new "fetched_date" column with today's date
+    today_date = datetime.date.today()
+    aqms_df["fetched_date"] = today_date
+
+    aqms_df.dropna(subset=["air_quality_index"], inplace=True)
+
+    # Convert to a Polars DataFrame
+    pl_aqms = pl.from_pandas(aqms_df)
+
+    return pl_aqms
 
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("transform")
 def cleaning_aqms_data(df: pl.DataFrame) -> pl.DataFrame:
     """
     Cleans the provided air quality data Polars DataFrame by reordering columns,
@@ -229,7 +283,8 @@ def cleaning_aqms_data(df: pl.DataFrame) -> pl.DataFrame:
 
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
 
-def fetch_articles(keywords_list: list, max_results: int, day_range: int) -> pd.DataFrame:
+@instrumented("extract")
+def fetch_articles(keywords_list: list, max_results: int, day_range: int, pause: float = 1) -> pd.DataFrame:
     """
     Fetches news articles using the Google News API for a list of keywords,
     extracts relevant information, and returns a concatenated DataFrame.
@@ -238,6 +293,7 @@ def fetch_articles(keywords_list: list, max_results: int, day_range: int) -> pd.
     - keywords_list (list): List of keywords to search for in the news articles.
     - max_results (int): Maximum number of news articles to retrieve for each keyword.
     - day_range (int): Number of days in the past to search for news articles.
+    - pause (float): Seconds waited after each article download. Can be 0 when replaying an HTTP archive.
 
     Returns:
     - pd.DataFrame: A concatenated DataFrame containing relevant information from the retrieved articles.
@@ -275,8 +331,9 @@ def fetch_articles(keywords_list: list, max_results: int, day_range: int) -> pd.
             for url in articles_df["url"]:
                 try:
                     # Download the article content and extract the text
-                    get_article = Article(url)
+                    get_article = Article(url, language="id")
                     get_article.download()
+                    count_bytes("news", len(get_article.html.encode()))
                     get_article.parse()
                     full_text = get_article.text
 
@@ -294,7 +351,7 @@ def fetch_articles(keywords_list: list, max_results: int, day_range: int) -> pd.
                     images.append(None)
 
                 # Sleep for a short time to avoid being blocked by the website
-                time.sleep(1)
+                time.sleep(pause)
 
             # Add the full text and image URL columns to the DataFrame
             articles_df["article_text"] = articles
@@ -320,6 +377,7 @@ def fetch_articles(keywords_list: list, max_results: int, day_range: int) -> pd.
         return None
 
 # ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("transform")
 def cleaning_articles(df: pd.DataFrame) -> pl.DataFrame:
     """
     Cleans and transforms a DataFrame containing news articles.
@@ -375,16 +433,31 @@ def cleaning_articles(df: pd.DataFrame) -> pl.DataFrame:
 
 
 # ----------------------------------------------------- DASH VIZ -----------------------------------------------------
+# Per-day hotspots of the last window fetched for each timeframe (and of the last viewports, which are small), served to
+# the date slider of the density map. The windows are keyed with the data version of processed_viirs, so that a worker
+# never answers the slider from a window older than the store_data of the page.
+DAY_FRAMES = DayFrameCache(max_windows=32)
+
+@instrumented("chart")
 def generate_density_map(n_day: int, uri_connection: str):
-    value = n_day
+    """
+    Fetches the hotspots of a timeframe and builds the density map (see build_density_map).
 
-    CONNECTION_URI = uri_connection
-    query = f"""
-        SELECT latitude, longitude, acq_date, acq_time, confidence, frp, brightness, second_adm, first_adm
-        FROM processed_viirs 
-        WHERE acq_date > CURRENT_DATE - INTERVAL '{value} day'"""
+    Returns:
+    - tuple: The figure dict, the hotspots as a split-oriented JSON string, the sorted dates of the window, and the
+             identifier of the window in DAY_FRAMES, "<n_day>@<data version>".
+    """
+    # fetched once per data version by one worker of the host, the others map its copy
+    version = fetch_data_version("processed_viirs", uri_connection=uri_connection)
+    processed_viirs = SHARED_FRAMES.get_or_fetch(f"density_map-{int(n_day)}", version,
+                                                 lambda: fetch_query("density_map", uri_connection, n_day=int(n_day)))
+
+    key = f"{int(n_day)}@{version}"
+    return (*build_density_map(processed_viirs, key=key), key)
 
-    processed_viirs = fetch_last_data(query=query, uri_connection=CONNECTION_URI)
+
+def _dashboard_frame(processed_viirs: pl.DataFrame) -> pd.DataFrame:
+    # hotspots sorted by date, with the column names shown by the dashboard
     df_viirs = processed_viirs.to_pandas()
 
     df_viirs.sort_values(by=["acq_date"], ascending=True, inplace=True)
@@ -394,120 +467,198 @@ def generate_density_map(n_day: int, uri_connection: str):
 
     df_viirs["Date"] = df_viirs["Date"].astype(str)
 
-    # dff = pd.read_json(data, orient='split')
+    return df_viirs
 
-    hover_dict = {"latitude":False, "longitude":False, "Date":True, "acq_time":False, 
-                "Confidence":True,"Fire Radiative Power":True, "District":True, 
-                "Province":False, "Brightness":True}
 
+def build_density_map(processed_viirs: pl.DataFrame, key=None):
+    """
+    Builds the density map of the latest day and the jsonified data shared with the other charts out of the fetched hotspots.
+    The other days of the window are kept in DAY_FRAMES and sent only when selected on the date slider.
 
-    map_fig = px.density_mapbox(df_viirs, lat="latitude", lon="longitude", z="Fire Radiative Power",
-                                radius=3, hover_name="Province",
-                                hover_data=hover_dict,
-                                center=dict(lat=-2.5, lon=118), zoom=3.6, color_continuous_scale="matter_r", 
-                                mapbox_style="carto-positron", template="plotly_dark", animation_frame="Date"
-                                )
-    
-    
-    map_fig.update_layout(autosize=True)
-    map_fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    map_fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
-    map_fig.update_coloraxes(showscale=True, colorbar=dict(len=0.3, title="Fire Radiative Power", thickness=10, orientation="h", y=0, x=0.15, title_side="top"))
+    Parameters:
+    - processed_viirs (pl.DataFrame): Hotspots as returned by the query of generate_density_map.
+    - key: Identifier of the window in DAY_FRAMES, e.g. the timeframe and the data version "7@<version>".
 
-    last_frame_num = int(len(map_fig.frames) -1)
-    map_fig.layout['sliders'][0]['active'] = last_frame_num
-    map_fig = go.Figure(data=map_fig['frames'][last_frame_num]['data'], frames=map_fig['frames'], layout=map_fig.layout)
+    Returns:
+    - tuple: The figure dict, the hotspots as a split-oriented JSON string, and the sorted dates of the window.
+    """
+    df_viirs = _dashboard_frame(processed_viirs)
 
-    map_fig["layout"].pop("updatemenus")
-    map_fig.update_layout(sliders=[dict(pad={"r":50, "l":10, "t":0})])
+    # only the latest day goes into the figure, its trace is built right away
+    dates = DAY_FRAMES.store(key, df_viirs)
+    map_fig = density_map_figure(DAY_FRAMES.get(key, dates[-1]) if dates else None)
 
-    return map_fig, df_viirs.to_json(date_format='iso', orient='split')
+    return map_fig, df_viirs.to_json(date_format='iso', orient='split'), dates
 
 
-def generate_line_chart(data: json):
+@instrumented("chart")
+def generate_viewport_frame(n_day: int, bounds: tuple, date: str, uri_connection: str):
+    """
+    Fetches the hotspots of a timeframe inside the visible part of the density map only, with range scans of the
+    geohash column, and returns the day shown on the map. The charts keep the national data of generate_density_map.
 
-    dff = pd.read_json(io.StringIO(data), orient='split')
-    fires_count = dff['Fire Radiative Power'].count()
-    confidence_count = dff["Confidence"][dff["Confidence"]=="High"].count()
+    Parameters:
+    - n_day (int): Number of days of the timeframe.
+    - bounds (tuple): The viewport (west, south, east, north), in degrees, as returned by relayout_bounds.
+    - date (str): The day shown on the map, formatted as "YYYY-MM-DD".
+    - uri_connection (str): The connection URI to the Supabase database.
 
-    fires_count_formatted = f"{fires_count:,}"
-    confidence_count_formatted = f"{confidence_count:,}"
+    Returns:
+    - tuple: The partial update of the density map, and the identifier of the viewport window in DAY_FRAMES
+             (used by the date slider). None if the hotspots could not be fetched.
+    """
+    west, south, east, north = (float(value) for value in bounds)
+    ranges = prefix_ranges(west, south, east, north)
 
+    processed_viirs = fetch_query("viewport", uri_connection, n_day=int(n_day),
+                                  lows=",".join(low for low, _ in ranges),
+                                  highs=",".join(high or "~" for _, high in ranges),
+                                  west=west, south=south, east=east, north=north)
 
-    dff.index = pd.DatetimeIndex(dff["Date"])
+    if processed_viirs is None:
+        return None
 
-    print(dff)
+    version = fetch_data_version("processed_viirs", uri_connection=uri_connection)
+    key = f"{int(n_day)}@{version}@{west:.4f},{south:.4f},{east:.4f},{north:.4f}"
+    DAY_FRAMES.store(key, _dashboard_frame(processed_viirs))
 
-    # Upsample to daily frequency and count the number of fires in each day
-    dff = dff.resample('D')['Fire Radiative Power'].count()
+    return density_frame_patch(DAY_FRAMES.get(key, date)), key
 
-    fig = px.area(dff, x=dff.index, y=dff.values,
-            labels={"y":"<b>Titik Api Terdeteksi</b>", "Date":""}, template="plotly_dark")
 
-    fig.update_layout(autosize=True)
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    fig.update_traces(line_color='indianred')
-    fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
-    fig.update_yaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
-    fig.update_layout(xaxis_showgrid=True, yaxis_showgrid=False)
+@instrumented("chart")
+def generate_density_frame(key, date: str, data: json = None):
+    """
+    Returns the partial update showing one day of the window on the density map.
 
-    # print(fires_count)
-    # print(confidence_count)
+    Parameters:
+    - key: Identifier of the window in DAY_FRAMES, as returned by generate_density_map or generate_viewport_frame.
+    - date (str): The requested day, formatted as "YYYY-MM-DD".
+    - data (json): The jsonified window, used when the day is not cached in this process (e.g. another worker fetched it).
 
-    return fig, fires_count_formatted, confidence_count_formatted
+    Returns:
+    - Patch: The partial update of the density map figure.
+    """
+    trace = DAY_FRAMES.get(key, date)
+
+    if trace is None and data is not None:
+        # the window is kept for the next days of the slider
+        dff = pd.read_json(io.StringIO(data), orient='split', convert_dates=False)
+        dff["Date"] = dff["Date"].astype(str).str[:10]
+        DAY_FRAMES.store(key, dff)
+        trace = DAY_FRAMES.get(key, date)
 
+    return density_frame_patch(trace)
 
-def generate_top_prov(data: json):
 
+def chart_aggregates(data: json) -> dict:
+    """
+    Counts the hotspots of the jsonified window for the line chart, the fire counters and the two bar charts, with a
+    single parse of the JSON.
+
+    Parameters:
+    - data (json): The hotspots of the timeframe, as kept in store_data.
+
+    Returns:
+    - dict: The days and their counts ("dates", "daily_counts"), the counters ("fires_count", "confidence_count")
+            and the top five provinces and districts ("Province", "District": [names, counts]).
+    """
     dff = pd.read_json(io.StringIO(data), orient='split')
-    grouped = dff.groupby(["Province"]).agg(
-        total_fires = ("Fire Radiative Power", "count")
-        )
+    aggregates = {
+        "fires_count": int(dff['Fire Radiative Power'].count()),
+        "confidence_count": int(dff["Confidence"][dff["Confidence"]=="High"].count()),
+    }
+
+    for column in ["Province", "District"]:
+        grouped = dff.groupby([column]).agg(
+            total_fires = ("Fire Radiative Power", "count")
+            )
+        grouped = grouped.sort_values(by="total_fires", ascending=False).reset_index()
+        grouped = grouped.head(5)
+        aggregates[column] = [grouped[column].tolist(), [int(count) for count in grouped["total_fires"]]]
 
-    grouped = grouped.sort_values(by="total_fires", ascending=False).reset_index()
-    grouped = grouped.head(5)
+    dff.index = pd.DatetimeIndex(dff["Date"])
 
-    fig = px.bar(grouped, x="total_fires", y="Province", orientation="h", text="total_fires",
-                    labels={"Province":"", "total_fires":"<b>Titik Api Terdeteksi</b>"}, template="plotly_dark")
+    # Upsample to daily frequency and count the number of fires in each day
+    daily = dff.resample('D')['Fire Radiative Power'].count()
+    aggregates["dates"] = daily.index.strftime('%Y-%m-%d').tolist()
+    aggregates["daily_counts"] = [int(count) for count in daily.values]
 
-    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    return aggregates
 
-    fig.update_layout(autosize=True)
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    fig.update_traces(marker_color='indianred')
-    fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
-    fig.update_xaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
-    fig.update_layout(xaxis_showgrid=False, yaxis_showgrid=False)
-    
 
-    return fig
+def cached_chart_aggregates(data: json, n_day: int, cache: RenderCache) -> dict:
+    """
+    Returns the chart_aggregates of a window, computed once per content of the window and timeframe and kept in the
+    render cache, where the warm-up after the ETL (src/warmup.py) puts them.
 
-def generate_top_kabkot(data: json):
+    Parameters:
+    - data (json): The hotspots of the timeframe, as kept in store_data.
+    - n_day (int): The timeframe the window was fetched for.
+    - cache (RenderCache): The render cache of the dashboard.
 
-    dff = pd.read_json(io.StringIO(data), orient='split')
-    grouped = dff.groupby(["District"]).agg(
-        total_fires = ("Fire Radiative Power", "count")
-        )
+    Returns:
+    - dict: As returned by chart_aggregates.
+    """
+    # the digest of the JSON rather than the data version, so that a window fetched before a load is not counted
+    # with the numbers of the new one
+    digest = hashlib.sha1(data.encode()).hexdigest()
+    text = cache.get_or_render(f"chart_aggregates-{int(n_day)}", digest, lambda: json.dumps(chart_aggregates(data)))
 
-    grouped = grouped.sort_values(by="total_fires", ascending=False).reset_index()
-    grouped = grouped.head(5)
+    return json.loads(text)
 
-    fig = px.bar(grouped, x="total_fires", y="District", orientation="h", text="total_fires",
-                    labels={"District":"", "total_fires":"<b>Titik Api Terdeteksi</b>"}, template="plotly_dark")
 
-    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+@instrumented("chart")
+def generate_line_chart(data: json, patch: bool = False, aggregates: dict = None):
 
-    fig.update_layout(autosize=True)
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    fig.update_traces(marker_color='indianred')
-    fig.update_layout({'plot_bgcolor': 'rgba(0, 0, 0, 0)','paper_bgcolor': 'rgba(0, 0, 0, 0)',})
-    fig.update_xaxes(title_font=dict(size=12), zeroline=True, zerolinewidth=2)
-    fig.update_layout(xaxis_showgrid=False, yaxis_showgrid=False)
-    
+    aggregates = aggregates or chart_aggregates(data)
+
+    fires_count_formatted = f"{aggregates['fires_count']:,}"
+    confidence_count_formatted = f"{aggregates['confidence_count']:,}"
+
+    fig = area_figure(aggregates["dates"], aggregates["daily_counts"], patch=patch)
+
+    return fig, fires_count_formatted, confidence_count_formatted
+
+
+@instrumented("chart")
+def generate_top_prov(data: json, patch: bool = False, aggregates: dict = None):
+
+    names, counts = (aggregates or chart_aggregates(data))["Province"]
+    fig = bar_figure(names, counts, patch=patch)
 
     return fig
 
+@instrumented("chart")
+def generate_top_kabkot(data: json, patch: bool = False, aggregates: dict = None):
+
+    names, counts = (aggregates or chart_aggregates(data))["District"]
+    fig = bar_figure(names, counts, patch=patch)
+
+    return fig
+
+
+@instrumented("chart")
+def generate_choropleth(data: json, layer: str, geojson_url: str) -> dict:
+    """
+    Counts the detected fires of the timeframe per province or district, for the choropleth.
+
+    Parameters:
+    - data (json): The hotspots of the timeframe, as kept in store_data.
+    - layer (str): "provinces" or "districts".
+    - geojson_url (str): URL of the boundaries of the layer, at the level of detail of the current zoom.
+
+    Returns:
+    - dict: The figure dict.
+    """
+    column = "Province" if layer == "provinces" else "District"
+
+    dff = pd.read_json(io.StringIO(data), orient='split')
+    counts = dff.groupby(column).size()
+
+    return choropleth_figure(geojson_url, FEATURE_ID[layer], counts.index.tolist(), counts.tolist())
+
 
+@instrumented("chart")
 def generate_calendar(dataframe):
     heatmap = alt.Chart(dataframe.reset_index()).mark_rect().encode(
         x=alt.X("date", timeUnit="date", type="ordinal", title=""),
@@ -533,4 +684,15 @@ def generate_calendar(dataframe):
             # titleColor="white"
         )
     
-    return heatmap.to_html()
\ No newline at end of file
+    return heatmap.to_html()
+
+
+def render_calendar(uri_connection: str) -> str:
+    """
+    Fetches the daily max temperatures and renders the calendar heatmap.
+
+    Returns:
+    - str: The HTML of the calendar.
+    """
+    max_temperature = fetch_query("daily_max_temperature", uri_connection)
+    return generate_calendar(max_temperature.to_pandas())
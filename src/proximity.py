@@ -0,0 +1,206 @@
+import argparse
+
+import numpy as np
+import polars as pl
+from scipy.spatial import cKDTree
+
+from src.queries import fetch_query
+from src.metrics import instrumented, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Fire pressure on the AQMS sensors: for every sensor of an air quality batch, the number of hotspots and their summed
+# FRP within each radius of PRESSURE_RADII_KM, stored in air_quality_fire_pressure (migrations/006_air_quality_fire_pressure.sql)
+# next to the readings of air_quality_idn (same address, city, province and updated_at).
+#
+# Sensors and hotspots are placed on the unit sphere (x, y, z) and indexed with KD-trees: the straight-line distance
+# between two points of the sphere is 2 * sin(d / 2R) for a great-circle distance d, so a radius in km is an exact
+# chord radius, with no distortion away from the equator and no special case at the antimeridian. The pairs within
+# the largest radius are found once, tree against tree, and each smaller radius is a mask over them.
+EARTH_RADIUS_KM = 6371.0088
+
+PRESSURE_RADII_KM = (10.0, 25.0, 50.0)
+
+PRESSURE_TABLE = "air_quality_fire_pressure"
+
+SENSOR_COLUMNS = ["address", "city", "province", "lat_sensor", "lon_sensor", "updated_at", "fetched_date"]
+
+
+def unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Returns the points of the unit sphere at the given coordinates.
+
+    Parameters:
+    - latitude (np.ndarray): Latitudes in degrees.
+    - longitude (np.ndarray): Longitudes in degrees.
+
+    Returns:
+    - np.ndarray: An (n, 3) array of x, y, z coordinates.
+    """
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def km_to_chord(km) -> np.ndarray:
+    return 2 * np.sin(np.asarray(km, dtype=np.float64) / (2 * EARTH_RADIUS_KM))
+
+
+def chord_to_km(chord) -> np.ndarray:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord, dtype=np.float64) / 2, 0, 1))
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class SensorIndex:
+    """
+    KD-tree over the AQMS sensor locations, counting the hotspots around each sensor.
+
+    Parameters:
+    - latitude (np.ndarray): Latitudes of the sensors, in degrees.
+    - longitude (np.ndarray): Longitudes of the sensors, in degrees.
+    """
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray):
+        self.points = unit_vectors(latitude, longitude)
+        self.tree = cKDTree(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def pressure(self, latitude: np.ndarray, longitude: np.ndarray, frp: np.ndarray,
+                 radii_km: tuple = PRESSURE_RADII_KM) -> dict:
+        """
+        Counts the hotspots and sums their FRP within each radius of every sensor.
+
+        Parameters:
+        - latitude (np.ndarray): Latitudes of the hotspots, in degrees.
+        - longitude (np.ndarray): Longitudes of the hotspots, in degrees.
+        - frp (np.ndarray): Fire radiative power of the hotspots, in MW. Missing values count as 0.
+        - radii_km (tuple): The radii, in km.
+
+        Returns:
+        - dict: "n_hotspots" and "frp_sum", (sensors, radii) arrays, and "nearest_hotspot_km", the distance from every
+                sensor to its nearest hotspot (NaN when there is no hotspot).
+        """
+        n_sensors, radii = len(self), np.asarray(radii_km, dtype=np.float64)
+        n_hotspots = np.zeros((n_sensors, len(radii)), dtype=np.int32)
+        frp_sum = np.zeros((n_sensors, len(radii)), dtype=np.float64)
+        nearest = np.full(n_sensors, np.nan)
+
+        if n_sensors == 0 or len(latitude) == 0:
+            return {"n_hotspots": n_hotspots, "frp_sum": frp_sum, "nearest_hotspot_km": nearest}
+
+        hotspot_tree = cKDTree(unit_vectors(latitude, longitude))
+        frp = np.nan_to_num(np.asarray(frp, dtype=np.float64))
+
+        pairs = self.tree.sparse_distance_matrix(hotspot_tree, km_to_chord(radii.max()), output_type="ndarray")
+        sensor, chord, weight = pairs["i"], pairs["v"], frp[pairs["j"]]
+
+        for k, radius in enumerate(km_to_chord(radii)):
+            within = chord <= radius
+            n_hotspots[:, k] = np.bincount(sensor[within], minlength=n_sensors)
+            frp_sum[:, k] = np.bincount(sensor[within], weights=weight[within], minlength=n_sensors)
+
+        nearest[:] = chord_to_km(hotspot_tree.query(self.points, k=1)[0])
+
+        return {"n_hotspots": n_hotspots, "frp_sum": frp_sum, "nearest_hotspot_km": nearest}
+
+
+def fire_pressure(aqms: pl.DataFrame, hotspots: pl.DataFrame, radii_km: tuple = PRESSURE_RADII_KM) -> pl.DataFrame:
+    """
+    Computes the fire pressure on every sensor of an AQMS batch.
+
+    Parameters:
+    - aqms (pl.DataFrame): The readings, as returned by cleaning_aqms_data or the air_quality_sensors query. Sensors
+                           without valid coordinates are left out.
+    - hotspots (pl.DataFrame): The detections, with latitude, longitude and frp columns.
+    - radii_km (tuple): The radii, in km.
+
+    Returns:
+    - pl.DataFrame: One row per sensor and radius, with the sensor columns of air_quality_idn, radius_km,
+                    n_hotspots, frp_sum and nearest_hotspot_km.
+    """
+    sensors = (
+        aqms
+        .select(SENSOR_COLUMNS)
+        .with_columns(pl.col("lat_sensor").cast(pl.Float64, strict=False).alias("latitude"),
+                      pl.col("lon_sensor").cast(pl.Float64, strict=False).alias("longitude"))
+        .filter(pl.col("latitude").is_between(-90, 90) & pl.col("longitude").is_between(-180, 180))
+    )
+    hotspots = hotspots.select(["latitude", "longitude", "frp"]).drop_nulls(["latitude", "longitude"])
+
+    index = SensorIndex(sensors["latitude"].to_numpy(), sensors["longitude"].to_numpy())
+    pressure = index.pressure(hotspots["latitude"].to_numpy(), hotspots["longitude"].to_numpy(),
+                              hotspots["frp"].to_numpy(), radii_km)
+
+    n_radii = len(radii_km)
+    return (
+        sensors
+        .drop(["latitude", "longitude"])
+        .select(pl.all().repeat_by(n_radii).explode())
+        .with_columns(
+            pl.Series("radius_km", np.tile(np.asarray(radii_km, dtype=np.float64), len(index))),
+            pl.Series("n_hotspots", pressure["n_hotspots"].ravel()),
+            pl.Series("frp_sum", pressure["frp_sum"].ravel().round(2)),
+            pl.Series("nearest_hotspot_km", np.repeat(pressure["nearest_hotspot_km"], n_radii).round(3),
+                      nan_to_null=True),
+        )
+    )
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("load")
+def load_fire_pressure(aqms: pl.DataFrame, hotspots: pl.DataFrame, uri_connection: str,
+                       radii_km: tuple = PRESSURE_RADII_KM) -> int:
+    """
+    Appends the fire pressure of an AQMS batch to air_quality_fire_pressure.
+
+    Parameters:
+    - aqms (pl.DataFrame): The readings of the batch, as loaded to air_quality_idn.
+    - hotspots (pl.DataFrame): The detections around the time of the readings.
+    - uri_connection (str): The connection URI to the Supabase database.
+    - radii_km (tuple): The radii, in km.
+
+    Returns:
+    - int: The number of rows appended, or None if the load failed.
+    """
+    pressure = fire_pressure(aqms, hotspots, radii_km)
+
+    try:
+        if not pressure.is_empty():
+            pressure.write_database(table_name=PRESSURE_TABLE, connection=uri_connection, if_exists="append")
+
+    except Exception as e:
+        print(f"An error occurred while loading the fire pressure: {e}")
+        return None
+
+    return pressure.height
+
+
+def update_fire_pressure(uri_connection: str, n_day: int = 1, radii_km: tuple = PRESSURE_RADII_KM) -> int:
+    """
+    Computes the fire pressure of today's latest AQMS readings from the hotspots of the last n_day days, as stored in
+    the database.
+
+    Returns:
+    - int: The number of rows appended, or None if the data could not be read or loaded.
+    """
+    aqms = fetch_query("air_quality_sensors", uri_connection)
+    hotspots = fetch_query("recent_hotspots", uri_connection, n_day=n_day)
+    if aqms is None or hotspots is None:
+        return None
+
+    return load_fire_pressure(aqms, hotspots, uri_connection, radii_km)
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Appends the fire pressure of today's AQMS readings to "
+                                                 f"{PRESSURE_TABLE}.")
+    parser.add_argument("--days", type=int, default=1, help="hotspots of the last DAYS days are counted")
+    parser.add_argument("--radii", type=float, nargs="+", default=list(PRESSURE_RADII_KM), help="radii, in km")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    print(update_fire_pressure(config.get("CONNECTION_URI"), n_day=args.days, radii_km=tuple(args.radii)))
+    write_summary(args.metrics_json)
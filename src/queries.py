@@ -0,0 +1,315 @@
+import os
+import re
+import functools
+import threading
+
+import polars as pl
+
+from src.metrics import instrumented
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Named, parameterized queries of the dashboard. Every query is one constant statement text whatever its parameters
+# (e.g. the timeframe of the density map), so that the server can reuse its plan, and values never go through string
+# formatting. Parameters are written %(name)s and passed by name:
+#
+#     fetch_query("density_map", uri_connection, n_day=7)
+#
+# Three drivers run them (DB_DRIVER, or the KABAR_API_DB_DRIVER environment variable):
+#   - adbc        ADBC (adbc-driver-postgresql): bind parameters, results fetched as Arrow. One connection per thread
+#                 and one statement per query, prepared once; libpq still plans it at each execution (unnamed
+#                 statements).
+#   - psycopg     psycopg 3 server-side prepared statements: the plan is kept by the server for the connection, the
+#                 rows go through Python tuples. Needs a direct or session-mode connection (not a transaction-mode
+#                 pooler).
+#   - connectorx  read_database_uri, as fetch_last_data does: results fetched as Arrow, but no bind parameters (they
+#                 are quoted as literals by psycopg) and a new connection per query.
+# benchmarks/bench_drivers.py compares their latency on each query.
+QUERIES = {
+    # processed_viirs
+    "density_map": """
+        SELECT latitude, longitude, acq_date, acq_time, confidence, frp, brightness, second_adm, first_adm
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - %(n_day)s::integer""",
+
+    # the hotspots of a map viewport: geohash ranges (see src/geohash.py.prefix_ranges, comma-separated bounds, "~"
+    # standing for the end of the column), then the exact bounding box
+    "viewport": """
+        SELECT latitude, longitude, acq_date, acq_time, confidence, frp, brightness, second_adm, first_adm
+        FROM processed_viirs
+        JOIN unnest(string_to_array(%(lows)s, ','), string_to_array(%(highs)s, ',')) AS cell(low, high)
+            ON geohash >= cell.low AND geohash < cell.high
+        WHERE acq_date > CURRENT_DATE - %(n_day)s::integer
+          AND longitude BETWEEN %(west)s::double precision AND %(east)s::double precision
+          AND latitude BETWEEN %(south)s::double precision AND %(north)s::double precision""",
+
+    "tile_window": """
+        SELECT latitude, longitude, acq_date, frp, confidence, second_adm, first_adm
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - %(n_day)s::integer""",
+
+    # one day of the exports of src/export.py, provinces and districts comma-separated, all when empty
+    "export_hotspots": """
+        SELECT latitude, longitude, brightness, acq_date, acq_time, satellite, instrument, confidence, version, frp,
+               daynight, second_adm, first_adm
+        FROM processed_viirs
+        WHERE acq_date = %(day)s::date
+          AND (%(provinces)s = '' OR first_adm = ANY(string_to_array(%(provinces)s, ',')))
+          AND (%(districts)s = '' OR second_adm = ANY(string_to_array(%(districts)s, ',')))
+        ORDER BY acq_time, latitude, longitude""",
+
+    # the hotspots counted around the AQMS sensors (src/proximity.py)
+    "recent_hotspots": """
+        SELECT latitude, longitude, frp
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - %(n_day)s::integer""",
+
+    # the detections not tagged with their nearest GSOD station yet (src/weather.py)
+    "weather_pending": """
+        SELECT latitude, longitude, acq_date, acq_time
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - %(n_day)s::integer AND gsod_station IS NULL""",
+
+    # the daily hotspots of every district, counted into the baseline of src/anomaly.py
+    "district_daily_counts": """
+        SELECT acq_date, first_adm, second_adm, COUNT(*)::integer AS n_hotspots
+        FROM processed_viirs
+        WHERE acq_date BETWEEN %(first_day)s::date AND %(last_day)s::date AND second_adm IS NOT NULL
+        GROUP BY acq_date, first_adm, second_adm""",
+
+    # the data version of src/cache.py: only the partitions of the last 31 days are read, the longest timeframe of the
+    # dashboard and the days the daily loads append to, so that it costs the same however long the history is
+    "processed_viirs_version": """
+        SELECT MAX(acq_date) AS last_date, COUNT(*) AS n_rows
+        FROM processed_viirs
+        WHERE acq_date > CURRENT_DATE - 31""",
+
+    # articles
+    "latest_articles": """
+        SELECT title, url, image, published_time
+        FROM articles
+        WHERE published_date > CURRENT_DATE - %(n_day)s::integer
+        ORDER BY published_time DESC""",
+
+    # the summaries already made of some article texts (src/summarize.py), content hashes comma-separated
+    "article_summaries": """
+        SELECT DISTINCT ON (content_hash) content_hash, summary
+        FROM articles
+        WHERE content_hash = ANY(string_to_array(%(hashes)s, ','))
+          AND summary_model = %(model)s AND summary IS NOT NULL""",
+
+    # air_quality_idn: the latest reading of every sensor today
+    "latest_air_quality": """
+        WITH RANKED_DATA AS (
+        SELECT
+            address, city, province, air_quality_index, category, updated_at,
+            ROW_NUMBER() OVER (PARTITION BY address, city, province ORDER BY updated_at DESC) AS rn
+        FROM
+            air_quality_idn
+        WHERE
+            DATE(updated_at) = CURRENT_DATE
+        )
+        SELECT
+            *
+        FROM
+            RANKED_DATA
+        WHERE
+            rn = 1
+        ORDER BY
+            air_quality_index DESC""",
+
+    # the same readings with the sensor locations, for the fire pressure (src/proximity.py)
+    "air_quality_sensors": """
+        SELECT DISTINCT ON (address, city, province)
+            address, city, province, lat_sensor, lon_sensor, updated_at, fetched_date
+        FROM air_quality_idn
+        WHERE DATE(updated_at) = CURRENT_DATE
+        ORDER BY address, city, province, updated_at DESC""",
+
+    # idn_gsod
+    "daily_max_temperature": """
+        SELECT date, max_temp_c
+        FROM idn_gsod
+        ORDER BY date DESC""",
+
+    "idn_gsod_version": """
+        SELECT MAX(date) AS last_date, COUNT(*) AS n_rows
+        FROM idn_gsod""",
+
+    # idn_gsod_stations: the station readings of a range of days (src/weather.py)
+    "gsod_station_readings": """
+        SELECT station_id, latitude, longitude, date, max_temp_c, precipitation, wind_speed
+        FROM idn_gsod_stations
+        WHERE date BETWEEN %(first_day)s::date AND %(last_day)s::date""",
+
+    "idn_gsod_last_date": """
+        SELECT MAX(date) AS last_date
+        FROM idn_gsod""",
+}
+
+DRIVERS = ("adbc", "psycopg", "connectorx")
+
+DB_DRIVER = os.environ.get("KABAR_API_DB_DRIVER", "adbc")
+
+_PARAMETER = re.compile(r"%\((\w+)\)s")
+
+
+@functools.lru_cache(maxsize=None)
+def positional(name: str) -> tuple:
+    """
+    Rewrites a named query with the $1, $2, ... placeholders of the Postgres protocol.
+
+    Parameters:
+    - name (str): The query name, a key of QUERIES.
+
+    Returns:
+    - tuple: The statement text, and the parameter names in the order of their placeholders.
+    """
+    order = []
+
+    def placeholder(match):
+        if match.group(1) not in order:
+            order.append(match.group(1))
+        return f"${order.index(match.group(1)) + 1}"
+
+    return _PARAMETER.sub(placeholder, QUERIES[name]), tuple(order)
+
+
+def inline(name: str, params: dict) -> str:
+    """
+    Renders a named query with its parameters quoted as SQL literals, for drivers without bind parameters.
+
+    Parameters:
+    - name (str): The query name, a key of QUERIES.
+    - params (dict): The parameter values.
+
+    Returns:
+    - str: The statement text.
+    """
+    from psycopg import sql
+
+    return _PARAMETER.sub(lambda match: sql.Literal(params[match.group(1)]).as_string(None), QUERIES[name])
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Connections are kept per thread (the Dash server answers callbacks from several threads) and per URI
+_local = threading.local()
+
+
+def _connections() -> dict:
+    if not hasattr(_local, "connections"):
+        _local.connections = {}
+    return _local.connections
+
+
+def _connect(driver: str, uri_connection: str):
+    connections = _connections()
+    key = (driver, uri_connection)
+
+    if key not in connections:
+        if driver == "adbc":
+            import adbc_driver_postgresql.dbapi
+            connection = adbc_driver_postgresql.dbapi.connect(uri_connection, autocommit=True)
+        else:
+            import psycopg
+            connection = psycopg.connect(uri_connection, autocommit=True)
+        # one cursor per query name, each keeping its prepared statement
+        connections[key] = (connection, {})
+
+    return connections[key]
+
+
+def close_connections():
+    """
+    Closes the connections of the current thread.
+    """
+    for connection, cursors in _connections().values():
+        try:
+            for cursor in cursors.values():
+                cursor.close()
+            connection.close()
+        except Exception:
+            pass
+    _connections().clear()
+
+
+def _run(driver: str, name: str, uri_connection: str, params: dict) -> pl.DataFrame:
+    if driver == "connectorx":
+        return pl.read_database_uri(query=inline(name, params), uri=uri_connection)
+
+    connection, cursors = _connect(driver, uri_connection)
+    cursor = cursors.get(name)
+    if cursor is None:
+        cursor = cursors[name] = connection.cursor()
+
+    if driver == "adbc":
+        statement, order = positional(name)
+        cursor.execute(statement, tuple(params[parameter] for parameter in order) or None)
+        return pl.from_arrow(cursor.fetch_arrow_table())
+
+    cursor.execute(QUERIES[name], params, prepare=True)
+    columns = [column.name for column in cursor.description]
+    return pl.DataFrame(cursor.fetchall(), schema=columns, orient="row")
+
+
+@functools.lru_cache(maxsize=None)
+def _runner(name: str):
+    # _run instrumented with the stage of a query, made once per query name
+    return instrumented("query", stage=f"query_{name}")(_run)
+
+
+# SQLSTATEs of a connection closed by the server (class 08, and the shutdowns of class 57 but not 57014, a timeout)
+_SHUTDOWN_STATES = ("57P01", "57P02", "57P03")
+
+
+def _disconnected(driver: str, e: Exception) -> bool:
+    """
+    Tells whether a query failed because its connection is no longer usable, rather than because of the statement,
+    its parameters or a timeout.
+    """
+    if driver == "adbc":
+        from adbc_driver_manager import OperationalError, InterfaceError
+    elif driver == "psycopg":
+        from psycopg import OperationalError, InterfaceError
+    else:
+        # connectorx opens a connection per query
+        return False
+
+    if not isinstance(e, (OperationalError, InterfaceError)):
+        return False
+    sqlstate = getattr(e, "sqlstate", None)
+    return not sqlstate or sqlstate.startswith("08") or sqlstate in _SHUTDOWN_STATES
+
+
+def fetch_query(name: str, uri_connection: str, driver: str = None, **params) -> pl.DataFrame:
+    """
+    Runs a named query of QUERIES.
+
+    Parameters:
+    - name (str): The query name.
+    - uri_connection (str): The connection URI to the Supabase database.
+    - driver (str): "adbc", "psycopg" or "connectorx". Defaults to DB_DRIVER.
+    - params: The parameters of the query, e.g. n_day=7.
+
+    Returns:
+    - pl.DataFrame: The rows of the query, or None if it failed.
+    """
+    driver = driver or DB_DRIVER
+
+    try:
+        if name not in QUERIES:
+            raise KeyError(f"Unknown query: {name}")
+        if driver not in DRIVERS:
+            raise ValueError(f"Unknown database driver: {driver}")
+
+        run = _runner(name)
+        try:
+            return run(driver, name, uri_connection, params)
+        except Exception as e:
+            if not _disconnected(driver, e):
+                raise
+            # the connection was dropped by the server (restart, idle timeout): once more on a new one
+            close_connections()
+            return run(driver, name, uri_connection, params)
+
+    except Exception as e:
+        print(f"An error occurred while running the query {name}: {e}")
+        return None
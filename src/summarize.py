@@ -0,0 +1,288 @@
+import re
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+from src.queries import fetch_query
+from src.metrics import instrumented, count_cache, count_tokens, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Summaries of the news: every article of cleaning_articles gets a short summary in Indonesian from a language model,
+# stored beside it in the articles table (the columns of migrations/005_summarize_articles.sql):
+#   - content_hash   sha256 of the article text. A text already summarized by the same model is not sent again: the
+#                    same article fetched by another keyword or on the next day, or an exact syndicated copy.
+#   - summary        The summary, null if the article was not summarized (over the token budget, or a model error).
+#   - summary_model  The backend name the summary was made with, e.g. "gpt-3.5-turbo-0613/v1".
+#
+# A backend is any object with:
+#   - name (str)                   The model and prompt version, part of the cache key: a new prompt summarizes again.
+#   - max_input_tokens (int)       The article text is cut to this many tokens.
+#   - max_output_tokens (int)      The longest summary asked for.
+#   - summarize(text: str) -> str  Summarizes one text; called from several threads at once.
+# OpenAIBackend calls the chat completions API; StubBackend is a local stand-in with the same interface, so that the
+# throughput and the caching can be measured offline (benchmarks/bench_summarize.py).
+#
+# The calls are made CONCURRENCY at a time, the most recent articles first, until the token budget of the run (the
+# estimated input tokens plus max_output_tokens of every call) is spent. The articles over the budget are left null.
+SUMMARY_COLUMNS = ["content_hash", "summary", "summary_model"]
+
+# Bumped when PROMPT changes, so that the summaries made with the previous prompt are not reused
+PROMPT_VERSION = 1
+
+PROMPT = ("Anda adalah redaktur berita lingkungan. Ringkas berita tentang kebakaran hutan dan lahan berikut dalam dua "
+          "sampai tiga kalimat bahasa Indonesia. Sebutkan lokasi, waktu dan dampaknya bila disebutkan dalam berita.")
+
+CONCURRENCY = 4
+
+# Tokens a run may spend, about 60 articles of MAX_INPUT_TOKENS
+TOKEN_BUDGET = 200_000
+
+MAX_INPUT_TOKENS = 3_000
+MAX_OUTPUT_TOKENS = 200
+
+# About 4 characters per token for the GPT tokenizers
+CHARS_PER_TOKEN = 4
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def content_hash(text: str) -> str:
+    """
+    Returns the sha256 hex digest of an article text, surrounding whitespace ignored.
+    """
+    return hashlib.sha256(text.strip().encode()).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the tokens of a text from its length, without a tokenizer.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """
+    Cuts a text to about max_tokens tokens.
+    """
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+class StubBackend:
+    """
+    Local backend: the lead sentences of the text, after a simulated model latency.
+
+    Parameters:
+    - sentences (int): Sentences kept.
+    - latency (float): Seconds slept per call, standing for the round trip to a model.
+    """
+
+    def __init__(self, sentences: int = 2, latency: float = 0.0, max_input_tokens: int = MAX_INPUT_TOKENS,
+                 max_output_tokens: int = MAX_OUTPUT_TOKENS):
+        self.name = f"stub-{sentences}/v{PROMPT_VERSION}"
+        self.sentences = sentences
+        self.latency = latency
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def summarize(self, text: str) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return truncate(" ".join(_SENTENCE.split(text.strip())[:self.sentences]), self.max_output_tokens)
+
+
+class OpenAIBackend:
+    """
+    Backend calling the OpenAI chat completions API (openai 0.27).
+
+    Parameters:
+    - api_key (str): The OpenAI API key (OPENAI_KEY of the .env).
+    - model (str): The chat model.
+    """
+
+    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo-0613", max_input_tokens: int = MAX_INPUT_TOKENS,
+                 max_output_tokens: int = MAX_OUTPUT_TOKENS):
+        import openai
+
+        self._openai = openai
+        self.name = f"{model}/v{PROMPT_VERSION}"
+        self.api_key = api_key
+        self.model = model
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+
+    def summarize(self, text: str) -> str:
+        response = self._openai.ChatCompletion.create(
+            api_key=self.api_key,
+            model=self.model,
+            messages=[{"role": "system", "content": PROMPT}, {"role": "user", "content": text}],
+            max_tokens=self.max_output_tokens,
+            temperature=0,
+            request_timeout=60,
+        )
+        return response["choices"][0]["message"]["content"].strip()
+
+
+def load_backend(api_key: str, model: str = "gpt-3.5-turbo-0613") -> OpenAIBackend:
+    """
+    Makes the OpenAI backend of the ETL.
+
+    Returns:
+    - OpenAIBackend: The backend, or None if there is no API key or openai is not installed.
+    """
+    if not api_key:
+        print("OPENAI_KEY is not set, the articles are not summarized")
+        return None
+
+    try:
+        return OpenAIBackend(api_key, model)
+    except ImportError:
+        print("openai is not installed, the articles are not summarized")
+        return None
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Summaries already made, by content hash and backend name. The ETL looks them up in the articles table, where they
+# are stored with the articles; MemoryStore keeps them in a dict for the offline runs.
+class MemoryStore:
+    """
+    Summaries kept in memory, for the offline runs and the benchmarks.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+
+    def lookup(self, hashes: list, model: str) -> dict:
+        return {h: self.summaries[(h, model)] for h in hashes if (h, model) in self.summaries}
+
+    def save(self, summaries: dict, model: str):
+        self.summaries.update(((h, model), summary) for h, summary in summaries.items())
+
+
+class DatabaseStore:
+    """
+    The summaries of the articles table, read with the article_summaries query. Nothing is saved: the summaries are
+    written with the articles by the ETL.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Supabase database.
+    """
+
+    def __init__(self, uri_connection: str):
+        self.uri_connection = uri_connection
+
+    def lookup(self, hashes: list, model: str) -> dict:
+        if not hashes:
+            return {}
+        rows = fetch_query("article_summaries", self.uri_connection, hashes=",".join(hashes), model=model)
+        if rows is None:
+            # summarized again rather than not at all
+            return {}
+        return dict(zip(rows["content_hash"].to_list(), rows["summary"].to_list()))
+
+    def save(self, summaries: dict, model: str):
+        pass
+
+
+def _summarize_one(backend, text: str) -> str:
+    try:
+        return backend.summarize(truncate(text, backend.max_input_tokens))
+    except Exception as e:
+        print(f"An error occurred while summarizing an article with {backend.name}: {e}")
+        return None
+
+
+@instrumented("transform")
+def summarize_articles(df: pl.DataFrame, backend, store, concurrency: int = CONCURRENCY,
+                       token_budget: int = TOKEN_BUDGET) -> pl.DataFrame:
+    """
+    Summarizes the articles whose text was not summarized by the backend yet.
+
+    Parameters:
+    - df (pl.DataFrame): The articles, as returned by cleaning_articles (or dedup_articles).
+    - backend: The model backend, e.g. OpenAIBackend or StubBackend. If None, the SUMMARY_COLUMNS are added with null
+               summaries.
+    - store: The summaries already made, a DatabaseStore or MemoryStore. The new summaries are saved to it.
+    - concurrency (int): Calls to the backend at the same time.
+    - token_budget (int): Estimated tokens the calls of this run may spend, input and output.
+
+    Returns:
+    - pl.DataFrame: The articles, in the same order, with the SUMMARY_COLUMNS added (replaced if already there).
+    """
+    df = df.drop([column for column in SUMMARY_COLUMNS if column in df.columns])
+    texts = df["article_text"].fill_null("").to_list()
+    hashes = [content_hash(text) for text in texts]
+
+    if backend is None or df.is_empty():
+        return df.with_columns(pl.Series("content_hash", hashes, dtype=pl.Utf8),
+                               pl.lit(None, dtype=pl.Utf8).alias("summary"),
+                               pl.lit(None, dtype=pl.Utf8).alias("summary_model"))
+
+    # one call per distinct text, the most recent articles first
+    order = df.with_row_count("row").sort("published_time", descending=True, nulls_last=True)["row"].to_list()
+    first_text = {}
+    for row in order:
+        first_text.setdefault(hashes[row], texts[row])
+
+    summaries = store.lookup(list(first_text), backend.name)
+    for h in first_text:
+        count_cache("article_summaries", h in summaries)
+
+    pending, spent = [], 0
+    for h, text in first_text.items():
+        if h in summaries:
+            continue
+        cost = min(estimate_tokens(text), backend.max_input_tokens) + backend.max_output_tokens
+        if spent + cost > token_budget:
+            continue
+        pending.append(h)
+        spent += cost
+
+    deferred = len(first_text) - len(summaries) - len(pending)
+    if deferred:
+        print(f"{deferred} article texts over the token budget of {token_budget:,}, left for the next run")
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        made = dict(zip(pending, executor.map(lambda h: _summarize_one(backend, first_text[h]), pending)))
+    made = {h: summary for h, summary in made.items() if summary}
+    count_tokens(backend.name, spent)
+
+    store.save(made, backend.name)
+    summaries.update(made)
+
+    column = [summaries.get(h) for h in hashes]
+    return df.with_columns(
+        pl.Series("content_hash", hashes, dtype=pl.Utf8),
+        pl.Series("summary", column, dtype=pl.Utf8),
+        pl.Series("summary_model", [backend.name if summary is not None else None for summary in column],
+                  dtype=pl.Utf8),
+    )
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+    from src.procedures import fetch_articles, cleaning_articles
+
+    parser = argparse.ArgumentParser(description="Fetches the recent news articles and prints their summaries, "
+                                                 "without storing them.")
+    parser.add_argument("--keyword", default="kebakaran hutan")
+    parser.add_argument("--max-results", type=int, default=10)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--stub", action="store_true", help="summarize with the local StubBackend")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    backend = StubBackend() if args.stub else load_backend(config.get("OPENAI_KEY"))
+    articles = cleaning_articles(fetch_articles([args.keyword], args.max_results, args.days))
+    if articles is not None:
+        summarized = summarize_articles(articles, backend, DatabaseStore(config.get("CONNECTION_URI")))
+        for title, summary in summarized.select("title", "summary").iter_rows():
+            print(f"{title}\n    {summary}\n")
+    write_summary(args.metrics_json)
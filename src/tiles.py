@@ -0,0 +1,315 @@
+import gzip
+import math
+import threading
+
+import numpy as np
+import polars as pl
+import geopandas as gpd
+import shapely
+import mapbox_vector_tile
+
+from src.queries import fetch_query
+from src.metrics import instrumented
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Mapbox Vector Tiles of the hotspots of processed_viirs and of the district and province boundaries, served by the
+# Dash server under /tiles/{z}/{x}/{y}.pbf. Tiles use the usual XYZ scheme in Web Mercator (EPSG:3857).
+#
+# Each tile carries three layers:
+#   - hotspots: the detections of the window, merged into clusters (count, frp_sum, frp_max) below CLUSTER_MAX_ZOOM
+#   - provinces: the province outlines of data/batas-provinsi.geojson
+#   - districts: the district outlines of data/IndonesianCitiesDistrictsUpdated.json, from DISTRICTS_MIN_ZOOM on
+TILE_EXTENT = 4096
+MAX_ZOOM = 16
+CLUSTER_MAX_ZOOM = 10
+DISTRICTS_MIN_ZOOM = 6
+
+# Size of a hotspot cluster cell, in tile units (TILE_EXTENT units per tile side, 256 px)
+CLUSTER_CELL = 128
+
+# Fraction of the tile size added around it before clipping, so that outlines do not stop at the tile edges
+TILE_BUFFER = 1 / 64
+
+EARTH_HALF_CIRCUMFERENCE = 20037508.342789244
+
+# The boundary files ship with the code, a new version of this module is enough to invalidate their tiles
+BOUNDARIES_VERSION = "1"
+
+
+def lonlat_to_mercator(longitude, latitude) -> tuple:
+    """
+    Projects WGS84 coordinates to Web Mercator meters.
+
+    Parameters:
+    - longitude (np.ndarray | float): Longitudes, in degrees.
+    - latitude (np.ndarray | float): Latitudes, in degrees.
+
+    Returns:
+    - tuple: The x and y coordinates, in meters.
+    """
+    x = np.asarray(longitude, dtype=np.float64) * EARTH_HALF_CIRCUMFERENCE / 180.0
+    y = np.log(np.tan((90.0 + np.asarray(latitude, dtype=np.float64)) * math.pi / 360.0)) * 6378137.0
+    return x, y
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Returns the Web Mercator bounds of an XYZ tile.
+
+    Parameters:
+    - z (int): Zoom level.
+    - x (int): Column, from the west.
+    - y (int): Row, from the north.
+
+    Returns:
+    - tuple: (min_x, min_y, max_x, max_y), in meters.
+    """
+    size = 2 * EARTH_HALF_CIRCUMFERENCE / (1 << z)
+    min_x = -EARTH_HALF_CIRCUMFERENCE + x * size
+    max_y = EARTH_HALF_CIRCUMFERENCE - y * size
+
+    return min_x, max_y - size, min_x + size, max_y
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class BoundaryLayers:
+    """
+    District and province outlines, projected to Web Mercator and indexed once, clipped and simplified per tile.
+
+    Parameters:
+    - districts_path (str): The districts GeoJSON, with the district name in "id" and its province in "provinsi".
+    - provinces_path (str): The provinces GeoJSON, with the province name in "provinsi".
+    """
+
+    def __init__(self, districts_path: str = "./data/IndonesianCitiesDistrictsUpdated.json",
+                 provinces_path: str = "./data/batas-provinsi.geojson"):
+        self.layers = {
+            "districts": gpd.read_file(districts_path).to_crs(epsg=3857).rename(columns={"id": "district",
+                                                                                          "provinsi": "province"}),
+            "provinces": gpd.read_file(provinces_path).to_crs(epsg=3857).rename(columns={"provinsi": "province"}),
+        }
+        for gdf in self.layers.values():
+            gdf.sindex
+
+    def features(self, layer: str, bounds: tuple) -> list:
+        """
+        Returns the outlines of a layer crossing a tile, clipped to it and simplified to its resolution.
+
+        Parameters:
+        - layer (str): "districts" or "provinces".
+        - bounds (tuple): The tile bounds, as returned by tile_bounds.
+
+        Returns:
+        - list: Features as dicts with a shapely geometry (in meters) and properties.
+        """
+        gdf = self.layers[layer]
+        min_x, min_y, max_x, max_y = bounds
+        buffer = (max_x - min_x) * TILE_BUFFER
+        clip_box = (min_x - buffer, min_y - buffer, max_x + buffer, max_y + buffer)
+
+        hits = gdf.iloc[gdf.sindex.query(shapely.box(*clip_box))]
+        if hits.empty:
+            return []
+
+        # half a tile unit is below what the tile can encode anyway
+        tolerance = (max_x - min_x) / TILE_EXTENT / 2
+        geometries = shapely.simplify(shapely.clip_by_rect(hits.geometry.values, *clip_box), tolerance)
+        properties = hits.drop(columns="geometry").to_dict("records")
+
+        return [{"geometry": geometry, "properties": props}
+                for geometry, props in zip(geometries, properties) if not geometry.is_empty]
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+class HotspotWindow:
+    """
+    The hotspots of one timeframe projected to Web Mercator and sorted by x, so that the hotspots of a tile are
+    found with two binary searches and a mask.
+
+    Parameters:
+    - hotspots (pl.DataFrame): Hotspots with latitude, longitude, acq_date, frp, confidence, second_adm and first_adm.
+    """
+
+    def __init__(self, hotspots: pl.DataFrame):
+        x, y = lonlat_to_mercator(hotspots["longitude"].to_numpy(), hotspots["latitude"].to_numpy())
+        order = np.argsort(x, kind="stable")
+
+        self.x, self.y = x[order], y[order]
+        self.frp = hotspots["frp"].cast(pl.Float64).fill_null(0).to_numpy()[order]
+        self.date = hotspots["acq_date"].cast(pl.Utf8).to_numpy()[order]
+        self.confidence = hotspots["confidence"].to_numpy()[order]
+        self.district = hotspots["second_adm"].to_numpy()[order]
+        self.province = hotspots["first_adm"].to_numpy()[order]
+
+    def __len__(self):
+        return len(self.x)
+
+    def features(self, z: int, bounds: tuple) -> list:
+        """
+        Returns the hotspots of a tile: one point per detection from CLUSTER_MAX_ZOOM on, clusters below.
+
+        Parameters:
+        - z (int): Zoom level of the tile.
+        - bounds (tuple): The tile bounds, as returned by tile_bounds.
+
+        Returns:
+        - list: Features as dicts with a shapely Point (in meters) and properties.
+        """
+        min_x, min_y, max_x, max_y = bounds
+        start, stop = np.searchsorted(self.x, [min_x, max_x])
+        inside = np.flatnonzero((self.y[start:stop] >= min_y) & (self.y[start:stop] < max_y)) + start
+
+        if inside.size == 0:
+            return []
+
+        if z >= CLUSTER_MAX_ZOOM:
+            return [{"geometry": shapely.Point(self.x[i], self.y[i]),
+                     "properties": {"date": self.date[i], "frp": round(float(self.frp[i]), 2),
+                                    "confidence": self.confidence[i], "district": self.district[i],
+                                    "province": self.province[i]}}
+                    for i in inside]
+
+        # clusters: hotspots are grouped by cell of the tile grid, placed at their mean position
+        cell_size = (max_x - min_x) * CLUSTER_CELL / TILE_EXTENT
+        cells_per_side = TILE_EXTENT // CLUSTER_CELL
+        column = np.minimum(((self.x[inside] - min_x) // cell_size).astype(np.int64), cells_per_side - 1)
+        row = np.minimum(((self.y[inside] - min_y) // cell_size).astype(np.int64), cells_per_side - 1)
+        cells, cell_of = np.unique(row * cells_per_side + column, return_inverse=True)
+
+        count = np.bincount(cell_of)
+        mean_x = np.bincount(cell_of, weights=self.x[inside]) / count
+        mean_y = np.bincount(cell_of, weights=self.y[inside]) / count
+        frp_sum = np.bincount(cell_of, weights=self.frp[inside])
+        frp_max = np.zeros(len(cells))
+        np.maximum.at(frp_max, cell_of, self.frp[inside])
+
+        return [{"geometry": shapely.Point(mean_x[c], mean_y[c]),
+                 "properties": {"count": int(count[c]), "frp_sum": round(float(frp_sum[c]), 2),
+                                "frp_max": round(float(frp_max[c]), 2)}}
+                for c in range(len(cells))]
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+_boundaries = None
+_boundaries_lock = threading.Lock()
+
+_windows = {}
+_windows_lock = threading.Lock()
+
+
+def boundary_layers() -> BoundaryLayers:
+    """
+    Returns the boundary layers of this process, read on first use.
+    """
+    global _boundaries
+    with _boundaries_lock:
+        if _boundaries is None:
+            _boundaries = BoundaryLayers()
+    return _boundaries
+
+
+def hotspot_window(n_day: int, version: str, uri_connection: str) -> HotspotWindow:
+    """
+    Returns the hotspots of the last n_day days, fetched once per data version of processed_viirs by one worker of the
+    host (see src.cache.FrameCache).
+
+    Parameters:
+    - n_day (int): Length of the window, in days.
+    - version (str): The data version of processed_viirs (see src.cache.fetch_data_version).
+    - uri_connection (str): The connection URI to the Supabase database.
+
+    Returns:
+    - HotspotWindow: The hotspots, or None if they could not be fetched.
+    """
+    with _windows_lock:
+        cached = _windows.get(n_day)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    from src.cache import SHARED_FRAMES
+
+    hotspots = SHARED_FRAMES.get_or_fetch(f"tile_window-{int(n_day)}", version,
+                                          lambda: fetch_query("tile_window", uri_connection, n_day=int(n_day)))
+
+    if hotspots is None:
+        return None
+
+    window = HotspotWindow(hotspots)
+    with _windows_lock:
+        _windows[n_day] = (version, window)
+
+    return window
+
+
+@instrumented("chart", stage="render_tile")
+def render_tile(z: int, x: int, y: int, window: HotspotWindow = None, boundaries: BoundaryLayers = None) -> bytes:
+    """
+    Encodes one gzipped vector tile.
+
+    Parameters:
+    - z (int): Zoom level.
+    - x (int): Column, from the west.
+    - y (int): Row, from the north.
+    - window (HotspotWindow): The hotspots to include. If None, the hotspots layer is left out.
+    - boundaries (BoundaryLayers): The boundaries to include. Defaults to boundary_layers().
+
+    Returns:
+    - bytes: The gzipped Mapbox Vector Tile.
+    """
+    boundaries = boundaries or boundary_layers()
+    bounds = tile_bounds(z, x, y)
+
+    layers = [{"name": "provinces", "features": boundaries.features("provinces", bounds)}]
+    if z >= DISTRICTS_MIN_ZOOM:
+        layers.append({"name": "districts", "features": boundaries.features("districts", bounds)})
+    if window is not None:
+        layers.append({"name": "hotspots", "features": window.features(z, bounds)})
+
+    tile = mapbox_vector_tile.encode([layer for layer in layers if layer["features"]],
+                                     default_options={"quantize_bounds": bounds, "extents": TILE_EXTENT,
+                                                      "y_coord_down": False})
+
+    return gzip.compress(tile, compresslevel=6)
+
+
+def get_tile(z: int, x: int, y: int, n_day: int = None, uri_connection: str = None, cache=None) -> bytes:
+    """
+    Returns a tile of the /tiles endpoint, from the tile cache when it was already made from the current data.
+
+    Parameters:
+    - z, x, y (int): The tile coordinates, already checked with valid_tile.
+    - n_day (int): Length of the hotspot window, in days. If None, the tile only has the boundaries.
+    - uri_connection (str): The connection URI to the Supabase database, needed with n_day.
+    - cache (TileCache): Where the tiles are kept. If None, the tile is rendered every time.
+
+    Returns:
+    - bytes: The gzipped Mapbox Vector Tile, or None if the hotspots could not be fetched.
+    """
+    from src.cache import fetch_data_version
+
+    if n_day is None:
+        if cache is None:
+            return render_tile(z, x, y)
+        return cache.get_or_render("boundaries", BOUNDARIES_VERSION, z, x, y, lambda: render_tile(z, x, y))
+
+    name = f"viirs-{n_day}"
+    version = fetch_data_version("processed_viirs", uri_connection=uri_connection)
+    cached = cache is not None and version is not None
+
+    # the window is only needed to render a tile missing from the cache
+    if cached:
+        tile = cache.get(name, version, z, x, y)
+        if tile is not None:
+            return tile
+
+    window = hotspot_window(n_day, version, uri_connection)
+    if window is None:
+        # not rendered without its hotspots: such a tile would be cached as the tile of this version
+        return None
+
+    tile = render_tile(z, x, y, window=window)
+    if cached:
+        cache.put(name, version, z, x, y, tile)
+
+    return tile
@@ -0,0 +1,82 @@
+import time
+import argparse
+
+from src.cache import RenderCache, fetch_data_version, forget_data_version
+from src.procedures import generate_density_map, cached_chart_aggregates, render_calendar
+from src.metrics import instrumented, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Warm-up of the dashboard caches, the last step of the ETL: everything the dashboard shows for a new data version is
+# made before the first visit, instead of by the first user picking each timeframe.
+#
+#     python -m src.warmup
+#
+# For each timeframe of WARM_TIMEFRAMES:
+#   - the hotspots of the density map query, written to the frames shared by the workers (src/cache.py.FrameCache),
+#     which generate_density_map and the /api/v1 routes read
+#   - the counts of the line chart, the fire counters and the top five provinces and districts, written to the render
+#     cache (procedures.cached_chart_aggregates)
+# and the calendar of the daily max temperatures, written to the render cache for the idn_gsod version.
+#
+# It runs on the dashboard host, from the working directory of the dashboard, so that it writes the caches the
+# workers read (CACHE_DIR and SHARED_DIR, or KABAR_API_CACHE_DIR and KABAR_API_SHARED_DIR).
+WARM_TIMEFRAMES = (7, 15, 30)
+
+
+@instrumented("load", stage="warm_dashboard")
+def warm_dashboard(uri_connection: str, timeframes: tuple = WARM_TIMEFRAMES, cache: RenderCache = None) -> dict:
+    """
+    Precomputes the dashboard views of the current data versions.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Supabase database.
+    - timeframes (tuple): The timeframes of the density map, in days.
+    - cache (RenderCache): The render cache of the dashboard. Defaults to the one in CACHE_DIR.
+
+    Returns:
+    - dict: {view: seconds} of the views warmed, e.g. "density_map-7". A view that failed is left out.
+    """
+    cache = cache or RenderCache()
+    warmed = {}
+
+    # the ETL just appended rows: the versions are asked again
+    forget_data_version("processed_viirs")
+    forget_data_version("idn_gsod")
+
+    for n_day in timeframes:
+        start = time.perf_counter()
+        try:
+            _, data, _, _ = generate_density_map(n_day=n_day, uri_connection=uri_connection)
+            cached_chart_aggregates(data, n_day, cache)
+        except Exception as e:
+            print(f"An error occurred while warming the {n_day}-day timeframe: {e}")
+            continue
+        warmed[f"density_map-{n_day}"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    version = fetch_data_version("idn_gsod", uri_connection=uri_connection)
+    if version is None:
+        print("The idn_gsod version could not be read, the calendar is not warmed")
+    else:
+        try:
+            cache.get_or_render("calendar", version, lambda: render_calendar(uri_connection))
+            warmed["calendar"] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            print(f"An error occurred while warming the calendar: {e}")
+
+    return warmed
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Precomputes the dashboard views after an ETL run.")
+    parser.add_argument("--days", type=int, nargs="+", default=list(WARM_TIMEFRAMES),
+                        help="timeframes of the density map, in days")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    for view, seconds in warm_dashboard(config.get("CONNECTION_URI"), tuple(args.days)).items():
+        print(f"{view:<22}{seconds:>8.2f} s")
+    write_summary(args.metrics_json)
@@ -0,0 +1,202 @@
+import io
+import argparse
+import datetime
+
+import numpy as np
+import polars as pl
+from scipy.spatial import cKDTree
+
+from src.queries import fetch_query
+from src.proximity import unit_vectors, chord_to_km
+from src.metrics import instrumented, write_summary
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+# Weather of the detections: every detection of processed_viirs is tagged with the nearest GSOD station reporting on
+# its acquisition day, the distance to it, and that day's max temperature, precipitation and wind speed at the station
+# (the columns of migrations/003_weather_processed_viirs.sql).
+#
+# The stations are indexed with one KD-tree per day, over the stations having a reading that day (about 90 for
+# Indonesia), on the unit sphere as in src/proximity.py. A batch is tagged with one nearest-neighbor query per
+# acquisition day, about 6 ms for a daily batch of 10,000 detections.
+#
+# GSOD is published with a delay of a few days, so the detections of the daily ETL usually have no readings yet and
+# are left null: `python -m src.weather` fills them in once load_gsod has appended their days.
+WEATHER_COLUMNS = ["gsod_station", "gsod_station_km", "gsod_max_temp_c", "gsod_precipitation", "gsod_wind_speed"]
+
+# readings of idn_gsod_stations (src/gsod.py.station_daily): the measurements copied to the detections
+READING_COLUMNS = {"max_temp_c": "gsod_max_temp_c", "precipitation": "gsod_precipitation",
+                   "wind_speed": "gsod_wind_speed"}
+
+_WEATHER_SCHEMA = {"gsod_station": pl.Utf8, "gsod_station_km": pl.Float32, "gsod_max_temp_c": pl.Float32,
+                   "gsod_precipitation": pl.Float32, "gsod_wind_speed": pl.Float32}
+
+
+class StationIndex:
+    """
+    Daily GSOD station readings, with a KD-tree over the stations of each day.
+
+    Parameters:
+    - readings (pl.DataFrame): One row per station and day with the columns station_id, latitude, longitude, date and
+                               the READING_COLUMNS, as returned by station_daily or the gsod_station_readings query.
+    """
+
+    def __init__(self, readings: pl.DataFrame):
+        readings = readings.drop_nulls(["station_id", "latitude", "longitude", "date"]).sort("date")
+        dates = readings["date"].to_physical().to_numpy()
+        days, starts = np.unique(dates, return_index=True)
+        ends = np.append(starts[1:], len(dates))
+        points = unit_vectors(readings["latitude"].to_numpy(), readings["longitude"].to_numpy())
+
+        # days since 1970-01-01: (KD-tree of the stations of the day, row of its first station in self.readings)
+        self.days = {int(day): (cKDTree(points[start:end]), start) for day, start, end in zip(days, starts, ends)}
+
+        # the readings in the order of the trees, with a last row of nulls for the locations without a station
+        self.readings = pl.concat([
+            readings.select(pl.col("station_id").alias("gsod_station"),
+                            *[pl.col(column).alias(alias) for column, alias in READING_COLUMNS.items()]),
+            pl.DataFrame({"gsod_station": [None]}, schema={"gsod_station": pl.Utf8}),
+        ], how="diagonal")
+
+    def __len__(self):
+        return len(self.days)
+
+    def nearest(self, days: np.ndarray, latitude: np.ndarray, longitude: np.ndarray) -> tuple:
+        """
+        Finds the nearest station reporting on the day of each location.
+
+        Parameters:
+        - days (np.ndarray): The days, as integer days since 1970-01-01.
+        - latitude (np.ndarray): Latitudes, in degrees.
+        - longitude (np.ndarray): Longitudes, in degrees.
+
+        Returns:
+        - tuple: The rows of self.readings (the last, null row when no station reported on the day) and the distances
+                 in km (NaN when no station reported).
+        """
+        rows = np.full(len(days), len(self.readings) - 1, dtype=np.int64)
+        distance = np.full(len(days), np.nan)
+        points = unit_vectors(latitude, longitude)
+
+        for day in np.unique(days):
+            if int(day) not in self.days:
+                continue
+            tree, start = self.days[int(day)]
+            on_day = days == day
+            chord, station = tree.query(points[on_day], k=1)
+            rows[on_day] = start + station
+            distance[on_day] = chord_to_km(chord)
+
+        return rows, distance
+
+
+@instrumented("transform")
+def enrich_weather(df: pl.DataFrame, stations: StationIndex) -> pl.DataFrame:
+    """
+    Tags the detections with their nearest GSOD station and its readings of the acquisition day.
+
+    Parameters:
+    - df (pl.DataFrame): The detections, with latitude, longitude and acq_date columns, e.g. as returned by
+                         cleaning_fetched_data.
+    - stations (StationIndex): The station readings of the days of the detections. If None, the WEATHER_COLUMNS are
+                               added empty.
+
+    Returns:
+    - pl.DataFrame: The detections, in the same order, with the WEATHER_COLUMNS added (replaced if already there).
+    """
+    df = df.drop([column for column in WEATHER_COLUMNS if column in df.columns])
+    if stations is None or df.is_empty():
+        return df.with_columns(pl.lit(None, dtype=dtype).alias(column) for column, dtype in _WEATHER_SCHEMA.items())
+
+    rows, distance = stations.nearest(df["acq_date"].to_physical().to_numpy(), df["latitude"].to_numpy(),
+                                      df["longitude"].to_numpy())
+    weather = stations.readings[rows].with_columns(pl.Series("gsod_station_km", distance.round(2), nan_to_null=True))
+
+    return df.hstack(weather.select(WEATHER_COLUMNS).cast(_WEATHER_SCHEMA).get_columns())
+
+
+def fetch_station_readings(first_day: datetime.date, last_day: datetime.date, uri_connection: str) -> StationIndex:
+    """
+    Reads the station readings of a range of days from idn_gsod_stations.
+
+    Returns:
+    - StationIndex: The indexed readings, or None if the query failed.
+    """
+    readings = fetch_query("gsod_station_readings", uri_connection, first_day=first_day, last_day=last_day)
+    if readings is None:
+        return None
+
+    return StationIndex(readings)
+
+# ----------------------------------------------------- ******************************** -----------------------------------------------------
+@instrumented("load")
+def fill_weather(uri_connection: str, n_day: int = 30) -> int:
+    """
+    Tags the detections of the last n_day days that have no weather yet, with the station readings loaded since.
+
+    Parameters:
+    - uri_connection (str): The connection URI to the Postgres (Supabase) database.
+    - n_day (int): How many days back the detections are looked at.
+
+    Returns:
+    - int: The number of detections updated, or None if it failed.
+    """
+    import psycopg2
+
+    pending = fetch_query("weather_pending", uri_connection, n_day=n_day)
+    if pending is None:
+        return None
+    if pending.is_empty():
+        return 0
+
+    stations = fetch_station_readings(pending["acq_date"].min(), pending["acq_date"].max(), uri_connection)
+    if stations is None:
+        return None
+
+    enriched = enrich_weather(pending, stations).drop_nulls("gsod_station")
+    if enriched.is_empty():
+        return 0
+
+    buffer = io.BytesIO()
+    enriched.write_csv(buffer)
+    buffer.seek(0)
+
+    try:
+        with psycopg2.connect(uri_connection) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TEMPORARY TABLE weather_batch (
+                        latitude DOUBLE PRECISION, longitude DOUBLE PRECISION, acq_date DATE, acq_time INTEGER,
+                        gsod_station TEXT, gsod_station_km REAL, gsod_max_temp_c REAL, gsod_precipitation REAL,
+                        gsod_wind_speed REAL
+                    ) ON COMMIT DROP""")
+                cursor.copy_expert(f"COPY weather_batch ({', '.join(enriched.columns)}) FROM STDIN "
+                                   "WITH (FORMAT csv, HEADER true)", buffer)
+                cursor.execute(f"""
+                    UPDATE processed_viirs AS p
+                    SET {', '.join(f'{column} = w.{column}' for column in WEATHER_COLUMNS)}
+                    FROM weather_batch AS w
+                    WHERE p.acq_date = w.acq_date AND p.acq_time = w.acq_time
+                      AND p.latitude = w.latitude AND p.longitude = w.longitude
+                      AND p.gsod_station IS NULL""")
+                updated = cursor.rowcount
+        connection.close()
+
+    except Exception as e:
+        print(f"An error occurred while filling the weather of the detections: {e}")
+        return None
+
+    return updated
+
+
+if __name__ == "__main__":
+    from dotenv import dotenv_values
+
+    parser = argparse.ArgumentParser(description="Tags the recent detections of processed_viirs with the readings of "
+                                                 "their nearest GSOD station.")
+    parser.add_argument("--days", type=int, default=30, help="detections of the last DAYS days are looked at")
+    parser.add_argument("--metrics-json", help="where the metrics summary of the run is written")
+    args = parser.parse_args()
+
+    config = dotenv_values("./.env")
+    print(f"{fill_weather(config.get('CONNECTION_URI'), n_day=args.days)} detections updated")
+    write_summary(args.metrics_json)